@@ -0,0 +1,318 @@
+# ASGI entry point.
+#
+# The Flask app in server.py is synchronous, so every worker thread sits idle
+# during each Atlas round trip. This module serves the hot routes (question
+# fetches, pair sampling, vote counters and answer leaderboards) with async
+# handlers on pymongo's AsyncMongoClient, so one process can keep hundreds of
+# requests in flight. Every other route falls through to the Flask app via
+# asgiref's WsgiToAsgi adapter, so both entry points expose the same API.
+#
+#   pip3 install uvicorn
+#   uvicorn asgi:app --host 0.0.0.0 --port 8000
+#
+# The handlers reuse server.py's pipelines and formatting helpers, and share
+# the in-process question cache, pair pools and counter buffer.
+
+import hashlib
+import json
+import re
+import time
+from urllib.parse import parse_qsl
+
+from asgiref.wsgi import WsgiToAsgi
+from bson.objectid import ObjectId
+
+from counters import counter_buffer
+from db import get_async_db, close_async_client
+from logs import get_logger
+from metrics import record_request
+from pair_sampler import ANSWER_FIELDS, POLICIES as PAIR_POLICIES, pair_prefetcher, pair_sampler
+from question_cache import question_cache, local_midnight, parse_question_dates, questions_body, relative_to_today
+from scoring import counter_update
+from serialization import dumps
+import server
+
+log = get_logger("asgi")
+
+CORS_HEADERS = [
+    (b"access-control-allow-origin", b"*"),
+    (b"access-control-expose-headers", b"X-Next-Cursor"),
+]
+
+
+class Request:
+    def __init__(self, scope, body):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.args = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+        self.headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body) if self.body else {}
+
+
+def json_response(payload, status=200, headers=None):
+    return status, dumps(payload), headers or {}
+
+
+def error(message, status):
+    return json_response({"error": message}, status)
+
+
+def conditional(request, body, cache_control):
+    """200 with an ETag, or 304 if the client already has this body."""
+    etag = '"%s"' % hashlib.sha1(body).hexdigest()
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag in request.headers.get("if-none-match", ""):
+        return 304, b"", headers
+    return 200, body, headers
+
+
+async def cached_questions(dates):
+    today, found, missing = question_cache.lookup(dates)
+    if missing:
+        docs = await get_async_db()["questions"].find({"date": {"$in": missing}}).to_list(None)
+        found.update(question_cache.store(today, missing, docs))
+    return found
+
+
+async def pool_for(question_id):
+    """pair_sampler's pool for a question, loaded with the async driver."""
+    pool = pair_sampler.cached(question_id)
+    if pool is not None:
+        return pool
+    db = get_async_db()
+    question = await db["questions"].find_one({"_id": question_id})
+    if question is None:
+        return None
+    answers = await db["answers"].find({"question_id": question_id}, ANSWER_FIELDS).to_list(None)
+    return pair_sampler.install(question, answers)
+
+
+def day_question(days_ago, label):
+    async def handler(request):
+        date = local_midnight(days_ago=days_ago)
+        found = await cached_questions([date])
+        if date not in found:
+            return error(f"No question found for {label}", 404)
+        return conditional(request, found[date].body, question_cache.cache_control([date], True, relative=True))
+    return handler
+
+
+async def get_questions(request):
+    try:
+        dates = parse_question_dates(request.args)
+    except ValueError as e:
+        return error(f"Invalid date range: {e}", 400)
+    body, complete = questions_body(dates, await cached_questions(dates))
+    return conditional(request, body, question_cache.cache_control(dates, complete, relative_to_today(request.args)))
+
+
+async def get_pair(request, question_id):
+    try:
+        object_id = ObjectId(question_id)
+    except Exception:
+        return error("Invalid question_id format", 400)
+    policy = request.args.get("policy")
+    if policy is not None and policy not in PAIR_POLICIES:
+        return error(f"Unknown policy, expected one of {', '.join(PAIR_POLICIES)}", 400)
+
+    pool = await pool_for(object_id)
+    if pool is None:
+        return error("Question not found", 404)
+    answers = pool.sample(policy or pair_sampler.default_policy)
+    return json_response(server.shape_pair(pool.question, answers))
+
+
+async def get_pairs(request, question_id):
+    try:
+        object_id = ObjectId(question_id)
+        n = int(request.args.get("n", 10))
+        user_id = request.args.get("user_id")
+        user_oid = ObjectId(user_id) if user_id else None
+    except Exception:
+        return error("Invalid question_id, n or user_id", 400)
+    policy = request.args.get("policy")
+    if policy is not None and policy not in PAIR_POLICIES:
+        return error(f"Unknown policy, expected one of {', '.join(PAIR_POLICIES)}", 400)
+
+    # Load the pool without blocking the loop; take() then stays in memory.
+    if await pool_for(object_id) is None:
+        return error("Question not found", 404)
+    n = max(1, min(n, server.MAX_PAIRS_PER_REQUEST))
+    session = request.args.get("session") or user_id
+    question_doc, pairs = pair_prefetcher.take(object_id, n, user_id=user_oid, session=session, policy_name=policy)
+    return json_response({"pairs": [server.shape_pair(question_doc, pair) for pair in pairs]})
+
+
+def increment(field, message):
+    async def handler(request, answer_id):
+        object_id = ObjectId(answer_id)
+        if counter_buffer is not None:
+            counter_buffer.add(object_id, **{field: 1})
+            server.answer_counted(object_id, **{field: 1})
+            return json_response({"message": f"{message} increment queued"}, 202)
+
+        result = await get_async_db()["answers"].update_one(
+            {"_id": object_id}, counter_update(**{field: 1}))
+        if result.matched_count == 0:
+            return error("Answer not found", 404)
+        server.answer_counted(object_id, **{field: 1})
+        return json_response({"message": f"{message} incremented"})
+    return handler
+
+
+async def record_matchup(request, question_id):
+    data = request.json()
+    for f in ["winner_id", "loser_id"]:
+        if f not in data:
+            return error(f"Missing required field: {f}", 400)
+    try:
+        question_oid = ObjectId(question_id)
+        winner_oid = ObjectId(data["winner_id"])
+        loser_oid = ObjectId(data["loser_id"])
+    except Exception:
+        return error("Invalid question_id, winner_id or loser_id format", 400)
+    if winner_oid == loser_oid:
+        return error("winner_id and loser_id must be different answers", 400)
+
+    answers_col = get_async_db()["answers"]
+    valid = pair_sampler.contains(question_oid, [winner_oid, loser_oid]) or await answers_col.count_documents({
+        "_id": {"$in": [winner_oid, loser_oid]},
+        "question_id": question_oid
+    }) == 2
+    if not valid:
+        return error("Both answers must belong to this question", 404)
+
+    if counter_buffer is not None:
+        counter_buffer.add(winner_oid, votes=1, appearances=1)
+        counter_buffer.add(loser_oid, appearances=1)
+        status = 202
+    else:
+        await answers_col.bulk_write(server.matchup_operations(winner_oid, loser_oid), ordered=False)
+        status = 200
+    server.answer_counted(winner_oid, votes=1, appearances=1)
+    server.answer_counted(loser_oid, appearances=1)
+
+    result = {"message": "Matchup recorded"}
+    if data.get("next_pair"):
+        pool = await pool_for(question_oid)
+        if pool is not None:
+            answers = pool.sample(pair_sampler.default_policy)
+            result["next_pair"] = server.shape_pair(pool.question, answers)
+    return json_response(result, status)
+
+
+async def answer_leaderboard(request, match):
+    try:
+        score, limit, after = server.parse_answer_page_args(request.args)
+    except Exception:
+        return error("Invalid score, limit or cursor", 400)
+    pipeline = server.answer_leaderboard_pipeline(match, score, limit, after)
+    cursor = await get_async_db()["answers"].aggregate(pipeline)
+    result, next_cursor = server.shape_answer_leaderboard(await cursor.to_list(None), limit)
+    return json_response(result, headers={"X-Next-Cursor": next_cursor} if next_cursor else None)
+
+
+async def get_answer_leaderboard(request, question_id):
+    try:
+        object_id = ObjectId(question_id)
+    except Exception:
+        return error("Invalid question_id format", 400)
+    return await answer_leaderboard(request, {"question_id": object_id})
+
+
+async def get_group_answer_leaderboard(request, group_name, question_id):
+    try:
+        object_id = ObjectId(question_id)
+    except Exception:
+        return error("Invalid question_id format", 400)
+    db = get_async_db()
+    group = await db["groups"].find_one({"group_name": group_name}, {"_id": 1})
+    if not group:
+        return error("Group not found", 404)
+    members = await db["memberships"].find(
+        {"group_id": group["_id"]}, {"user_id": 1, "_id": 0}).to_list(None)
+    return await answer_leaderboard(
+        request, {"question_id": object_id, "user_id": {"$in": [m["user_id"] for m in members]}})
+
+
+ROUTES = [
+    ("GET", r"/today/get-question/", day_question(0, "today")),
+    ("GET", r"/yesterday/get-question/", day_question(1, "yesterday")),
+    ("GET", r"/day-before-yesterday/get-question/", day_question(2, "day before yesterday")),
+    ("GET", r"/questions", get_questions),
+    ("GET", r"/question/(?P<question_id>[^/]+)/get_pair", get_pair),
+    ("GET", r"/question/(?P<question_id>[^/]+)/pairs", get_pairs),
+    ("POST", r"/question/(?P<question_id>[^/]+)/matchup", record_matchup),
+    ("POST", r"/answer/(?P<answer_id>[^/]+)/increment-appearance", increment("appearances", "Appearance count")),
+    ("POST", r"/answer/(?P<answer_id>[^/]+)/increment-vote", increment("votes", "Vote count")),
+    ("GET", r"/question/(?P<question_id>[^/]+)/answer_leaderboard", get_answer_leaderboard),
+    ("GET", r"/groups/(?P<group_name>[^/]+)/answer-leaderboard/(?P<question_id>[^/]+)", get_group_answer_leaderboard),
+]
+# Each route is also labelled the way Flask writes its URL rule, so both entry
+# points report the same routes in /metrics
+ROUTES = [
+    (method, re.compile(pattern + "$"), re.sub(r"\(\?P<(\w+)>[^)]*\)", r"<\1>", pattern), handler)
+    for method, pattern, handler in ROUTES
+]
+
+
+def match_route(method, path):
+    for route_method, pattern, rule, handler in ROUTES:
+        if route_method == method:
+            found = pattern.match(path)
+            if found:
+                return handler, rule, found.groupdict()
+    return None, None, None
+
+
+async def read_body(receive):
+    body = b""
+    more = True
+    while more:
+        message = await receive()
+        body += message.get("body", b"")
+        more = message.get("more_body", False)
+    return body
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if counter_buffer is not None:
+                counter_buffer.stop()
+            await close_async_client()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+wsgi_app = WsgiToAsgi(server.app)
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+
+    handler, rule, params = (match_route(scope.get("method"), scope.get("path", ""))
+                             if scope["type"] == "http" else (None, None, None))
+    if handler is None:
+        return await wsgi_app(scope, receive, send)
+
+    started = time.perf_counter()
+    request = Request(scope, await read_body(receive))
+    try:
+        status, body, headers = await handler(request, **params)
+    except Exception as e:
+        log.exception("handler_failed", route=rule)
+        status, body, headers = error(str(e), 500)
+    record_request(rule, scope["method"], status, time.perf_counter() - started)
+
+    raw_headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    raw_headers += [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers.items()]
+    await send({"type": "http.response.start", "status": status, "headers": raw_headers + CORS_HEADERS})
+    await send({"type": "http.response.body", "body": body})
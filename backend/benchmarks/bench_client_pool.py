@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# Compares requests/sec with a fresh MongoClient per request (the old
+# behaviour) against the shared per-process client from db.py.
+#
+# The question cache and the answer pools are emptied before every request,
+# so each one reaches MongoDB as it did back then and the numbers compare
+# the cost of the client alone.
+#
+#   python3 benchmarks/bench_client_pool.py --requests 500
+#   python3 benchmarks/bench_client_pool.py --mongo-uri mongodb://localhost:27017
+
+import argparse
+import json
+import time
+from datetime import datetime
+
+from bson.objectid import ObjectId
+
+from common import add_standin_arguments, install_standin, summarize, BENCH_DB_NAME
+
+import db
+import server
+from pair_sampler import pair_sampler
+from question_cache import question_cache
+from flask import g
+
+
+def seed(database, answers_per_question):
+    database["questions"].delete_many({})
+    database["answers"].delete_many({})
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    question_id = database["questions"].insert_one({
+        "question": "What did you do the other day?",
+        "date": today,
+    }).inserted_id
+    answer_ids = database["answers"].insert_many([
+        {
+            "user_id": ObjectId(),
+            "question_id": question_id,
+            "answer_text": f"answer {i}",
+            "votes": 0,
+            "appearances": 0,
+        }
+        for i in range(answers_per_question)
+    ]).inserted_ids
+    return question_id, answer_ids
+
+
+def run(client, paths, count):
+    durations = []
+    start = time.perf_counter()
+    for i in range(count):
+        method, path = paths[i % len(paths)]
+        question_cache.clear()
+        pair_sampler.clear()
+        t0 = time.perf_counter()
+        response = client.open(path, method=method)
+        durations.append(time.perf_counter() - t0)
+        if response.status_code >= 500:
+            raise RuntimeError(f"{path} failed: {response.get_data(as_text=True)}")
+    return summarize(durations, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-request vs shared MongoClient")
+    add_standin_arguments(parser)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--answers", type=int, default=50)
+    args = parser.parse_args()
+
+    factory = install_standin(args)
+    question_id, answer_ids = seed(factory()[BENCH_DB_NAME], args.answers)
+    paths = [
+        ("GET", "/today/get-question/"),
+        ("GET", f"/question/{question_id}/get_pair"),
+        ("POST", f"/answer/{answer_ids[0]}/increment-vote"),
+    ]
+    client = server.app.test_client()
+
+    # Before: every request builds (and closes) its own client. Modules bind
+    # db.get_db at import time, but it looks db.get_client up on each call,
+    # so replacing that reaches server.py, question_cache.py, pair_sampler.py
+    # and every other consumer.
+    shared_get_client = db.get_client
+
+    def per_request_get_client():
+        if "bench_client" not in g:
+            g.bench_client = factory()
+        return g.bench_client
+
+    @server.app.teardown_request
+    def close_per_request_client(exc):
+        bench_client = g.pop("bench_client", None)
+        if bench_client is not None:
+            bench_client.close()
+
+    db.get_client = per_request_get_client
+    before = run(client, paths, args.requests)
+
+    # After: the shared, lazily created client.
+    db.get_client = shared_get_client
+    db.close_client()
+    after = run(client, paths, args.requests)
+
+    print(json.dumps({
+        "per_request_client": before,
+        "shared_client": after,
+        "speedup": round(after["requests_per_sec"] / before["requests_per_sec"], 2),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# Times daily_scores.close_day on a synthetic question day, then closes the
+# same day again to show the rerun credits nobody twice.
+#
+#   python3 benchmarks/bench_daily_scores.py --answers 2000
+#   python3 benchmarks/bench_daily_scores.py --answers 20000 --mongo-uri mongodb://localhost:27017
+#
+# mongomock has no indexes and evaluates pipelines in Python, so it only
+# checks correctness; time 100k answers against a real mongod.
+
+import argparse
+import json
+import random
+import time
+
+from bson.objectid import ObjectId
+
+from common import add_standin_arguments, install_standin, BENCH_DB_NAME
+
+import indexes
+from daily_scores import close_day
+from question_cache import local_midnight
+
+
+def seed(database, answers, groups):
+    for name in ["questions", "answers", "users", "memberships", "groups", "score_runs"]:
+        database[name].delete_many({})
+    day = local_midnight(days_ago=1)
+    question_id = database["questions"].insert_one({"question": "Benchmark question", "date": day}).inserted_id
+
+    user_ids = [ObjectId() for _ in range(answers)]
+    for start in range(0, answers, 10000):
+        chunk = user_ids[start:start + 10000]
+        database["users"].insert_many([
+            {"_id": uid, "username": f"user{start + i}", "total_points": random.randint(0, 5000)}
+            for i, uid in enumerate(chunk)
+        ])
+        batch = []
+        for uid in chunk:
+            appearances = random.randint(0, 60)
+            batch.append({"question_id": question_id, "user_id": uid, "answer_text": "answer",
+                          "votes": random.randint(0, appearances), "appearances": appearances})
+        database["answers"].insert_many(batch)
+
+    group_ids = [database["groups"].insert_one({"group_name": f"group{g}", "group_size": 0}).inserted_id
+                 for g in range(groups)]
+    memberships = [{"group_id": random.choice(group_ids), "user_id": uid, "total_points": 0}
+                   for uid in random.sample(user_ids, min(len(user_ids), answers // 5))] if group_ids else []
+    if memberships:
+        database["memberships"].insert_many(memberships)
+    return day
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Daily scoring job")
+    add_standin_arguments(parser)
+    parser.add_argument("--answers", type=int, default=2000)
+    parser.add_argument("--groups", type=int, default=100)
+    args = parser.parse_args()
+    args.handshake_ms = args.handshake_ms or 0.0
+
+    factory = install_standin(args)
+    database = factory()[BENCH_DB_NAME]
+    indexes.ensure_indexes(database)
+    day = seed(database, args.answers, args.groups)
+    before = sum(u["total_points"] for u in database["users"].find({}, {"total_points": 1}))
+
+    t0 = time.perf_counter()
+    first = close_day(database, day)
+    first_sec = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    second = close_day(database, day)
+    second_sec = time.perf_counter() - t0
+
+    after = sum(u["total_points"] for u in database["users"].find({}, {"total_points": 1}))
+    if after - before != first["points"] or second["users_credited"]:
+        raise AssertionError("rerunning the day changed total_points")
+
+    print(json.dumps({
+        "answers": args.answers,
+        "users_credited": first["users_credited"],
+        "points": first["points"],
+        "close_sec": round(first_sec, 3),
+        "rerun_sec": round(second_sec, 3),
+        "rerun_users_credited": second["users_credited"],
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# HTTP load test for comparing the WSGI server (python3 server.py) with the
+# ASGI entry point (uvicorn asgi:app) under many concurrent clients.
+#
+# Point both servers' .env at the same local mongod, seed it, start them, and
+# replay the hot-route mix against each:
+#
+#   python3 benchmarks/bench_http_load.py --seed --mongo-uri mongodb://localhost:27017 --db-name the_other_day_bench
+#   python3 server.py                                  # http://127.0.0.1:5000
+#   uvicorn asgi:app --port 8000                       # http://127.0.0.1:8000
+#   python3 benchmarks/bench_http_load.py \
+#       --target wsgi=http://127.0.0.1:5000 --target asgi=http://127.0.0.1:8000 \
+#       --concurrency 200 --duration 20
+#
+# The async driver can't run on mongomock, so this benchmark needs a real
+# mongod.
+
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from urllib.parse import urlsplit
+
+from common import summarize
+
+# (weight, name, method, path template)
+MIX = [
+    (3, "today question", "GET", "/today/get-question/"),
+    (1, "question history", "GET", "/questions?offsets=0,1,2"),
+    (6, "get_pair", "GET", "/question/{question_id}/get_pair"),
+    (4, "matchup", "POST", "/question/{question_id}/matchup"),
+    (2, "answer leaderboard", "GET", "/question/{question_id}/answer_leaderboard?limit=20"),
+]
+
+
+def seed(mongo_uri, db_name, answers):
+    from bson.objectid import ObjectId
+    from pymongo import MongoClient
+
+    db = MongoClient(mongo_uri)[db_name]
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    db["questions"].delete_many({"date": today})
+    question_id = db["questions"].insert_one({"question": "Load test question", "date": today}).inserted_id
+    db["answers"].insert_many([
+        {"question_id": question_id, "user_id": ObjectId(), "answer_text": f"answer {i}",
+         "votes": 0, "appearances": 0, "ratio": 0.0, "wilson": 0.0}
+        for i in range(answers)
+    ])
+    print(f"seeded question {question_id} with {answers} answers")
+
+
+def worker(base_url, question_id, deadline, results, lock):
+    parts = urlsplit(base_url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+    weighted = [entry for entry in MIX for _ in range(entry[0])]
+    pair = None
+    local = defaultdict(list)
+    errors = defaultdict(int)
+    while time.monotonic() < deadline:
+        _, name, method, template = random.choice(weighted)
+        path = template.format(question_id=question_id)
+        body = None
+        if name == "matchup":
+            if not pair:
+                continue
+            body = json.dumps({"winner_id": pair[0]["_id"], "loser_id": pair[1]["_id"]})
+        t0 = time.perf_counter()
+        try:
+            conn.request(method, path, body=body, headers={"Content-Type": "application/json"})
+            response = conn.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            errors[name] += 1
+            conn.close()
+            conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+            continue
+        local[name].append(time.perf_counter() - t0)
+        if response.status >= 400:
+            errors[name] += 1
+        elif name == "get_pair":
+            sampled = json.loads(data)
+            pair = sampled if len(sampled) == 2 else pair
+    conn.close()
+    with lock:
+        for name, durations in local.items():
+            results["durations"][name].extend(durations)
+        for name, count in errors.items():
+            results["errors"][name] += count
+
+
+def run_target(base_url, concurrency, duration):
+    parts = urlsplit(base_url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+    conn.request("GET", "/today/get-question/")
+    question = json.loads(conn.getresponse().read())
+    conn.close()
+    if "_id" not in question:
+        raise SystemExit(f"{base_url} has no question for today; run with --seed first")
+
+    results = {"durations": defaultdict(list), "errors": defaultdict(int)}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+    start = time.perf_counter()
+    threads = [
+        threading.Thread(target=worker, args=(base_url, question["_id"], deadline, results, lock))
+        for _ in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    routes = {name: summarize(durations, elapsed) for name, durations in results["durations"].items()}
+    all_durations = [d for durations in results["durations"].values() for d in durations]
+    return {
+        "url": base_url,
+        "overall": summarize(all_durations, elapsed),
+        "routes": routes,
+        "errors": dict(results["errors"]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WSGI vs ASGI HTTP load test")
+    parser.add_argument("--target", action="append", default=[],
+                        help="name=url of a running server; repeat to compare")
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=15.0)
+    parser.add_argument("--seed", action="store_true", help="seed today's question and exit")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017")
+    parser.add_argument("--db-name", default="the_other_day_bench")
+    parser.add_argument("--answers", type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.seed:
+        seed(args.mongo_uri, args.db_name, args.answers)
+        return
+    if not args.target:
+        parser.error("give at least one --target name=url")
+
+    report = {"concurrency": args.concurrency, "duration_sec": args.duration, "targets": {}}
+    for target in args.target:
+        name, _, url = target.partition("=")
+        report["targets"][name] = run_target(url, args.concurrency, args.duration)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# End-to-end load test of server.py's app, in process, against a stand-in
+# database. No Atlas cluster or running server is needed.
+#
+# Seeds synthetic users, a week of questions with their answers, and groups,
+# then replays a mix of client traffic through Flask's test client:
+#
+#   open_app     today's question, the last three days, has-answered, ranking
+#   get_pair     a pair to vote on
+#   vote         a matchup on the last pair seen
+#   leaderboards global, group and answer leaderboards
+#
+# and prints throughput and latency percentiles per route as JSON on stdout. Save the
+# output with --output and pass it back as --baseline on a later commit to
+# see the change per route.
+#
+#   python3 benchmarks/bench_load.py --answers 10000 --duration 20
+#   python3 benchmarks/bench_load.py --answers 1000000 --mongo-uri mongodb://localhost:27017 \
+#       --clients 16 --output before.json
+#   python3 benchmarks/bench_load.py --answers 1000000 --mongo-uri mongodb://localhost:27017 \
+#       --clients 16 --skip-seed --baseline before.json
+#
+# mongomock keeps everything in Python dicts without indexes: it shows where
+# the app itself spends time, but seeding more than ~50k answers or running
+# several --clients against it is slow. Use a local mongod for larger runs.
+
+import argparse
+from collections import defaultdict
+import json
+import random
+import subprocess
+import sys
+import threading
+import time
+
+from bson.objectid import ObjectId
+
+from common import BACKEND_DIR, BENCH_DB_NAME, add_standin_arguments, install_standin, summarize
+
+import indexes
+from question_cache import local_midnight
+from scoring import score_fields
+
+# (weight, step)
+MIX = [
+    (2, "open_app"),
+    (6, "get_pair"),
+    (4, "vote"),
+    (1, "leaderboards"),
+]
+
+
+def seed(database, answers, days, users, groups, group_size):
+    for name in ["questions", "answers", "users", "memberships", "groups", "score_runs"]:
+        database[name].delete_many({})
+
+    user_ids = [ObjectId() for _ in range(users)]
+    for start in range(0, users, 10000):
+        database["users"].insert_many([
+            {"_id": uid, "username": f"user{start + i}", "name": f"User {start + i}", "avatar_url": "",
+             "total_points": random.randint(0, 5000), "created_at": local_midnight(days_ago=days)}
+            for i, uid in enumerate(user_ids[start:start + 10000])
+        ])
+
+    question_ids = [
+        database["questions"].insert_one({"question": f"Question {day}", "date": local_midnight(days_ago=day)}).inserted_id
+        for day in range(days)
+    ]
+    per_question = answers // days
+    for question_id in question_ids:
+        # Every answer to a question is by a different user
+        authors = random.sample(user_ids, min(per_question, users))
+        for start in range(0, len(authors), 10000):
+            batch = []
+            for uid in authors[start:start + 10000]:
+                appearances = random.randint(0, 60)
+                votes = random.randint(0, appearances)
+                batch.append({"question_id": question_id, "user_id": uid, "answer_text": "an answer",
+                              "votes": votes, "appearances": appearances, **score_fields(votes, appearances)})
+            database["answers"].insert_many(batch)
+
+    users_by_id = {u["_id"]: u for u in database["users"].find({}, {"username": 1, "name": 1, "avatar_url": 1, "total_points": 1})}
+    group_names = []
+    for g in range(groups):
+        members = random.sample(user_ids, min(group_size, users))
+        group_id = database["groups"].insert_one(
+            {"group_name": f"group{g}", "group_size": len(members)}).inserted_id
+        database["memberships"].insert_many([
+            {"group_id": group_id, "user_id": uid, "group_name": f"group{g}",
+             "joined_at": local_midnight(days_ago=days), "username": users_by_id[uid]["username"],
+             "name": users_by_id[uid]["name"], "avatar_url": "", "total_points": users_by_id[uid]["total_points"]}
+            for uid in members
+        ])
+        group_names.append(f"group{g}")
+    return {"question_id": str(question_ids[0]), "user_ids": [str(uid) for uid in user_ids[:1000]],
+            "group_names": group_names}
+
+
+class Client:
+    """One simulated app user."""
+
+    def __init__(self, app, data):
+        self.http = app.test_client()
+        self.question_id = data["question_id"]
+        self.user_id = random.choice(data["user_ids"])
+        self.group_name = random.choice(data["group_names"]) if data["group_names"] else None
+        self.pair = None
+        self.durations = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def request(self, route, method, path, body=None):
+        t0 = time.perf_counter()
+        try:
+            response = self.http.open(path, method=method, json=body)
+        except Exception:
+            self.errors[route] += 1
+            return None
+        self.durations[route].append(time.perf_counter() - t0)
+        if response.status_code >= 400:
+            self.errors[route] += 1
+            return None
+        return response
+
+    def open_app(self):
+        self.request("GET /today/get-question/", "GET", "/today/get-question/")
+        self.request("GET /questions", "GET", "/questions?offsets=0,1,2")
+        self.request("GET /today/has-answered/<user_id>", "GET", f"/today/has-answered/{self.user_id}")
+        self.request("GET /user/<user_id>/ranking", "GET", f"/user/{self.user_id}/ranking")
+
+    def get_pair(self):
+        response = self.request("GET /question/<question_id>/get_pair", "GET",
+                                f"/question/{self.question_id}/get_pair")
+        if response is not None:
+            pair = response.get_json()
+            self.pair = pair if len(pair) == 2 else self.pair
+
+    def vote(self):
+        if self.pair is None:
+            return self.get_pair()
+        winner, loser = random.sample(self.pair, 2)
+        self.request("POST /question/<question_id>/matchup", "POST", f"/question/{self.question_id}/matchup",
+                     {"winner_id": winner["_id"], "loser_id": loser["_id"]})
+        self.pair = None
+
+    def leaderboards(self):
+        self.request("GET /leaderboard", "GET", "/leaderboard?limit=50")
+        if self.group_name:
+            self.request("GET /groups/leaderboard/<group_name>", "GET",
+                         f"/groups/leaderboard/{self.group_name}?limit=50")
+        self.request("GET /question/<question_id>/answer_leaderboard", "GET",
+                     f"/question/{self.question_id}/answer_leaderboard?limit=20")
+
+    def run(self, deadline):
+        steps = [step for weight, step in MIX for _ in range(weight)]
+        while time.monotonic() < deadline:
+            getattr(self, random.choice(steps))()
+
+
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(result, baseline):
+    """p50/p95 and throughput relative to a saved run (1.0 = unchanged)."""
+    changes = {}
+    for route, summary in result["routes"].items():
+        before = baseline.get("routes", {}).get(route)
+        if not before:
+            continue
+        changes[route] = {
+            key: round(summary[key] / before[key], 2) if before[key] else None
+            for key in ("requests_per_sec", "p50_ms", "p95_ms")
+        }
+    return {"baseline_commit": baseline.get("commit"), "ratios": changes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process load test")
+    add_standin_arguments(parser)
+    parser.add_argument("--answers", type=int, default=10000, help="answers across all seeded questions")
+    parser.add_argument("--days", type=int, default=7, help="days of questions to seed")
+    parser.add_argument("--users", type=int, default=None, help="default: as many as answers per question")
+    parser.add_argument("--groups", type=int, default=50)
+    parser.add_argument("--group-size", type=int, default=50)
+    parser.add_argument("--skip-seed", action="store_true", help="reuse the data from a previous run")
+    parser.add_argument("--clients", type=int, default=1, help="concurrent simulated users")
+    parser.add_argument("--duration", type=float, default=15.0)
+    parser.add_argument("--output", help="also write the results to this file")
+    parser.add_argument("--baseline", help="results file of an earlier run to compare against")
+    args = parser.parse_args()
+    args.handshake_ms = args.handshake_ms or 0.0
+
+    install_standin(args)
+    from db import get_db
+    import server
+
+    database = get_db()
+    indexes.ensure_indexes(database)
+    users = args.users or max(args.answers // args.days, 1)
+    if args.skip_seed:
+        question = database["questions"].find_one({"date": local_midnight()}, {"_id": 1})
+        if question is None:
+            raise SystemExit(f"{BENCH_DB_NAME} has no question for today; run without --skip-seed")
+        data = {
+            "question_id": str(question["_id"]),
+            "user_ids": [str(u["_id"]) for u in database["users"].find({}, {"_id": 1}).limit(1000)],
+            "group_names": [g["group_name"] for g in database["groups"].find({}, {"group_name": 1})],
+        }
+    else:
+        t0 = time.perf_counter()
+        data = seed(database, args.answers, args.days, users, args.groups, args.group_size)
+        print(f"seeded {args.answers} answers, {users} users and {args.groups} groups "
+              f"in {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+
+    clients = [Client(server.app, data) for _ in range(args.clients)]
+    # Warm the caches so the first requests don't dominate the percentiles
+    clients[0].open_app()
+    clients[0].leaderboards()
+    clients[0].durations.clear()
+    clients[0].errors.clear()
+
+    deadline = time.monotonic() + args.duration
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client.run, args=(deadline,)) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    durations = defaultdict(list)
+    errors = defaultdict(int)
+    for client in clients:
+        for route, values in client.durations.items():
+            durations[route].extend(values)
+        for route, count in client.errors.items():
+            errors[route] += count
+
+    result = {
+        "commit": commit(),
+        "database": "mongod" if args.mongo_uri else "mongomock",
+        "answers": args.answers,
+        "users": users,
+        "clients": args.clients,
+        "duration_sec": round(elapsed, 1),
+        "overall": summarize([d for values in durations.values() for d in values], elapsed),
+        "routes": {route: summarize(values, elapsed) for route, values in sorted(durations.items())},
+        "errors": dict(errors),
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            result["compared_to_baseline"] = compare(result, json.load(f))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# Compares the three ways of answering /user/<user_id>/ranking on a synthetic
+# users collection:
+#
+#   scan   - the old approach: load every user sorted by points and search
+#   count  - count users with more points (uses the total_points index)
+#   index  - ranking.RankIndex, the optional in-process sorted structure
+#
+#   python3 benchmarks/bench_ranking.py --users 20000
+#   python3 benchmarks/bench_ranking.py --users 1000000 --mongo-uri mongodb://localhost:27017
+#
+# mongomock has no indexes, so "count" is only representative against a real
+# mongod.
+
+import argparse
+import json
+import random
+import time
+
+from common import add_standin_arguments, install_standin, summarize, BENCH_DB_NAME
+
+import indexes
+from ranking import RankIndex, count_rank
+
+
+def seed(users, count, max_points):
+    users.delete_many({})
+    batch = []
+    for i in range(count):
+        batch.append({"username": f"user{i}", "total_points": random.randint(0, max_points)})
+        if len(batch) == 10000:
+            users.insert_many(batch)
+            batch = []
+    if batch:
+        users.insert_many(batch)
+
+
+def scan_rank(users, user_id):
+    all_users = list(users.find().sort("total_points", -1))
+    for i, user in enumerate(all_users):
+        if user["_id"] == user_id:
+            return i + 1
+    return None
+
+
+def timed(fn, samples):
+    durations = []
+    results = []
+    start = time.perf_counter()
+    for sample in samples:
+        t0 = time.perf_counter()
+        results.append(fn(sample))
+        durations.append(time.perf_counter() - t0)
+    return summarize(durations, time.perf_counter() - start), results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="User rank lookup strategies")
+    add_standin_arguments(parser)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--max-points", type=int, default=500,
+                        help="points are drawn from [0, max-points], so ties are common")
+    parser.add_argument("--lookups", type=int, default=200)
+    parser.add_argument("--scan-lookups", type=int, default=5,
+                        help="the old full scan is slow; sample it fewer times")
+    args = parser.parse_args()
+    args.handshake_ms = args.handshake_ms or 0.0
+
+    factory = install_standin(args)
+    database = factory()[BENCH_DB_NAME]
+    users = database["users"]
+    seed(users, args.users, args.max_points)
+    indexes.ensure_indexes(database)
+
+    sample = [u["_id"] for u in users.aggregate([{"$sample": {"size": args.lookups}}])]
+    points = {u["_id"]: u["total_points"] for u in users.find({"_id": {"$in": sample}})}
+
+    report = {"users": args.users}
+    report["scan"], _ = timed(lambda uid: scan_rank(users, uid), sample[:args.scan_lookups])
+    report["count"], counted = timed(lambda uid: count_rank(users, points[uid]), sample)
+
+    rank_index = RankIndex(ttl=float("inf"))
+    t0 = time.perf_counter()
+    rank_index.load(users)
+    report["index_build_sec"] = round(time.perf_counter() - t0, 3)
+    report["index"], indexed = timed(lambda uid: rank_index.rank(users, uid)[0], sample)
+
+    if counted != indexed:
+        raise AssertionError("count and index strategies disagree")
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# Times encoding the leaderboard payloads:
+#
+#   legacy - the old approach: str() every ObjectId, strftime every date,
+#            then json.dumps and encode
+#   dumps  - serialization.dumps on the documents as they come from MongoDB
+#
+#   python3 benchmarks/bench_serialization.py
+#   python3 benchmarks/bench_serialization.py --entries 1000 --rounds 500
+#
+# No database is needed; the payloads are built in memory with the same
+# shape the routes return.
+
+import argparse
+from datetime import datetime, timedelta
+import json
+import random
+import time
+
+from bson.objectid import ObjectId
+
+import common  # noqa: F401  (puts the backend on sys.path)
+import serialization
+
+
+def leaderboard(entries):
+    return {"leaderboard": [
+        {"user_id": ObjectId(), "username": f"user{i}", "total_points": random.randint(0, 50000),
+         "rank": i + 1, "name": f"User {i}", "avatar_url": f"https://example.com/avatars/{i}.png"}
+        for i in range(entries)
+    ], "total_users": entries}
+
+
+def group_leaderboard(entries):
+    return {"leaderboard": [
+        {"_id": ObjectId(), "username": f"user{i}", "name": f"User {i}",
+         "avatar_url": f"https://example.com/avatars/{i}.png",
+         "total_points": random.randint(0, 50000), "rank": i + 1}
+        for i in range(entries)
+    ], "group_name": "benchmark", "total_users": entries}
+
+
+def answer_leaderboard(entries):
+    question_id = ObjectId()
+    date = datetime(2025, 3, 14)
+    result = []
+    for i in range(entries):
+        user_id = ObjectId()
+        result.append({
+            "answer": {"_id": ObjectId(), "question_id": question_id, "user_id": user_id,
+                       "answer_text": "an answer of a typical length " * 2,
+                       "votes": random.randint(0, 50), "appearances": random.randint(50, 100),
+                       "date": date - timedelta(days=i % 30)},
+            "user": {"_id": user_id, "username": f"user{i}", "name": f"User {i}",
+                     "avatar_url": f"https://example.com/avatars/{i}.png"}
+        })
+    return result
+
+
+def legacy_dumps(payload):
+    """What the routes used to do before handing the payload to json.dumps."""
+    def convert(value):
+        if isinstance(value, dict):
+            return {k: convert(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [convert(v) for v in value]
+        if isinstance(value, ObjectId):
+            return str(value)
+        if isinstance(value, datetime):
+            return value.strftime("%m-%d-%Y")
+        return value
+    return json.dumps(convert(payload)).encode("utf-8")
+
+
+def time_us(encode, payload, rounds):
+    encode(payload)
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        encode(payload)
+    return (time.perf_counter() - t0) / rounds * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Response encoding")
+    parser.add_argument("--entries", type=int, default=100, help="entries per payload")
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+
+    results = {"encoder": "orjson" if serialization.orjson is not None else "json", "entries": args.entries}
+    for name, build in [("leaderboard", leaderboard),
+                        ("group_leaderboard", group_leaderboard),
+                        ("answer_leaderboard", answer_leaderboard)]:
+        payload = build(args.entries)
+        if json.loads(legacy_dumps(payload)) != json.loads(serialization.dumps(payload)):
+            raise AssertionError(f"{name}: dumps output differs from the legacy encoding")
+        legacy = time_us(legacy_dumps, payload, args.rounds)
+        current = time_us(serialization.dumps, payload, args.rounds)
+        results[name] = {
+            "legacy_us": round(legacy, 1),
+            "dumps_us": round(current, 1),
+            "speedup": round(legacy / current, 1),
+            "bytes": len(serialization.dumps(payload)),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
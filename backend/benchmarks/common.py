@@ -0,0 +1,99 @@
+# Helpers shared by the local benchmarks.
+#
+# The benchmarks never talk to Atlas. They run server.py's app against a
+# stand-in MongoDB: a local mongod when --mongo-uri is given, otherwise an
+# in-process mongomock store.
+
+import os
+import sys
+import time
+import statistics
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+import db
+import settings
+
+BENCH_DB_NAME = "the_other_day_bench"
+
+
+def add_standin_arguments(parser):
+    parser.add_argument("--mongo-uri", default=None,
+                        help="use a real mongod at this URI instead of mongomock")
+    parser.add_argument("--handshake-ms", type=float, default=None,
+                        help="simulated connection setup cost per new client "
+                             "(defaults to 20ms for mongomock, 0 for a real mongod)")
+
+
+def standin_factory(mongo_uri=None, handshake_ms=0.0):
+    """Return a MongoClient-compatible factory for the stand-in database."""
+    if mongo_uri:
+        from pymongo import MongoClient
+
+        def make_client(host=None, **kwargs):
+            # A local mongod normally runs without TLS.
+            kwargs.pop("tlsCAFile", None)
+            if handshake_ms:
+                time.sleep(handshake_ms / 1000.0)
+            return MongoClient(mongo_uri, **kwargs)
+        return make_client
+
+    import mongomock
+    from mongomock.store import ServerStore
+    _patch_mongomock_bulk()
+    store = ServerStore()
+
+    def make_client(host=None, **kwargs):
+        if handshake_ms:
+            time.sleep(handshake_ms / 1000.0)
+        return mongomock.MongoClient(_store=store)
+    return make_client
+
+
+def _patch_mongomock_bulk():
+    # Newer pymongo passes a `sort` argument to the bulk builder that
+    # mongomock doesn't know about; updates by _id don't need it.
+    from mongomock.collection import BulkOperationBuilder
+    add_update = BulkOperationBuilder.add_update
+    if getattr(add_update, "accepts_sort", False):
+        return
+
+    def add_update_ignoring_sort(self, *args, sort=None, **kwargs):
+        return add_update(self, *args, **kwargs)
+
+    add_update_ignoring_sort.accepts_sort = True
+    BulkOperationBuilder.add_update = add_update_ignoring_sort
+
+
+def install_standin(args):
+    """Point db.get_client() at the stand-in and return the factory used."""
+    handshake_ms = args.handshake_ms
+    if handshake_ms is None:
+        handshake_ms = 0.0 if args.mongo_uri else 20.0
+    factory = standin_factory(args.mongo_uri, handshake_ms)
+    settings.config["ATLAS_URI"] = args.mongo_uri or "mongodb://standin"
+    settings.config["DB_NAME"] = BENCH_DB_NAME
+    db.close_client()
+    db.MongoClient = factory
+    return factory
+
+
+def summarize(durations, elapsed):
+    durations = sorted(durations)
+
+    def pct(p):
+        if not durations:
+            return 0.0
+        index = min(len(durations) - 1, int(round(p / 100.0 * (len(durations) - 1))))
+        return durations[index] * 1000.0
+
+    return {
+        "requests": len(durations),
+        "requests_per_sec": round(len(durations) / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(statistics.mean(durations) * 1000.0, 3) if durations else 0.0,
+        "p50_ms": round(pct(50), 3),
+        "p95_ms": round(pct(95), 3),
+        "p99_ms": round(pct(99), 3),
+    }
@@ -0,0 +1,177 @@
+# Write-behind buffering for the answer vote/appearance counters.
+#
+# Each pairwise vote used to cost three single-document updates. With
+# COUNTER_BUFFER=1 the increments are instead coalesced in memory per answer
+# and written as one unordered bulk_write of UpdateOne operations, either
+# every COUNTER_FLUSH_INTERVAL_MS, as soon as COUNTER_FLUSH_MAX_PENDING answers
+# are waiting, or when the process exits.
+#
+# Buffered increments are lost if the process dies without exiting cleanly.
+# COUNTER_MAX_LOSS_MS bounds that window: once the oldest buffered increment
+# is that old, the next request flushes synchronously instead of waiting for
+# the background thread (which may be frozen between serverless invocations).
+
+import atexit
+import os
+import threading
+import time
+
+from pymongo import UpdateOne
+
+from db import get_db
+from logs import get_logger
+from metrics import Counter, FunctionGauge, Histogram, registry
+from scoring import counter_update
+from settings import get_setting, get_flag
+
+log = get_logger("counters")
+
+flushes_total = registry.register(Counter(
+    "counter_buffer_flushes_total", "Counter buffer flushes, by result.", ["result"]))
+flushed_updates_total = registry.register(Counter(
+    "counter_buffer_flushed_updates_total", "Answer updates written by counter buffer flushes."))
+flush_seconds = registry.register(Histogram(
+    "counter_buffer_flush_duration_seconds", "Time to write one counter buffer flush."))
+
+
+class CounterBuffer:
+    def __init__(self, flush_interval=1.0, max_pending=500, max_loss=5.0):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_loss = max_loss
+        self._pending = {}
+        self._oldest = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._thread_pid = None
+        self._stopped = False
+
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.flushed_updates = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    def add(self, answer_id, votes=0, appearances=0):
+        self._ensure_thread()
+        with self._lock:
+            counts = self._pending.get(answer_id)
+            if counts is None:
+                counts = self._pending[answer_id] = [0, 0]
+            counts[0] += votes
+            counts[1] += appearances
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            overdue = time.monotonic() - self._oldest >= self.max_loss
+            full = len(self._pending) >= self.max_pending
+
+        if overdue:
+            # The increment is buffered either way; a failed flush keeps it
+            # for the next attempt, so the request must not fail (and be
+            # retried into a second increment).
+            try:
+                self.flush()
+            except Exception:
+                log.exception("counter_flush_failed")
+        elif full:
+            self._wake.set()
+
+    def flush(self):
+        """Write everything buffered so far. Returns the number of updates."""
+        with self._flush_lock:
+            with self._lock:
+                pending = self._pending
+                self._pending = {}
+                self._oldest = None
+            if not pending:
+                return 0
+
+            operations = [
+                UpdateOne({"_id": answer_id}, counter_update(votes=votes, appearances=appearances))
+                for answer_id, (votes, appearances) in pending.items()
+            ]
+            start = time.perf_counter()
+            try:
+                get_db()["answers"].bulk_write(operations, ordered=False)
+            except Exception:
+                # Put the increments back so the next flush retries them.
+                self.failed_flushes += 1
+                flushes_total.inc("failed")
+                with self._lock:
+                    for answer_id, (votes, appearances) in pending.items():
+                        counts = self._pending.setdefault(answer_id, [0, 0])
+                        counts[0] += votes
+                        counts[1] += appearances
+                    if self._oldest is None:
+                        self._oldest = time.monotonic()
+                raise
+            elapsed_ms = (time.perf_counter() - start) * 1000.0
+
+            self.flushes += 1
+            self.flushed_updates += len(operations)
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self.total_flush_ms += elapsed_ms
+            flushes_total.inc("ok")
+            flushed_updates_total.inc(amount=len(operations))
+            flush_seconds.observe(elapsed_ms / 1000.0)
+            return len(operations)
+
+    def stats(self):
+        with self._lock:
+            depth = len(self._pending)
+            oldest = self._oldest
+        return {
+            "buffer_depth": depth,
+            "oldest_pending_ms": (time.monotonic() - oldest) * 1000.0 if oldest else 0.0,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "flushed_updates": self.flushed_updates,
+            "last_flush_ms": self.last_flush_ms,
+            "max_flush_ms": self.max_flush_ms,
+            "mean_flush_ms": self.total_flush_ms / self.flushes if self.flushes else 0.0,
+        }
+
+    def _ensure_thread(self):
+        # Threads don't survive a fork, so each worker process starts its own.
+        if self._thread_pid == os.getpid() or self._stopped:
+            return
+        with self._lock:
+            if self._thread_pid == os.getpid():
+                return
+            self._thread_pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="counter-flush", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                log.exception("counter_flush_failed")
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+        self.flush()
+
+
+counter_buffer = None
+if get_flag("COUNTER_BUFFER"):
+    counter_buffer = CounterBuffer(
+        flush_interval=get_setting("COUNTER_FLUSH_INTERVAL_MS", 1000, float) / 1000.0,
+        max_pending=get_setting("COUNTER_FLUSH_MAX_PENDING", 500, int),
+        max_loss=get_setting("COUNTER_MAX_LOSS_MS", 5000, float) / 1000.0,
+    )
+    atexit.register(counter_buffer.stop)
+    registry.register(FunctionGauge(
+        "counter_buffer_depth", "Answers with increments waiting to be written.",
+        lambda: counter_buffer.stats()["buffer_depth"]))
+    registry.register(FunctionGauge(
+        "counter_buffer_oldest_pending_seconds", "Age of the oldest increment waiting to be written.",
+        lambda: counter_buffer.stats()["oldest_pending_ms"] / 1000.0))
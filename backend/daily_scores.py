@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# Closes out a question day: turns each answer's votes and appearances into
+# points and adds them to its author's total_points.
+#
+#   python3 daily_scores.py                      # close yesterday
+#   python3 daily_scores.py --date 03-14-2025    # close a given day
+#
+# The same job runs from the /jobs/close-day endpoint (see vercel.json for the
+# schedule). Closing a day:
+#
+#   1. freezes each answer's final score into answers.points with one update
+#      pipeline (answers that already have points keep them),
+#   2. sums the points per user with a $group,
+#   3. applies every user's award in one unordered bulk_write, and the same
+#      award to the copies in memberships (see memberships.py).
+#
+# Each award is guarded by the user's scored_through date, so a user is only
+# credited once per day and rerunning a day, even after a crash half way
+# through, is safe. The guard relies on days being closed in date order,
+# which close_day enforces.
+
+import argparse
+from datetime import datetime
+
+from pymongo import UpdateMany, UpdateOne
+
+from question_cache import local_midnight
+from scoring import SCORE_FIELDS, score_expressions
+from settings import get_setting
+
+POINTS_SCORE = get_setting("DAILY_POINTS_SCORE", "wilson")
+
+POINTS_SCALE = get_setting("DAILY_POINTS_SCALE", 100, float)
+
+
+class ClosedOutOfOrder(Exception):
+    pass
+
+
+def points_expression(score=POINTS_SCORE, scale=POINTS_SCALE):
+    """An answer's final points: its score (0-1) times `scale`, rounded
+    half up."""
+    return {"$toInt": {"$floor": {"$add": [{"$multiply": [score_expressions()[score], scale]}, 0.5]}}}
+
+
+def _award(points, date):
+    return {"$inc": {"total_points": points}, "$set": {"scored_through": date}}
+
+
+def close_day(db, date):
+    """Award the points for the question dated `date` (a local midnight).
+
+    Returns a summary of the run. Raises LookupError if there is no question
+    that day, and ClosedOutOfOrder if a later day has already been closed.
+    """
+    if POINTS_SCORE not in SCORE_FIELDS:
+        raise ValueError(f"DAILY_POINTS_SCORE must be one of {', '.join(SCORE_FIELDS)}")
+    if date >= local_midnight():
+        raise ValueError(f"{date.strftime('%m-%d-%Y')} hasn't finished yet")
+    question = db["questions"].find_one({"date": date}, {"_id": 1})
+    if question is None:
+        raise LookupError(f"No question for {date.strftime('%m-%d-%Y')}")
+    later = db["score_runs"].find_one({"date": {"$gt": date}}, {"date": 1})
+    if later is not None:
+        raise ClosedOutOfOrder(
+            f"{later['date'].strftime('%m-%d-%Y')} is already closed; close days in order")
+
+    started = datetime.utcnow()
+    answers = db["answers"]
+    answers.update_many(
+        {"question_id": question["_id"], "points": {"$exists": False}},
+        [{"$set": {"points": points_expression()}}]
+    )
+    awards = list(answers.aggregate([
+        {"$match": {"question_id": question["_id"], "points": {"$gt": 0}}},
+        {"$group": {"_id": "$user_id", "points": {"$sum": "$points"}}}
+    ]))
+
+    not_yet_scored = {"scored_through": {"$not": {"$gte": date}}}
+    credited = 0
+    if awards:
+        credited = db["users"].bulk_write([
+            UpdateOne({"_id": a["_id"], **not_yet_scored}, _award(a["points"], date)) for a in awards
+        ], ordered=False).modified_count
+
+        members = set(db["memberships"].distinct("user_id", {"user_id": {"$in": [a["_id"] for a in awards]}}))
+        operations = [
+            UpdateMany({"user_id": a["_id"], **not_yet_scored}, _award(a["points"], date))
+            for a in awards if a["_id"] in members
+        ]
+        if operations:
+            db["memberships"].bulk_write(operations, ordered=False)
+
+    summary = {
+        "question_id": question["_id"],
+        "date": date,
+        "users": len(awards),
+        "users_credited": credited,
+        "points": sum(a["points"] for a in awards),
+        "closed_at": datetime.utcnow(),
+        "seconds": (datetime.utcnow() - started).total_seconds(),
+    }
+    db["score_runs"].update_one({"_id": question["_id"]}, {"$set": summary}, upsert=True)
+    summary["awards"] = awards
+    return summary
+
+
+if __name__ == '__main__':
+    from db import get_db
+
+    parser = argparse.ArgumentParser(description="Award the points for a finished question day")
+    parser.add_argument("--date", help="day to close as MM-DD-YYYY (default: yesterday)")
+    args = parser.parse_args()
+
+    date = datetime.strptime(args.date, "%m-%d-%Y") if args.date else local_midnight(days_ago=1)
+    summary = close_day(get_db(), date)
+    print(f"{date.strftime('%m-%d-%Y')}: {summary['points']} points to {summary['users']} users "
+          f"({summary['users_credited']} newly credited) in {summary['seconds']:.2f}s")
@@ -0,0 +1,111 @@
+# Shared MongoDB access for the backend.
+#
+# Creating a MongoClient is expensive (TLS handshake, server discovery and a
+# certifi lookup), so every process keeps exactly one client and all routes
+# borrow connections from its pool. The client lives at module level, which
+# also lets warm Vercel invocations reuse it.
+
+from pymongo import MongoClient
+import asyncio
+import certifi
+import os
+import threading
+
+from metrics import listeners
+from settings import get_setting
+
+_client = None
+_client_pid = None
+_lock = threading.Lock()
+
+_async_client = None
+_async_key = None
+
+
+def client_options():
+    """Pool settings for the shared client, overridable through .env."""
+    return {
+        "tlsCAFile": certifi.where(),
+        "maxPoolSize": get_setting("MONGO_MAX_POOL_SIZE", 50, int),
+        "minPoolSize": get_setting("MONGO_MIN_POOL_SIZE", 0, int),
+        "maxIdleTimeMS": get_setting("MONGO_MAX_IDLE_TIME_MS", 60000, int),
+        "serverSelectionTimeoutMS": get_setting("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000, int),
+        # Don't block import (or a cold start) on server discovery.
+        "connect": False,
+        # Command and pool timings for /metrics
+        "event_listeners": listeners(),
+    }
+
+
+def get_client():
+    """Return this process's MongoClient, creating it on first use.
+
+    MongoClient is not fork-safe, so a child process that inherited a client
+    from its parent (e.g. a pre-forking WSGI server) builds its own.
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+    with _lock:
+        if _client is None or _client_pid != pid:
+            _client = MongoClient(get_setting("ATLAS_URI"), **client_options())
+            _client_pid = pid
+    return _client
+
+
+def get_db():
+    return get_client()[get_setting("DB_NAME")]
+
+
+def get_async_client():
+    """Return the AsyncMongoClient for the running event loop (asgi.py).
+
+    It shares the pool settings of the synchronous client. An async client
+    is bound to the loop it was created on, so a new loop (or a forked
+    process) gets its own.
+    """
+    global _async_client, _async_key
+    from pymongo import AsyncMongoClient
+
+    key = (os.getpid(), id(asyncio.get_running_loop()))
+    if _async_client is None or _async_key != key:
+        _async_client = AsyncMongoClient(get_setting("ATLAS_URI"), **client_options())
+        _async_key = key
+    return _async_client
+
+
+def get_async_db():
+    return get_async_client()[get_setting("DB_NAME")]
+
+
+async def close_async_client():
+    global _async_client, _async_key
+    if _async_client is not None and _async_key[0] == os.getpid():
+        await _async_client.close()
+    _async_client = None
+    _async_key = None
+
+
+def close_client():
+    global _client, _client_pid
+    with _lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
+
+def _reset_after_fork():
+    # The inherited client's sockets belong to the parent; drop it without
+    # closing so the parent's connections are left alone.
+    global _client, _client_pid, _lock, _async_client, _async_key
+    _client = None
+    _client_pid = None
+    _lock = threading.Lock()
+    _async_client = None
+    _async_key = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
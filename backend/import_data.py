@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+# Loads questions, answers or users from NDJSON or CSV, e.g. the schedule of
+# daily questions or a snapshot written by read_tables.py.
+#
+#   python3 import_data.py questions schedule.csv
+#   python3 import_data.py answers snapshot/answers.ndjson.gz
+#   python3 import_data.py users users.ndjson --mode upsert
+#   cat questions.ndjson | python3 import_data.py questions -
+#
+# Each row is checked and converted before it is written:
+#
+#   * ObjectId fields (_id, question_id, user_id) accept a 24 character hex
+#     string or Extended JSON {"$oid": ...}.
+#   * Dates accept MM-DD-YYYY, ISO 8601 or Extended JSON {"$date": ...}. A
+#     question's date is turned into the local midnight the routes look
+#     questions up by.
+#   * With --validate (the default), an answer's question_id and user_id must
+#     refer to existing documents; they are checked with one $in query per
+#     batch and remembered.
+#   * Answers get their ratio and wilson scores (scoring.py) if they have none.
+#
+# Rows that fail are reported on stderr and skipped (--strict stops at the
+# first one). Valid rows are written in batches of --batch-size by
+# --workers threads, with unordered insert_many in "insert" mode (rows that
+# already exist are counted and skipped) or unordered bulk_write upserts on
+# the collection's natural key in "upsert" mode. Questions default to upsert
+# keyed by date, so reloading a schedule replaces it instead of adding a
+# second question for the same day.
+#
+# Imported users' total_points don't reach group leaderboards until
+# `python3 memberships.py --refresh` is run.
+# Users without a password hash (read_tables.py leaves them out unless
+# --keep-passwords is given) are stored as they are and can't log in until
+# one is set.
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import csv
+from datetime import datetime, timezone
+import gzip
+import io
+import json
+import sys
+import time
+
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from scoring import score_fields
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:
+    loads = json.loads
+
+# How each collection's rows are read and written
+SCHEMAS = {
+    "questions": {
+        "required": ["question", "date"],
+        "ids": ["_id"],
+        "dates": ["date"],
+        "midnight": ["date"],
+        "ints": [],
+        "floats": [],
+        "refs": {},
+        "key": ["date"],
+        "mode": "upsert",
+    },
+    "answers": {
+        "required": ["question_id", "user_id", "answer_text"],
+        "ids": ["_id", "question_id", "user_id"],
+        "dates": ["created_at"],
+        "midnight": [],
+        "ints": ["votes", "appearances", "points"],
+        "floats": ["ratio", "wilson"],
+        "refs": {"question_id": "questions", "user_id": "users"},
+        "key": ["user_id", "question_id"],
+        "mode": "insert",
+    },
+    "users": {
+        "required": ["username"],
+        "ids": ["_id"],
+        "dates": ["created_at", "scored_through"],
+        "midnight": ["scored_through"],
+        "ints": ["total_points"],
+        "floats": [],
+        "refs": {},
+        "key": ["username"],
+        "mode": "insert",
+    },
+}
+
+DATE_FORMATS = ["%m-%d-%Y", "%Y-%m-%d", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M:%S.%f"]
+
+DUPLICATE_KEY = 11000
+
+
+class InvalidRow(ValueError):
+    pass
+
+
+def to_object_id(value, field):
+    if isinstance(value, dict):
+        value = value.get("$oid")
+    if isinstance(value, ObjectId):
+        return value
+    if isinstance(value, str) and len(value) == 24:
+        try:
+            # Much cheaper than ObjectId's own validation of a hex string
+            return ObjectId(bytes.fromhex(value))
+        except ValueError:
+            pass
+    raise InvalidRow(f"{field} is not an ObjectId: {value!r}")
+
+
+def to_datetime(value, field):
+    """A naive datetime, as the app stores them. Values with a time zone
+    (including Extended JSON) are taken in UTC, which is what pymongo reads
+    back for them, so dates exported by read_tables.py come back unchanged."""
+    if isinstance(value, dict):
+        value = value.get("$date")
+        if isinstance(value, dict):
+            value = int(value.get("$numberLong"))
+    if isinstance(value, datetime):
+        parsed = value
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        parsed = datetime.fromtimestamp(value / 1000.0, timezone.utc)
+    elif isinstance(value, str):
+        text = value.strip()
+        if text.endswith("Z"):
+            text = text[:-1] + "+00:00"
+        try:
+            parsed = datetime.fromisoformat(text)
+        except ValueError:
+            for fmt in DATE_FORMATS:
+                try:
+                    parsed = datetime.strptime(text, fmt)
+                    break
+                except ValueError:
+                    continue
+            else:
+                raise InvalidRow(f"{field} is not a date: {value!r}")
+    else:
+        raise InvalidRow(f"{field} is not a date: {value!r}")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def to_midnight(value, field):
+    return to_datetime(value, field).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def to_int(value, field):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise InvalidRow(f"{field} is not an integer: {value!r}")
+
+
+def to_float(value, field):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise InvalidRow(f"{field} is not a number: {value!r}")
+
+
+def converters(schema):
+    """(field, converter) pairs for a schema."""
+    pairs = [(field, to_object_id) for field in schema["ids"]]
+    pairs += [(field, to_midnight if field in schema["midnight"] else to_datetime) for field in schema["dates"]]
+    pairs += [(field, to_int) for field in schema["ints"]]
+    pairs += [(field, to_float) for field in schema["floats"]]
+    return pairs
+
+
+def normalize(schema, fields, row):
+    """The document to store for one input row. Raises InvalidRow."""
+    doc = {key: value for key, value in row.items() if value is not None and value != ""}
+    for field in schema["required"]:
+        if field not in doc:
+            raise InvalidRow(f"missing {field}")
+    for field, convert in fields:
+        if field in doc:
+            doc[field] = convert(doc[field], field)
+    return doc
+
+
+def complete_answer(doc):
+    doc.setdefault("votes", 0)
+    doc.setdefault("appearances", 0)
+    if "ratio" not in doc or "wilson" not in doc:
+        doc.update(score_fields(doc["votes"], doc["appearances"]))
+    doc.setdefault("created_at", datetime.utcnow())
+    return doc
+
+
+def complete_user(doc):
+    doc.setdefault("total_points", 0)
+    doc.setdefault("created_at", datetime.utcnow())
+    return doc
+
+
+COMPLETE = {"answers": complete_answer, "users": complete_user}
+
+
+def open_input(path):
+    raw = sys.stdin.buffer if path == "-" else open(path, "rb")
+    if path.endswith(".gz"):
+        raw = gzip.open(raw)
+    return raw
+
+
+def read_rows(stream, fmt):
+    """(line number, row dict) for each input row. A line that isn't a JSON
+    object comes back as an InvalidRow in place of the row, so it can be
+    reported and skipped without ending the import."""
+    if fmt == "csv":
+        reader = csv.DictReader(io.TextIOWrapper(stream, encoding="utf-8", newline=""))
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = loads(line)
+        except ValueError as e:
+            row = InvalidRow(f"not JSON ({e})")
+        if not isinstance(row, (dict, InvalidRow)):
+            row = InvalidRow("expected an object")
+        yield number, row
+
+
+def input_format(path, fmt):
+    if fmt:
+        return fmt
+    name = path[:-3] if path.endswith(".gz") else path
+    return "csv" if name.endswith(".csv") else "ndjson"
+
+
+class ReferenceCheck:
+    """Checks ObjectId references exist, one $in query per field per batch."""
+
+    def __init__(self, db, refs):
+        self.db = db
+        self.refs = refs
+        self.known = {field: set() for field in refs}
+
+    def missing(self, docs):
+        """{id(doc): error} for docs whose references don't exist."""
+        errors = {}
+        for field, collection in self.refs.items():
+            known = self.known[field]
+            unknown = {doc[field] for doc in docs} - known
+            if unknown:
+                known.update(self.db[collection].distinct("_id", {"_id": {"$in": list(unknown)}}))
+            for doc in docs:
+                if doc[field] not in known:
+                    errors[id(doc)] = f"{field} {doc[field]} is not in {collection}"
+        return errors
+
+
+class Importer:
+    def __init__(self, db, collection, mode):
+        self.collection = db[collection]
+        self.schema = SCHEMAS[collection]
+        self.mode = mode
+        self.inserted = 0
+        self.upserted = 0
+        self.updated = 0
+        self.duplicates = 0
+
+    def write(self, docs):
+        if self.mode == "upsert":
+            return self._upsert(docs)
+        try:
+            result = self.collection.insert_many(docs, ordered=False)
+            return len(result.inserted_ids), 0, 0, 0
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            others = [error for error in errors if error.get("code") != DUPLICATE_KEY]
+            if others:
+                raise
+            return e.details.get("nInserted", 0), 0, 0, len(errors)
+
+    def _upsert(self, docs):
+        operations = []
+        for doc in docs:
+            key = {field: doc[field] for field in self.schema["key"]}
+            fields = {k: v for k, v in doc.items() if k != "_id"}
+            update = {"$set": fields}
+            if "_id" in doc:
+                update["$setOnInsert"] = {"_id": doc["_id"]}
+            operations.append(UpdateOne(key, update, upsert=True))
+        result = self.collection.bulk_write(operations, ordered=False)
+        return 0, result.upserted_count, result.modified_count, 0
+
+    def record(self, counts):
+        inserted, upserted, updated, duplicates = counts
+        self.inserted += inserted
+        self.upserted += upserted
+        self.updated += updated
+        self.duplicates += duplicates
+
+
+def batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def run(db, args):
+    schema = SCHEMAS[args.collection]
+    fields = converters(schema)
+    complete = COMPLETE.get(args.collection)
+    check = ReferenceCheck(db, schema["refs"]) if args.validate and schema["refs"] else None
+    importer = Importer(db, args.collection, args.mode or schema["mode"])
+    read = invalid = 0
+    started = time.monotonic()
+    pending = []
+
+    def reject(where, error):
+        nonlocal invalid
+        invalid += 1
+        if args.strict:
+            raise SystemExit(f"{where}: {error}")
+        if invalid <= args.max_errors:
+            print(f"{where}: {error}", file=sys.stderr)
+
+    with open_input(args.file) as stream, ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        for batch in batches(read_rows(stream, input_format(args.file, args.format)), args.batch_size):
+            docs = []
+            for number, row in batch:
+                read += 1
+                if isinstance(row, InvalidRow):
+                    reject(f"row {number}", row)
+                    continue
+                try:
+                    doc = normalize(schema, fields, row)
+                    docs.append((number, complete(doc) if complete else doc))
+                except InvalidRow as e:
+                    reject(f"row {number}", e)
+            if check is not None and docs:
+                errors = check.missing([doc for _, doc in docs])
+                for number, doc in docs:
+                    if id(doc) in errors:
+                        reject(f"row {number}", errors[id(doc)])
+                docs = [(number, doc) for number, doc in docs if id(doc) not in errors]
+            if not docs or args.dry_run:
+                continue
+            pending.append(pool.submit(importer.write, [doc for _, doc in docs]))
+            # Bound the batches in flight so memory stays flat
+            while len(pending) >= 2 * args.workers:
+                importer.record(pending.pop(0).result())
+        for future in pending:
+            importer.record(future.result())
+
+    seconds = time.monotonic() - started
+    return {
+        "collection": args.collection,
+        "read": read,
+        "invalid": invalid,
+        "inserted": importer.inserted,
+        "upserted": importer.upserted,
+        "updated": importer.updated,
+        "duplicates": importer.duplicates,
+        "seconds": round(seconds, 2),
+        "docs_per_sec": round(read / seconds) if seconds else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import questions, answers or users from NDJSON or CSV")
+    parser.add_argument("collection", choices=sorted(SCHEMAS))
+    parser.add_argument("file", help="input file (.ndjson, .jsonl or .csv, optionally .gz), or - for stdin")
+    parser.add_argument("--format", choices=["ndjson", "csv"], help="default: from the file name")
+    parser.add_argument("--mode", choices=["insert", "upsert"],
+                        help="default: upsert for questions, insert otherwise")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=4, help="batches written at once")
+    parser.add_argument("--no-validate", dest="validate", action="store_false",
+                        help="don't check that referenced questions and users exist")
+    parser.add_argument("--strict", action="store_true", help="stop at the first invalid row")
+    parser.add_argument("--max-errors", type=int, default=20, help="invalid rows to print")
+    parser.add_argument("--dry-run", action="store_true", help="check the input without writing")
+    args = parser.parse_args()
+
+    from db import get_db
+    from indexes import ensure_indexes
+    db = get_db()
+    # The unique indexes are what turn repeated rows into skipped duplicates
+    ensure_indexes(db)
+    print(json.dumps(run(db, args)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# Declares the MongoDB indexes the backend relies on, creates them, and checks
+# that every route's query is served by one.
+#
+#   python3 indexes.py            # create any missing indexes (idempotent)
+#   python3 indexes.py --check    # explain each route's query, exit 1 if any
+#                                 # of them scans a whole collection
+#
+# Setting ENSURE_INDEXES=true also creates them when server.py starts.
+#
+# A route that queries a new field needs its index in INDEXES and its query in
+# route_queries(), so --check keeps covering it.
+
+import argparse
+import sys
+
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+from db import get_db
+from question_cache import local_midnight
+from sessions import session_tokens
+
+# (collection, keys, options)
+INDEXES = [
+    ("questions", [("date", ASCENDING)], {}),
+    ("users", [("username", ASCENDING)], {"unique": True}),
+    # Global leaderboard order (see leaderboard_cache.py); also serves ranks
+    ("users", [("total_points", DESCENDING), ("_id", ASCENDING)], {}),
+    ("groups", [("group_name", ASCENDING)], {"unique": True}),
+    # One answer per user per question. Also serves lookups by user_id alone.
+    ("answers", [("user_id", ASCENDING), ("question_id", ASCENDING)], {"unique": True}),
+    # Answer leaderboards sort on the stored scores (see scoring.py). Their
+    # question_id prefix serves every other lookup by question.
+    ("answers", [("question_id", ASCENDING), ("ratio", DESCENDING), ("_id", ASCENDING)], {}),
+    ("answers", [("question_id", ASCENDING), ("wilson", DESCENDING), ("_id", ASCENDING)], {}),
+    # A user's answers by votes and by date (see user_answers_pipeline)
+    ("answers", [("user_id", ASCENDING), ("votes", DESCENDING), ("_id", ASCENDING)], {}),
+    ("answers", [("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], {}),
+    # One document per (group, user), see memberships.py
+    ("memberships", [("group_id", ASCENDING), ("user_id", ASCENDING)], {"unique": True}),
+    ("memberships", [("user_id", ASCENDING), ("group_id", ASCENDING)], {}),
+    # Materialized group leaderboards
+    ("memberships", [("group_id", ASCENDING), ("total_points", DESCENDING), ("_id", ASCENDING)], {}),
+    # Days closed by daily_scores.py
+    ("score_runs", [("date", ASCENDING)], {"unique": True}),
+    # A revocation only matters until the tokens it voids have expired
+    ("revoked_sessions", [("revoked_at", ASCENDING)], {"expireAfterSeconds": int(session_tokens.ttl)}),
+]
+
+
+def route_queries():
+    """(route, explainable command) for the queries the routes issue.
+
+    Each command has the same filter and sort shape as the route's query;
+    the values are placeholders, since the planner only looks at the shape.
+    """
+    # server imports Flask, which creating indexes doesn't need.
+    from server import answer_leaderboard_pipeline, user_answers_pipeline
+
+    today = local_midnight()
+    user_id, question_id, group_id = ObjectId(), ObjectId(), ObjectId()
+    return [
+        ("/today/get-question/",
+         {"find": "questions", "filter": {"date": today}, "limit": 1}),
+        ("/questions",
+         {"find": "questions", "filter": {"date": {"$in": [today, local_midnight(days_ago=1)]}}}),
+        ("/today/has-answered/<user_id>, /answer",
+         {"find": "answers", "filter": {"user_id": user_id, "question_id": question_id}, "limit": 1}),
+        ("/user/<user_id>/top-answers, /user/<user_id>/answers?sort=votes",
+         {"aggregate": "answers", "cursor": {}, "pipeline": user_answers_pipeline(user_id, "votes", 20, (5, question_id))}),
+        ("/user/<user_id>/answers?sort=date",
+         {"aggregate": "answers", "cursor": {}, "pipeline": user_answers_pipeline(
+             user_id, "date", 20, (today, question_id))}),
+        ("/user/<user_id>/ranking",
+         {"count": "users", "query": {"total_points": {"$gt": 0}}}),
+        ("/leaderboard",
+         {"find": "users", "filter": {}, "sort": {"total_points": -1, "_id": 1}, "limit": 1000}),
+        ("/leaderboard?cursor=",
+         {"find": "users", "filter": {"$or": [{"total_points": {"$lt": 10}}, {"total_points": 10, "_id": {"$gt": user_id}}]},
+          "sort": {"total_points": -1, "_id": 1}, "limit": 1000}),
+        ("/user/login, /user/register, /user/username/<username>",
+         {"find": "users", "filter": {"username": "username"}, "limit": 1}),
+        ("/groups/create-group, /groups/join-group",
+         {"find": "groups", "filter": {"group_name": "group"}, "limit": 1}),
+        ("/groups/get-groups/<username>, /user/login",
+         {"find": "memberships", "filter": {"user_id": user_id}}),
+        ("/groups/get-groups/<username>",
+         {"find": "groups", "filter": {"_id": {"$in": [group_id]}}}),
+        ("/groups/<group_name>/answer-leaderboard/<question_id>",
+         {"find": "memberships", "filter": {"group_id": group_id}, "projection": {"user_id": 1, "_id": 0}}),
+        ("/groups/leaderboard/<group_name>",
+         {"find": "memberships", "filter": {"group_id": group_id},
+          "sort": {"total_points": -1, "_id": 1}, "skip": 20, "limit": 10}),
+        ("/groups/leaderboard/<group_name>?around=<user_id>",
+         {"count": "memberships", "query": {"group_id": group_id, "$or": [
+             {"total_points": {"$gt": 10}}, {"total_points": 10, "_id": {"$lt": user_id}}]}}),
+        ("/question/<question_id>/get_pair",
+         {"find": "answers", "filter": {"question_id": question_id}}),
+        ("/question/<question_id>/matchup",
+         {"count": "answers", "query": {"_id": {"$in": [user_id, question_id]}, "question_id": question_id}}),
+        ("/question/<question_id>/answer_leaderboard?score=ratio",
+         {"aggregate": "answers", "cursor": {},
+          "pipeline": answer_leaderboard_pipeline({"question_id": question_id}, "ratio", 20)}),
+        ("/question/<question_id>/answer_leaderboard?score=wilson",
+         {"aggregate": "answers", "cursor": {},
+          "pipeline": answer_leaderboard_pipeline({"question_id": question_id}, "wilson", 20)}),
+        ("/groups/<group_name>/answer-leaderboard/<question_id>",
+         {"aggregate": "answers", "cursor": {},
+          "pipeline": answer_leaderboard_pipeline(
+              {"question_id": question_id, "user_id": {"$in": [user_id]}}, "ratio", 20)}),
+    ]
+
+
+def ensure_indexes(db=None):
+    """Create every declared index. Safe to run repeatedly."""
+    db = db if db is not None else get_db()
+    created = []
+    for collection, keys, options in INDEXES:
+        try:
+            created.append((collection, db[collection].create_index(keys, **options)))
+        except OperationFailure as e:
+            # Usually existing duplicates blocking a unique index
+            raise RuntimeError(f"Could not create {collection} index {keys}: {e}") from e
+    return created
+
+
+def _find(value, key):
+    """Every value stored under `key` anywhere in a nested explain output."""
+    if isinstance(value, dict):
+        for k, v in value.items():
+            if k == key:
+                yield v
+            yield from _find(v, key)
+    elif isinstance(value, list):
+        for v in value:
+            yield from _find(v, key)
+
+
+def plan_stages(explain):
+    """The stages of the winning plans in an explain() result.
+
+    Aggregations nest their plans (and the server version decides where),
+    so this walks the whole document rather than a fixed path.
+    """
+    return {stage for plan in _find(explain, "winningPlan") for stage in _find(plan, "stage")}
+
+
+def check_query_plans(db=None):
+    """Explain every route query. Returns [(route, stages, ok)]."""
+    db = db if db is not None else get_db()
+    results = []
+    for route, command in route_queries():
+        stages = plan_stages(db.command("explain", command, verbosity="queryPlanner"))
+        results.append((route, sorted(stages), bool(stages) and "COLLSCAN" not in stages))
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Create and verify the MongoDB indexes")
+    parser.add_argument("--check", action="store_true",
+                        help="explain each route's query and fail on collection scans")
+    args = parser.parse_args()
+
+    if args.check:
+        failed = False
+        for route, stages, ok in check_query_plans():
+            print(f"{'ok  ' if ok else 'FAIL'} {route}: {', '.join(stages) or 'no plan'}")
+            failed = failed or not ok
+        sys.exit(1 if failed else 0)
+
+    for collection, name in ensure_indexes():
+        print(f"{collection}.{name}")
@@ -0,0 +1,125 @@
+# In-process cache of the global leaderboard's top LEADERBOARD_CACHE_SIZE
+# users.
+#
+# /leaderboard with any limit up to that size is served from memory. Point
+# changes made by this process (see ranking.points_changed) are patched into
+# the cached list as they happen; changes made elsewhere, such as a
+# daily_scores.py run, are picked up by a background reload every
+# LEADERBOARD_CACHE_TTL seconds, or right away after invalidate().
+#
+# Entries are ordered by (total_points desc, _id asc), the same order as the
+# users (total_points, _id) index, so a page that continues past the cache is
+# a keyset query on that index starting after the last cached entry.
+
+from bisect import insort
+
+from pymongo import ASCENDING, DESCENDING
+
+from settings import get_setting
+from snapshots import Snapshot
+
+LEADERBOARD_FIELDS = {"username": 1, "total_points": 1, "avatar_url": 1, "name": 1}
+
+LEADERBOARD_ORDER = [("total_points", DESCENDING), ("_id", ASCENDING)]
+
+
+def sort_key(user):
+    return (-user.get("total_points", 0), user["_id"])
+
+
+def after_filter(points, user_id):
+    """Users that come after (points, user_id) in leaderboard order."""
+    return {"$or": [
+        {"total_points": {"$lt": points}},
+        {"total_points": points, "_id": {"$gt": user_id}}
+    ]}
+
+
+class _Entry:
+    __slots__ = ("key", "user")
+
+    def __init__(self, key, user):
+        self.key = key
+        self.user = user
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+
+class TopUsers(Snapshot):
+    """The first `size` users in leaderboard order.
+
+    The cached entries are always a correct prefix of the real leaderboard.
+    When a change leaves it unclear who comes next (a cached user falls out
+    of the cached range, or an unknown user climbs into it), the cache
+    shrinks to what it still knows and reloads in the background.
+    """
+
+    def __init__(self, size=1000, ttl=60):
+        super().__init__(ttl)
+        self.size = size
+        self._entries = []
+        self._by_user = {}
+        # Whether every user is cached, i.e. there's nobody after the last entry
+        self._holds_all = False
+        self.version = 0
+
+    def load(self, users):
+        entries = [_Entry(sort_key(user), user) for user in
+                   users.find({}, LEADERBOARD_FIELDS).sort(LEADERBOARD_ORDER).limit(self.size)]
+        with self._lock:
+            self._entries = entries
+            self._by_user = {entry.user["_id"]: entry for entry in entries}
+            self._holds_all = len(entries) < self.size
+            self.version += 1
+            self._loaded()
+
+    def top(self, users, limit):
+        """(version, the first `limit` users), or None if the cache doesn't
+        know that many right now."""
+        self._ensure_fresh(users)
+        with self._lock:
+            if limit > len(self._entries) and not self._holds_all:
+                return None
+            return self.version, [entry.user for entry in self._entries[:limit]]
+
+    def set_points(self, user_id, points, profile=None):
+        """Patch in a user's new total. `profile` (LEADERBOARD_FIELDS) is
+        needed to add a user who isn't cached yet."""
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            entry = self._by_user.pop(user_id, None)
+            if entry is not None:
+                self._entries.remove(entry)
+                profile = entry.user
+            key = (-points, user_id)
+            last = self._entries[-1] if self._entries else None
+
+            if self._holds_all or (last is not None and key < last.key):
+                if profile is None:
+                    # They belong in the cache but we can't show them; keep
+                    # only the entries ahead of them.
+                    self._entries = [e for e in self._entries if e.key < key]
+                    self._by_user = {e.user["_id"]: e for e in self._entries}
+                    self._holds_all = False
+                else:
+                    user = {field: profile[field] for field in LEADERBOARD_FIELDS if field in profile}
+                    new = _Entry(key, {**user, "_id": user_id, "total_points": points})
+                    insort(self._entries, new)
+                    self._by_user[user_id] = new
+                    if len(self._entries) > self.size:
+                        dropped = self._entries.pop()
+                        del self._by_user[dropped.user["_id"]]
+                        self._holds_all = False
+            elif entry is None:
+                return
+            if len(self._entries) < self.size and not self._holds_all:
+                self._loaded_at = 0
+            self.version += 1
+
+
+top_users = TopUsers(
+    size=get_setting("LEADERBOARD_CACHE_SIZE", 1000, int),
+    ttl=get_setting("LEADERBOARD_CACHE_TTL", 60, float),
+)
@@ -0,0 +1,88 @@
+# Structured logging.
+#
+# Every record is written to stderr as one JSON line:
+#
+#   {"ts": 1742000000.123, "level": "error", "logger": "server",
+#    "event": "get_pair_failed", "question_id": "...", "error": "..."}
+#
+# Warnings and errors are always written. Records below WARNING are sampled:
+# only a LOG_SAMPLE_RATE fraction of them is kept, so a per-request log line
+# costs almost nothing on the hot routes while still showing what normal
+# traffic looks like.
+
+import logging
+import random
+import sys
+
+from serialization import dumps
+from settings import get_setting
+
+LOG_LEVEL = get_setting("LOG_LEVEL", "INFO").upper()
+
+LOG_SAMPLE_RATE = get_setting("LOG_SAMPLE_RATE", 0.01, float)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "event": record.getMessage(),
+            **getattr(record, "fields", {})
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return dumps(entry).decode("utf-8")
+
+
+class Sampler(logging.Filter):
+    """Keeps every WARNING and above, and `rate` of everything else."""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+class EventLogger:
+    """logging.Logger with an event name and keyword fields per record."""
+
+    def __init__(self, logger):
+        self._logger = logger
+
+    def _log(self, level, event, fields, exc_info=False):
+        if self._logger.isEnabledFor(level):
+            self._logger.log(level, event, exc_info=exc_info, extra={"fields": fields})
+
+    def debug(self, event, **fields):
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event, **fields):
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event, **fields):
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event, **fields):
+        self._log(logging.ERROR, event, fields)
+
+    def exception(self, event, **fields):
+        """error() with the traceback of the exception being handled."""
+        self._log(logging.ERROR, event, fields, exc_info=True)
+
+
+_root = logging.getLogger("backend")
+if not _root.handlers:
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(JsonFormatter())
+    _handler.addFilter(Sampler(LOG_SAMPLE_RATE))
+    _root.addHandler(_handler)
+    _root.setLevel(LOG_LEVEL)
+    _root.propagate = False
+
+
+def get_logger(name):
+    return EventLogger(_root.getChild(name))
@@ -0,0 +1,196 @@
+# Group membership.
+#
+# Each membership is its own document in the memberships collection:
+#
+#   {group_id, user_id, group_name, joined_at,
+#    username, name, avatar_url, total_points}
+#
+# keyed by the group's and user's ObjectIds. Joining checks for an existing
+# membership and inserts one; the unique (group_id, user_id) index rejects
+# the second of two concurrent joins, and the (user_id, group_id) index lists
+# a user's groups. Groups keep a group_size counter next to their name and
+# password, so no document grows with the size of a group.
+#
+# The profile fields are copies of the member's user document, which makes
+# the memberships of a group its materialized leaderboard: the
+# (group_id, total_points, _id) index serves any page of it, or the window
+# around one member, as a single indexed read. Whatever changes a user's
+# total_points must apply the same change to their memberships, as
+# daily_scores.close_day() does, so the copies follow.
+#
+# Older data kept usernames in groups.members and group names in
+# users.groups. Convert it once with:
+#
+#   python3 memberships.py --migrate
+#
+# and, should the copies ever drift from the users collection, re-copy them
+# with --refresh.
+
+import argparse
+from datetime import datetime
+
+from pymongo import ASCENDING, DESCENDING, UpdateMany, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+
+PROFILE_PROJECTION = {"username": 1, "name": 1, "avatar_url": 1, "total_points": 1, "scored_through": 1}
+
+LEADERBOARD_ORDER = [("total_points", DESCENDING), ("_id", ASCENDING)]
+
+
+def profile_fields(user):
+    return {
+        "username": user.get("username", ""),
+        "name": user.get("name", ""),
+        "avatar_url": user.get("avatar_url", ""),
+        "total_points": user.get("total_points", 0),
+        # The last day whose points total_points includes (daily_scores.py)
+        "scored_through": user.get("scored_through")
+    }
+
+
+def add_member(db, group, user):
+    """Add a user to a group. Returns False if they already belong to it.
+
+    `user` is the user's document, with at least PROFILE_PROJECTION.
+    """
+    user_id = user["_id"]
+    # The unique index only exists once indexes.py has run, so check first;
+    # the index still settles two concurrent joins.
+    if db["memberships"].find_one({"group_id": group["_id"], "user_id": user_id}, {"_id": 1}):
+        return False
+    membership = {
+        "group_id": group["_id"],
+        "user_id": user_id,
+        "group_name": group["group_name"],
+        "joined_at": datetime.utcnow(),
+        **profile_fields(user)
+    }
+    try:
+        db["memberships"].insert_one(membership)
+    except DuplicateKeyError:
+        return False
+    db["groups"].update_one({"_id": group["_id"]}, {"$inc": {"group_size": 1}})
+    return True
+
+
+def leaderboard(db, group_id, offset=0, limit=None):
+    """Members of a group by points, highest first."""
+    cursor = db["memberships"].find(
+        {"group_id": group_id},
+        {"user_id": 1, **PROFILE_PROJECTION}
+    ).sort(LEADERBOARD_ORDER).skip(offset)
+    if limit is not None:
+        cursor = cursor.limit(limit)
+    return list(cursor)
+
+
+def position(db, group_id, user_id):
+    """A member's 0-based place in leaderboard(), or None if not a member."""
+    member = db["memberships"].find_one({"group_id": group_id, "user_id": user_id}, {"total_points": 1})
+    if member is None:
+        return None
+    points = member.get("total_points", 0)
+    return db["memberships"].count_documents({
+        "group_id": group_id,
+        "$or": [
+            {"total_points": {"$gt": points}},
+            {"total_points": points, "_id": {"$lt": member["_id"]}}
+        ]
+    })
+
+
+def member_ids(db, group_id):
+    return [m["user_id"] for m in db["memberships"].find({"group_id": group_id}, {"user_id": 1, "_id": 0})]
+
+
+def user_memberships(db, user_id):
+    """A user's memberships, oldest first."""
+    memberships = list(db["memberships"].find({"user_id": user_id}, {"group_id": 1, "group_name": 1}))
+    memberships.sort(key=lambda m: m["_id"])
+    return memberships
+
+
+def migrate(db):
+    """Move groups.members and users.groups into memberships. Safe to rerun."""
+    groups = db["groups"]
+    users = db["users"]
+    memberships = db["memberships"]
+
+    names = {}
+    for group in groups.find({"members": {"$exists": True}}, {"group_name": 1, "members": 1}):
+        names.setdefault(group["group_name"], set()).update(group.get("members") or [])
+    for user in users.find({"groups": {"$exists": True}}, {"username": 1, "groups": 1}):
+        for group_name in user.get("groups") or []:
+            names.setdefault(group_name, set()).add(user["username"])
+
+    created = 0
+    migrated_at = datetime.utcnow()
+    for group_name, usernames in names.items():
+        group = groups.find_one({"group_name": group_name}, {"group_name": 1})
+        if group is None:
+            continue
+        operations = [
+            UpdateOne(
+                {"group_id": group["_id"], "user_id": user["_id"]},
+                {"$setOnInsert": {
+                    "group_name": group_name,
+                    "username": user["username"],
+                    "joined_at": migrated_at
+                }},
+                upsert=True
+            )
+            for user in users.find({"username": {"$in": list(usernames)}}, {"username": 1})
+        ]
+        if operations:
+            created += memberships.bulk_write(operations, ordered=False).upserted_count
+
+    # Recount every group, including ones that never had a members array
+    sizes = {
+        row["_id"]: row["size"]
+        for row in memberships.aggregate([{"$group": {"_id": "$group_id", "size": {"$sum": 1}}}])
+    }
+    operations = [
+        UpdateOne({"_id": group["_id"]}, {"$set": {"group_size": sizes.get(group["_id"], 0)}, "$unset": {"members": ""}})
+        for group in groups.find({}, {"_id": 1})
+    ]
+    if operations:
+        groups.bulk_write(operations, ordered=False)
+    users.update_many({"groups": {"$exists": True}}, {"$unset": {"groups": ""}})
+    refresh(db)
+    return created
+
+
+def refresh(db, batch_size=1000):
+    """Re-copy every member's profile from users. Returns members updated."""
+    user_ids = db["memberships"].distinct("user_id")
+    updated = 0
+    for start in range(0, len(user_ids), batch_size):
+        operations = [
+            UpdateMany({"user_id": user["_id"]}, {"$set": profile_fields(user)})
+            for user in db["users"].find({"_id": {"$in": user_ids[start:start + batch_size]}}, PROFILE_PROJECTION)
+        ]
+        if operations:
+            updated += db["memberships"].bulk_write(operations, ordered=False).matched_count
+    return updated
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Maintain group memberships")
+    parser.add_argument("--migrate", action="store_true",
+                        help="convert groups.members and users.groups into membership documents")
+    parser.add_argument("--refresh", action="store_true",
+                        help="re-copy every member's points and profile from users")
+    args = parser.parse_args()
+    if args.migrate:
+        from db import get_db
+        from indexes import ensure_indexes
+        db = get_db()
+        # The unique index is what makes the upserts safe to rerun
+        ensure_indexes(db)
+        print(f"created {migrate(db)} memberships")
+    elif args.refresh:
+        from db import get_db
+        print(f"refreshed {refresh(get_db())} memberships")
+    else:
+        parser.print_help()
@@ -0,0 +1,228 @@
+# Request and MongoDB instrumentation, served from /metrics in the
+# Prometheus text format.
+#
+#   http_request_duration_seconds      route latency by route, method, status
+#   mongo_command_duration_seconds     every command the driver sends, by name
+#   mongo_command_failures_total       commands the server rejected
+#   mongo_pool_checkout_seconds        time spent waiting for a pooled connection
+#   mongo_pool_checkout_failures_total checkouts that gave up, by reason
+#   mongo_pool_connections_in_use      connections currently checked out
+#   counter_buffer_*                   write-behind vote counters (counters.py)
+#
+# The MongoDB numbers come from pymongo's command and pool monitoring
+# listeners, which db.py registers on every client. Routes are labelled with
+# their URL rule ("/user/<user_id>"), never the raw path, so the number of
+# series stays fixed.
+#
+# The metrics live in process memory: each worker process reports its own,
+# and a scraper should treat every process as a separate target.
+
+from bisect import bisect_left
+import threading
+
+from pymongo import monitoring
+
+from logs import get_logger
+from settings import get_flag, get_setting
+
+METRICS_ENABLED = get_flag("METRICS", True)
+
+# Requests slower than this are always logged, not just sampled
+SLOW_REQUEST_SECONDS = get_setting("LOG_SLOW_REQUEST_MS", 1000, float) / 1000.0
+
+log = get_logger("requests")
+
+# Seconds; covers cache hits (sub-millisecond) up to a slow Atlas round trip
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines += self._render_items(items)
+        return lines
+
+    def _render_items(self, items):
+        return [f"{self.name}{_labels(self.labels, key)} {_number(value)}" for key, value in items]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def add(self, amount, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+
+class FunctionGauge(_Metric):
+    """A gauge whose value is read from `function` at scrape time."""
+    kind = "gauge"
+
+    def __init__(self, name, help, function):
+        super().__init__(name, help)
+        self.function = function
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}",
+                f"{self.name} {_number(self.function())}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), then the sum
+                series = self._values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def _render_items(self, items):
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                le = bound if bound == "+Inf" else _number(float(bound))
+                lines.append(f"{self.name}_bucket{_labels(self.labels, key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {_number(series[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+request_seconds = registry.register(Histogram(
+    "http_request_duration_seconds", "Time to handle a request.", ["route", "method", "status"]))
+mongo_command_seconds = registry.register(Histogram(
+    "mongo_command_duration_seconds", "Round trip time of MongoDB commands.", ["command"]))
+mongo_command_failures = registry.register(Counter(
+    "mongo_command_failures_total", "MongoDB commands that returned an error.", ["command"]))
+pool_checkout_seconds = registry.register(Histogram(
+    "mongo_pool_checkout_seconds", "Time spent waiting to check a connection out of the pool."))
+pool_checkout_failures = registry.register(Counter(
+    "mongo_pool_checkout_failures_total", "Connection checkouts that failed.", ["reason"]))
+pool_in_use = registry.register(Gauge(
+    "mongo_pool_connections_in_use", "Connections currently checked out of the pool."))
+
+
+class CommandMetrics(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        mongo_command_seconds.observe(event.duration_micros / 1e6, event.command_name)
+
+    def failed(self, event):
+        mongo_command_seconds.observe(event.duration_micros / 1e6, event.command_name)
+        mongo_command_failures.inc(event.command_name)
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pool_checkout_seconds.observe(event.duration)
+        pool_checkout_failures.inc(event.reason)
+
+    def connection_checked_out(self, event):
+        pool_checkout_seconds.observe(event.duration)
+        pool_in_use.add(1)
+
+    def connection_checked_in(self, event):
+        pool_in_use.add(-1)
+
+
+def record_request(route, method, status, seconds):
+    """Time a finished request and write its (sampled) log line."""
+    request_seconds.observe(seconds, route, method, status)
+    fields = {"route": route, "method": method, "status": status, "ms": round(seconds * 1000.0, 2)}
+    if status >= 500:
+        log.error("request", **fields)
+    elif seconds >= SLOW_REQUEST_SECONDS:
+        log.warning("slow_request", **fields)
+    else:
+        log.info("request", **fields)
+
+
+def listeners():
+    """event_listeners for a MongoClient, or none while METRICS is off."""
+    return [CommandMetrics(), PoolMetrics()] if METRICS_ENABLED else []
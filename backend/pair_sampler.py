@@ -0,0 +1,295 @@
+# In-memory answer pools for the voting screen.
+#
+# get_pair used to run a $sample aggregation on every call, which for a
+# filtered collection degrades to a random sort over every matching answer.
+# Instead we keep, per recently voted question, the question document and a
+# list of its answers. New answers from create_answer are appended as they are
+# inserted, counter updates from this process are applied in place, and the
+# whole pool is reloaded in the background every PAIR_POOL_TTL seconds to pick
+# up changes made by other processes.
+#
+# Pairs are chosen by a policy (PAIR_POLICY, or ?policy= on the request):
+#
+#   uniform            - two answers uniformly at random
+#   least_appearances  - of a few random candidates, the two shown least,
+#                        so new answers get their first votes quickly
+#   closest_ratio      - a random answer and, of a few random candidates,
+#                        the one whose vote ratio is closest to it, which
+#                        sharpens the ordering at the top of the board
+#
+# Every policy inspects a constant number of answers, so sampling is O(1)
+# regardless of how many answers a question has.
+
+from collections import OrderedDict, deque
+import random
+import threading
+import time
+
+from db import get_db
+from scoring import ratio
+from settings import get_setting
+
+ANSWER_FIELDS = {"question_id": 1, "user_id": 1, "answer_text": 1, "votes": 1, "appearances": 1}
+
+CANDIDATES = 6
+
+POLICIES = {}
+
+
+def policy(name):
+    def register(fn):
+        POLICIES[name] = fn
+        return fn
+    return register
+
+
+@policy("uniform")
+def uniform(answers, rng):
+    return rng.sample(answers, 2)
+
+
+@policy("least_appearances")
+def least_appearances(answers, rng):
+    candidates = rng.sample(answers, min(CANDIDATES, len(answers)))
+    candidates.sort(key=lambda a: a.get("appearances", 0))
+    return candidates[:2]
+
+
+@policy("closest_ratio")
+def closest_ratio(answers, rng):
+    candidates = rng.sample(answers, min(CANDIDATES + 1, len(answers)))
+    anchor = candidates.pop()
+    anchor_ratio = ratio(anchor.get("votes", 0), anchor.get("appearances", 0))
+    opponent = min(candidates, key=lambda a: abs(
+        ratio(a.get("votes", 0), a.get("appearances", 0)) - anchor_ratio))
+    return [anchor, opponent]
+
+
+class AnswerPool:
+    def __init__(self, question, answers):
+        self.question = question
+        self.answers = list(answers)
+        self.by_id = {a["_id"]: a for a in self.answers}
+        self.loaded_at = time.monotonic()
+        self.refreshing = False
+
+    def add(self, answer):
+        if answer["_id"] not in self.by_id:
+            self.by_id[answer["_id"]] = answer
+            self.answers.append(answer)
+
+    def sample(self, policy_name, rng=random):
+        if len(self.answers) < 2:
+            return list(self.answers)
+        return POLICIES[policy_name](self.answers, rng)
+
+
+class PairSampler:
+    def __init__(self, ttl=60, max_questions=16, default_policy="uniform"):
+        self.ttl = ttl
+        self.max_questions = max_questions
+        self.default_policy = default_policy
+        self._pools = OrderedDict()
+        self._answer_question = {}
+        self._lock = threading.Lock()
+
+    def load(self, question_id):
+        db = get_db()
+        question = db["questions"].find_one({"_id": question_id})
+        if question is None:
+            return None
+        answers = db["answers"].find({"question_id": question_id}, ANSWER_FIELDS)
+        return self.install(question, answers)
+
+    def install(self, question, answers):
+        """Replace the pool for a question with freshly loaded documents."""
+        pool = AnswerPool(question, answers)
+        with self._lock:
+            old = self._pools.pop(question["_id"], None)
+            if old is not None:
+                for answer_id in old.by_id:
+                    self._answer_question.pop(answer_id, None)
+            self._pools[question["_id"]] = pool
+            for answer_id in pool.by_id:
+                self._answer_question[answer_id] = question["_id"]
+            while len(self._pools) > self.max_questions:
+                _, evicted = self._pools.popitem(last=False)
+                for answer_id in evicted.by_id:
+                    self._answer_question.pop(answer_id, None)
+        return pool
+
+    def cached(self, question_id):
+        """The pool for a question if one is loaded, refreshing it if stale."""
+        with self._lock:
+            pool = self._pools.get(question_id)
+            if pool is None:
+                return None
+            self._pools.move_to_end(question_id)
+            stale = time.monotonic() - pool.loaded_at >= self.ttl and not pool.refreshing
+            if stale:
+                pool.refreshing = True
+        if stale:
+            threading.Thread(target=self._refresh, args=(pool,), daemon=True).start()
+        return pool
+
+    def _refresh(self, pool):
+        try:
+            self.load(pool.question["_id"])
+        except Exception:
+            pool.refreshing = False
+
+    def pool_for(self, question_id):
+        """The pool for a question, loading it on first use. None if the
+        question doesn't exist."""
+        pool = self.cached(question_id)
+        if pool is None:
+            pool = self.load(question_id)
+        return pool
+
+    def sample(self, question_id, policy_name=None):
+        """Returns (question document, two answer documents), or None."""
+        pool = self.pool_for(question_id)
+        if pool is None:
+            return None
+        return pool.question, pool.sample(policy_name or self.default_policy)
+
+    def add_answer(self, answer):
+        """Make a newly inserted answer available without a reload."""
+        with self._lock:
+            pool = self._pools.get(answer["question_id"])
+            if pool is None:
+                return
+            pool.add({k: answer[k] for k in ["_id", *ANSWER_FIELDS] if k in answer})
+            self._answer_question[answer["_id"]] = answer["question_id"]
+
+    def record(self, answer_id, votes=0, appearances=0):
+        """Apply a counter update made by this process to the pooled copy.
+        Returns the answer's user_id, or None if it isn't pooled."""
+        with self._lock:
+            question_id = self._answer_question.get(answer_id)
+            pool = self._pools.get(question_id) if question_id is not None else None
+            answer = pool.by_id.get(answer_id) if pool is not None else None
+            if answer is None:
+                return None
+            answer["votes"] = answer.get("votes", 0) + votes
+            answer["appearances"] = answer.get("appearances", 0) + appearances
+            return answer.get("user_id")
+
+    def is_current(self, pool):
+        with self._lock:
+            return self._pools.get(pool.question["_id"]) is pool
+
+    def contains(self, question_id, answer_ids):
+        """True if every answer is pooled under this question."""
+        with self._lock:
+            return all(self._answer_question.get(a) == question_id for a in answer_ids)
+
+    def clear(self):
+        with self._lock:
+            self._pools.clear()
+            self._answer_question.clear()
+
+
+class _PairQueue(deque):
+    # The pool the queued pairs were sampled from.
+    pool = None
+
+
+def pair_key(first, second):
+    return frozenset((first["_id"], second["_id"]))
+
+
+class PairPrefetcher:
+    """Ready-made pairs per question for the batched /pairs endpoint.
+
+    Each (question, policy) has a queue of pre-sampled pairs that is topped
+    up from the in-memory pool, so handing out a batch never waits on
+    MongoDB. Pairs a voter has already been shown are remembered per session
+    for `session_ttl` seconds and skipped, as are pairs containing the
+    caller's own answer; those go back on the queue for other voters.
+    """
+
+    def __init__(self, sampler, buffer_size=200, session_ttl=3600, max_sessions=10000):
+        self.sampler = sampler
+        self.buffer_size = buffer_size
+        self.session_ttl = session_ttl
+        self.max_sessions = max_sessions
+        self._queues = {}
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _seen(self, session):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.pop(session, None)
+            if entry is None or now - entry[0] >= self.session_ttl:
+                entry = (now, set())
+            self._sessions[session] = (now, entry[1])
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return entry[1]
+
+    def _refill(self, pool, queue, policy_name):
+        if len(pool.answers) < 2:
+            return
+        while len(queue) < self.buffer_size:
+            queue.append(tuple(pool.sample(policy_name)))
+
+    def take(self, question_id, n, user_id=None, session=None, policy_name=None):
+        """Returns (question document, up to n distinct pairs), or None."""
+        pool = self.sampler.pool_for(question_id)
+        if pool is None:
+            return None
+        policy_name = policy_name or self.sampler.default_policy
+        seen = self._seen(session) if session else set()
+
+        with self._lock:
+            queue = self._queues.get((question_id, policy_name))
+            if queue is None or queue.pool is not pool:
+                # A reloaded pool means fresh answer documents; start over.
+                queue = _PairQueue()
+                self._queues[(question_id, policy_name)] = queue
+                self._queues = {
+                    k: q for k, q in self._queues.items()
+                    if q is queue or self.sampler.is_current(q.pool)
+                }
+            queue.pool = pool
+
+            pairs = []
+            taken = set()
+            skipped = []
+            attempts = 0
+            while len(pairs) < n and attempts < n * 10 + self.buffer_size:
+                if not queue:
+                    self._refill(pool, queue, policy_name)
+                    if not queue:
+                        break
+                pair = queue.popleft()
+                attempts += 1
+                key = pair_key(*pair)
+                if key in taken or key in seen:
+                    skipped.append(pair)
+                elif user_id is not None and any(a.get("user_id") == user_id for a in pair):
+                    skipped.append(pair)
+                else:
+                    pairs.append(pair)
+                    taken.add(key)
+
+            queue.extend(skipped[:max(self.buffer_size - len(queue), 0)])
+            if len(queue) < self.buffer_size // 2:
+                self._refill(pool, queue, policy_name)
+            seen.update(taken)
+        return pool.question, pairs
+
+
+pair_sampler = PairSampler(
+    ttl=get_setting("PAIR_POOL_TTL", 60, float),
+    max_questions=get_setting("PAIR_POOL_QUESTIONS", 16, int),
+    default_policy=get_setting("PAIR_POLICY", "uniform"),
+)
+
+pair_prefetcher = PairPrefetcher(
+    pair_sampler,
+    buffer_size=get_setting("PAIR_PREFETCH_SIZE", 200, int),
+    session_ttl=get_setting("PAIR_SESSION_TTL", 3600, float),
+)
@@ -0,0 +1,180 @@
+# Password hashing for users and groups.
+#
+# werkzeug's scrypt/pbkdf2 hashes are deliberately slow (100ms+ each), and
+# running them on the request thread lets a burst of logins tie up every
+# worker. Here the hashing runs in a small process pool instead, and a
+# host-wide cap (shared by every worker process on the machine through lock
+# files) limits how many hashes run at once, so the cheap read endpoints keep
+# their CPU. A request that can't get a slot within PASSWORD_HASH_TIMEOUT
+# seconds fails with PasswordServiceBusy rather than queueing forever.
+#
+# The hash parameters come from PASSWORD_HASH_METHOD (any werkzeug method
+# string, e.g. "scrypt:16384:8:1" or "pbkdf2:sha256:600000"). Stored hashes
+# record the parameters they were made with, so after a change verify()
+# returns a fresh hash for the caller to save on the next successful login.
+#
+# The pool's processes are spawned rather than forked: by the time the first
+# hash is needed the process already runs MongoDB monitor threads (and maybe
+# the counter flush thread), which a fork would copy in an unknown state.
+# A spawned process imports only this module's dependencies and the main
+# script, as __mp_main__, so the main script must keep its start-up work
+# out of that import (see the ENSURE_INDEXES check in server.py).
+# Where processes can't be started at all, as on Vercel's runtime (no
+# /dev/shm), hashing falls back to the request thread; with VERCEL set it
+# starts there.
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from logs import get_logger
+from settings import get_setting
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to a per-process cap
+    fcntl = None
+
+
+log = get_logger("passwords")
+
+
+class PasswordServiceBusy(Exception):
+    pass
+
+
+class HostSlots:
+    """At most `count` concurrent holders across all processes on the host.
+
+    Each slot is a lock file; holding its flock() is holding the slot. The
+    kernel drops the lock if the holder dies, so a crashed worker can't leak
+    a slot.
+    """
+
+    def __init__(self, count, directory, poll=0.005):
+        self.count = count
+        self.directory = directory
+        self.poll = poll
+        self._local = threading.BoundedSemaphore(count)
+
+    @contextmanager
+    def acquire(self, timeout):
+        deadline = time.monotonic() + timeout
+        if fcntl is None:
+            if not self._local.acquire(timeout=timeout):
+                raise PasswordServiceBusy()
+            try:
+                yield
+            finally:
+                self._local.release()
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        while True:
+            for slot in range(self.count):
+                fd = os.open(os.path.join(self.directory, f"slot-{slot}"), os.O_RDWR | os.O_CREAT, 0o600)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    os.close(fd)
+                    continue
+                try:
+                    yield
+                finally:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                    os.close(fd)
+                return
+            if time.monotonic() >= deadline:
+                raise PasswordServiceBusy()
+            time.sleep(self.poll)
+
+
+class PasswordHasher:
+    def __init__(self, method="scrypt", salt_length=16, workers=2, slots=None, timeout=10.0):
+        self.method = method
+        self.salt_length = salt_length
+        self.workers = workers
+        self.slots = slots
+        self.timeout = timeout
+        self._method_id = None
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        # Like MongoClient, the pool belongs to the process that created it.
+        pid = os.getpid()
+        with self._lock:
+            if self._executor is None or self._executor_pid != pid:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+                self._executor_pid = pid
+            return self._executor
+
+    def _run(self, fn, *args):
+        with self.slots.acquire(self.timeout):
+            if self.workers <= 0:
+                return fn(*args)
+            try:
+                return self._pool().submit(fn, *args).result()
+            except (OSError, NotImplementedError):
+                # No working multiprocessing here; hash in this thread from now on
+                log.exception("password_pool_unavailable")
+                self.shutdown()
+                self.workers = 0
+                return fn(*args)
+            except BrokenProcessPool:
+                # A pool process died; start a new pool next time
+                log.exception("password_pool_broken")
+                self.shutdown()
+                return fn(*args)
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def method_id(self):
+        """The full parameter string stored hashes are compared against,
+        e.g. "scrypt" expands to "scrypt:32768:8:1"."""
+        if self._method_id is None:
+            self._method_id = generate_password_hash("", self.method, 1).split("$", 1)[0]
+        return self._method_id
+
+    def needs_rehash(self, stored):
+        return stored.split("$", 1)[0] != self.method_id()
+
+    def verify(self, stored, password):
+        """Returns (matches, new hash to store or None)."""
+        if not self._run(check_password_hash, stored, password):
+            return False, None
+        if self.needs_rehash(stored):
+            return True, self.hash(password)
+        return True, None
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._executor_pid == os.getpid():
+                self._executor.shutdown(wait=False)
+            self._executor = None
+            self._executor_pid = None
+
+
+# Serverless functions can't start worker processes
+_workers = get_setting("PASSWORD_HASH_WORKERS", 0 if os.environ.get("VERCEL") else 2, int)
+
+password_hasher = PasswordHasher(
+    method=get_setting("PASSWORD_HASH_METHOD", "scrypt"),
+    salt_length=get_setting("PASSWORD_SALT_LENGTH", 16, int),
+    workers=_workers,
+    slots=HostSlots(
+        get_setting("PASSWORD_HASH_CONCURRENCY", max(_workers, 1), int),
+        get_setting("PASSWORD_HASH_LOCK_DIR", os.path.join(tempfile.gettempdir(), "the-other-day-hash-slots")),
+    ),
+    timeout=get_setting("PASSWORD_HASH_TIMEOUT", 10, float),
+)
@@ -0,0 +1,81 @@
+# In-process cache of /user/<user_id>/profile responses.
+#
+# A profile is cached for PROFILE_CACHE_TTL seconds. Changes this process
+# makes drop the affected user's entry right away: votes and appearances on
+# their answers (through server.answer_counted), a new answer, joining or
+# creating a group, and point changes. Changes made by other processes show
+# up once the TTL runs out.
+#
+# A profile read concurrently with an invalidation may already be out of
+# date, so put() only stores it if the user hasn't been invalidated since
+# the read began (see started()).
+
+from collections import OrderedDict
+import threading
+import time
+
+from settings import get_setting
+
+
+class ProfileCache:
+    def __init__(self, ttl=30, size=10000):
+        self.ttl = ttl
+        self.size = size
+        self._entries = OrderedDict()
+        # Invalidations are numbered; _invalidated maps a user to their
+        # latest, and users not in it count as invalidated at _floor.
+        self._tick = 0
+        self._floor = 0
+        self._invalidated = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            stored_at, profile = entry
+            if time.monotonic() - stored_at >= self.ttl:
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return profile
+
+    def started(self):
+        """Call before reading a profile; pass the result to put()."""
+        with self._lock:
+            return self._tick
+
+    def put(self, user_id, profile, started):
+        with self._lock:
+            if self._invalidated.get(user_id, self._floor) > started:
+                return
+            self._entries[user_id] = (time.monotonic(), profile)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._tick += 1
+            self._invalidated[user_id] = self._tick
+            if len(self._invalidated) > self.size:
+                # Forget who was invalidated when; reads already in flight
+                # then aren't stored, which is always safe.
+                self._invalidated.clear()
+                self._floor = self._tick
+
+    def clear(self):
+        """Drop every profile, e.g. after a daily scoring run."""
+        with self._lock:
+            self._entries.clear()
+            self._invalidated.clear()
+            self._tick += 1
+            self._floor = self._tick
+
+
+profile_cache = ProfileCache(
+    ttl=get_setting("PROFILE_CACHE_TTL", 30, float),
+    size=get_setting("PROFILE_CACHE_SIZE", 10000, int),
+)
@@ -0,0 +1,196 @@
+# In-memory cache of the daily questions.
+#
+# The question for a given day never changes once it is scheduled, and the
+# feed asks for today's, yesterday's and the day before yesterday's question on
+# every app open. We keep the last few days' documents in memory together with
+# their serialized JSON so the routes can return the bytes directly.
+#
+# Everything is dropped at local midnight, the same boundary the routes use
+# (datetime.now().replace(hour=0, ...)), so the new day's question is picked
+# up on the first request after rollover.
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+import threading
+import time
+
+from db import get_db
+from serialization import dumps
+from settings import get_setting
+
+CachedQuestion = namedtuple("CachedQuestion", ["doc", "body"])
+
+
+def local_midnight(days_ago=0):
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=days_ago)
+
+
+def serialize_question(doc):
+    return dumps(doc)
+
+
+MAX_QUESTION_RANGE_DAYS = 62
+
+
+def parse_question_dates(args):
+    """The days requested from /questions, newest first.
+
+    Either ?offsets=0,1,2 (days before today) or an inclusive
+    ?from=MM-DD-YYYY&to=MM-DD-YYYY range. Raises ValueError.
+    """
+    if 'offsets' in args:
+        offsets = [int(o) for o in args['offsets'].split(',') if o.strip()]
+        if not offsets or min(offsets) < 0:
+            raise ValueError("offsets must be non-negative integers")
+        offsets = list(dict.fromkeys(offsets))
+        check_day_count(len(offsets))
+        return [local_midnight(days_ago=o) for o in offsets]
+    end = args.get('to')
+    end = datetime.strptime(end, "%m-%d-%Y") if end else local_midnight()
+    start = args.get('from')
+    start = datetime.strptime(start, "%m-%d-%Y") if start else end
+    if start > end:
+        raise ValueError("from must not be after to")
+    # Checked before the list is built, which a wide range would make huge
+    check_day_count((end - start).days + 1)
+    return [end - timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+def relative_to_today(args):
+    """True if the days /questions returns for these args depend on when it
+    is asked: offsets, or a range that ends today by default."""
+    return 'offsets' in args or not args.get('to')
+
+
+def check_day_count(count):
+    if count > MAX_QUESTION_RANGE_DAYS:
+        raise ValueError(f"at most {MAX_QUESTION_RANGE_DAYS} days can be requested at once")
+
+
+def questions_body(dates, found):
+    """The /questions response, assembled from the cached JSON bytes."""
+    missing = [d.strftime("%m-%d-%Y") for d in dates if d not in found]
+    body = b"".join([
+        b'{"questions": [',
+        b", ".join(found[d].body for d in dates if d in found),
+        b'], "missing": ',
+        dumps(missing),
+        b"}",
+    ])
+    return body, not missing
+
+
+class QuestionCache:
+    def __init__(self, days=7, miss_ttl=60):
+        self.days = days
+        # A question may be scheduled after somebody asked for it, so misses
+        # are only remembered briefly.
+        self.miss_ttl = miss_ttl
+        self._entries = {}
+        self._misses = {}
+        self._day = None
+        self._lock = threading.Lock()
+
+    def _rollover(self):
+        today = local_midnight()
+        if self._day != today:
+            with self._lock:
+                if self._day != today:
+                    self._entries = {}
+                    self._misses = {}
+                    self._day = today
+        return today
+
+    def _cacheable(self, today, date):
+        return today - timedelta(days=self.days - 1) <= date <= today
+
+    def get(self, date):
+        """Return the CachedQuestion for a midnight datetime, or None."""
+        return self.get_many([date]).get(date)
+
+    def get_many(self, dates):
+        """Return {date: CachedQuestion} for the dates that have a question.
+
+        Whatever isn't cached is fetched with a single $in query.
+        """
+        today, found, missing = self.lookup(dates)
+        if missing:
+            docs = get_db()["questions"].find({"date": {"$in": missing}})
+            found.update(self.store(today, missing, docs))
+        return found
+
+    def lookup(self, dates):
+        """Split dates into cached entries and the ones that need a query.
+
+        Returns (today, {date: CachedQuestion}, [uncached dates]); pass the
+        query results for the uncached dates to store().
+        """
+        today = self._rollover()
+        found = {}
+        missing = []
+        now = time.monotonic()
+        for date in dates:
+            entry = self._entries.get(date)
+            if entry is not None:
+                found[date] = entry
+                continue
+            missed_at = self._misses.get(date)
+            if missed_at is not None and now - missed_at < self.miss_ttl:
+                continue
+            missing.append(date)
+        return today, found, missing
+
+    def store(self, today, dates, docs):
+        """Cache the question documents queried for `dates`."""
+        by_date = {}
+        for doc in docs:
+            by_date.setdefault(doc["date"], doc)
+
+        found = {}
+        now = time.monotonic()
+        with self._lock:
+            # If midnight passed while we were querying, don't store the
+            # results under the new day.
+            storing = self._day == today
+            for date in dates:
+                doc = by_date.get(date)
+                cacheable = storing and self._cacheable(today, date)
+                if doc is None:
+                    if cacheable:
+                        self._misses[date] = now
+                    continue
+                entry = CachedQuestion(doc, serialize_question(doc))
+                found[date] = entry
+                if cacheable:
+                    self._entries[date] = entry
+                    self._misses.pop(date, None)
+        return found
+
+    def cache_control(self, dates, complete, relative=True):
+        """Cache-Control for a response covering the given days.
+
+        Days before today never change, so a URL naming them by date can be
+        cached forever. A `relative` URL (yesterday, ?offsets=) points at
+        other days after the next local midnight, so like anything that
+        includes today it is only cached until then. A day whose question
+        hasn't been found yet is cached only as long as we remember the miss.
+        """
+        if complete and not relative and max(dates) < local_midnight():
+            return "public, max-age=31536000, immutable"
+        if complete:
+            seconds_left = int((local_midnight(days_ago=-1) - datetime.now()).total_seconds())
+            return f"public, max-age={max(seconds_left, 0)}"
+        return f"public, max-age={int(self.miss_ttl)}"
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            self._misses = {}
+            self._day = None
+
+
+question_cache = QuestionCache(
+    days=get_setting("QUESTION_CACHE_DAYS", 7, int),
+    miss_ttl=get_setting("QUESTION_CACHE_MISS_TTL", 60, float),
+)
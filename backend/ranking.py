@@ -0,0 +1,97 @@
+# Global user ranking.
+#
+# A user's rank is 1 + the number of users with strictly more points, so tied
+# users share a rank. With the users.total_points index that is a single
+# COUNT_SCAN in MongoDB. For very large user bases RANK_INDEX=1 additionally
+# keeps every user's points in a sorted in-process list, which answers the
+# same question with a binary search and no database round trip.
+
+from bisect import bisect_right, insort
+
+from db import get_db
+from leaderboard_cache import top_users
+from profile_cache import profile_cache
+from settings import get_setting, get_flag
+from snapshots import Snapshot
+
+
+def count_rank(users, points):
+    return users.count_documents({"total_points": {"$gt": points}}) + 1
+
+
+class RankIndex(Snapshot):
+    def __init__(self, ttl=300):
+        # The index only sees point changes made by this process, so it is
+        # rebuilt from the database every `ttl` seconds.
+        super().__init__(ttl)
+        self._points = []
+        self._by_user = {}
+
+    def load(self, users):
+        by_user = {}
+        for user in users.find({}, {"total_points": 1}).batch_size(10000):
+            by_user[user["_id"]] = user.get("total_points", 0)
+        points = sorted(by_user.values())
+        with self._lock:
+            self._by_user = by_user
+            self._points = points
+            self._loaded()
+
+    def rank(self, users, user_id):
+        """Return (rank, total_users), or None if the user isn't indexed."""
+        self._ensure_fresh(users)
+        with self._lock:
+            points = self._by_user.get(user_id)
+            if points is None:
+                return None
+            above = len(self._points) - bisect_right(self._points, points)
+            return above + 1, len(self._points)
+
+    def set_points(self, user_id, points):
+        """Record a user's new point total (or a newly registered user)."""
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            old = self._by_user.get(user_id)
+            if old is not None:
+                index = bisect_right(self._points, old) - 1
+                del self._points[index]
+            insort(self._points, points)
+            self._by_user[user_id] = points
+
+
+rank_index = RankIndex(ttl=get_setting("RANK_INDEX_TTL", 300, float)) if get_flag("RANK_INDEX") else None
+
+
+def get_rank(user_id):
+    """Return (rank, total_users) for a user ObjectId, or None if unknown."""
+    users = get_db()["users"]
+    if rank_index is not None:
+        ranked = rank_index.rank(users, user_id)
+        if ranked is not None:
+            return ranked
+
+    user = users.find_one({"_id": user_id}, {"total_points": 1})
+    if user is None:
+        return None
+    return count_rank(users, user.get("total_points", 0)), users.estimated_document_count()
+
+
+def points_changed(user_id, points, profile=None):
+    """Tell the in-process rank index, leaderboard cache and profile cache
+    about a user's new total. `profile` lets a user who isn't cached yet
+    join the cached leaderboard (see leaderboard_cache.py)."""
+    if rank_index is not None:
+        rank_index.set_points(user_id, points)
+    top_users.set_points(user_id, points, profile)
+    profile_cache.invalidate(user_id)
+
+
+def all_points_changed(users):
+    """After a bulk change such as daily_scores.close_day(): rebuild the rank
+    index now, so no request ranks from the old points, and have the
+    leaderboard and profile caches reload."""
+    if rank_index is not None:
+        rank_index.load(users)
+    top_users.invalidate()
+    profile_cache.clear()
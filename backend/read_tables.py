@@ -1,33 +1,235 @@
 #!/usr/bin/env python3
-# Python script used to read each table.
-
-from dotenv import dotenv_values
-from pymongo import MongoClient
-import ssl
-import certifi
-
-config = dotenv_values("../.env")
-ca = certifi.where()
-client = MongoClient(config["ATLAS_URI"],  tlsCAFile=certifi.where())# , ssl_cert_reqs=ssl.CERT_NONE) # , tlsCAFile=certifi.where()
-db = client[config["DB_NAME"]]
-
-users = db["users"]
-questions = db["questions"]
-answers = db["answers"]
-
-print("Entries in Users Table:")
-print("------------------------------")
-print(list(users.find()))
-print()
-
-print("Entries in Questions Table:")
-print("------------------------------")
-for row in questions.find():
-    print(row)
-print()
-
-print("Entries in Answers Table:")
-print("------------------------------")
-for row in answers.find():
-    print(row)
-client.close()
+# Exports collections, e.g. to take a snapshot of production for local
+# benchmarking.
+#
+#   python3 read_tables.py                                  # users, questions, answers as NDJSON on stdout
+#   python3 read_tables.py --out snapshot --gzip            # every collection to snapshot/<name>.ndjson.gz
+#   python3 read_tables.py --out snapshot --format bson answers questions
+#   python3 read_tables.py --out snapshot --since 03-01-2025 --until 03-14-2025
+#   python3 read_tables.py --out snapshot --filter 'answers={"votes": {"$gte": 5}}'
+#
+# Documents are streamed from a cursor (--batch-size at a time) straight to
+# the output, so memory use doesn't depend on the size of a collection.
+# NDJSON is MongoDB Extended JSON, one document per line, which keeps
+# ObjectIds and dates intact for import_data.py. BSON files are the raw
+# documents as the server sent them, in the same layout mongodump writes, so
+# mongorestore can load them too. With --out, collections are exported in
+# parallel (--jobs) and each reports its progress and throughput on stderr.
+#
+# Password hashes are left out unless --keep-passwords is given.
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import gzip
+import os
+import sys
+import threading
+import time
+
+from bson import json_util
+from bson.codec_options import CodecOptions
+from bson.json_util import JSONOptions, JSONMode
+from bson.raw_bson import RawBSONDocument
+
+from db import get_db
+
+DEFAULT_COLLECTIONS = ["users", "questions", "answers"]
+
+ALL_COLLECTIONS = ["users", "questions", "answers", "groups", "memberships", "score_runs"]
+
+# The field --since/--until apply to in each collection
+DATE_FIELDS = {
+    "users": "created_at",
+    "questions": "date",
+    "answers": "created_at",
+    "groups": "created_at",
+    "memberships": "joined_at",
+    "score_runs": "date",
+}
+
+SECRET_FIELDS = {"users": ["password"], "groups": ["password"]}
+
+JSON_OPTIONS = JSONOptions(json_mode=JSONMode.RELAXED, tz_aware=False)
+
+RAW = CodecOptions(document_class=RawBSONDocument)
+
+
+def export_query(collection, filters, since=None, until=None):
+    """The filter for one collection: its --filter and the date range."""
+    query = dict(filters.get(collection, {}))
+    if since or until:
+        field = DATE_FIELDS.get(collection)
+        if field is None:
+            raise ValueError(f"{collection} has no date field for --since/--until")
+        dates = {}
+        if since:
+            dates["$gte"] = since
+        if until:
+            # --until is inclusive
+            dates["$lt"] = until + timedelta(days=1)
+        query[field] = dates
+    return query
+
+
+def export_projection(collection, keep_passwords):
+    if keep_passwords or collection not in SECRET_FIELDS:
+        return None
+    return {field: 0 for field in SECRET_FIELDS[collection]}
+
+
+class Progress:
+    """Per-collection counters, reported on stderr every `interval` seconds."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._done = threading.Event()
+
+    def start(self, collection, expected):
+        with self._lock:
+            self._rows[collection] = {"docs": 0, "bytes": 0, "expected": expected,
+                                      "started": time.monotonic(), "seconds": None}
+
+    def add(self, collection, docs, size):
+        row = self._rows[collection]
+        row["docs"] += docs
+        row["bytes"] += size
+
+    def finish(self, collection):
+        row = self._rows[collection]
+        row["seconds"] = time.monotonic() - row["started"]
+        self._print(collection, row)
+
+    def _print(self, collection, row):
+        seconds = row["seconds"] if row["seconds"] is not None else time.monotonic() - row["started"]
+        rate = row["docs"] / seconds if seconds else 0.0
+        of = f"/{row['expected']}" if row["expected"] is not None else ""
+        state = "done" if row["seconds"] is not None else "..."
+        # One write per line, so lines from parallel exports don't interleave
+        sys.stderr.write(f"{collection}: {row['docs']}{of} docs, {row['bytes'] / 1e6:.1f} MB, "
+                         f"{rate:,.0f} docs/s {state}\n")
+
+    def report_until_done(self):
+        while not self._done.wait(self.interval):
+            with self._lock:
+                for collection, row in self._rows.items():
+                    if row["seconds"] is None:
+                        self._print(collection, row)
+
+    def stop(self):
+        self._done.set()
+
+
+def write_ndjson(cursor, out, progress, collection, batch_size):
+    """Writes each document as a line; flushes progress once per batch."""
+    docs = size = 0
+    for doc in cursor:
+        line = (json_util.dumps(doc, json_options=JSON_OPTIONS) + "\n").encode("utf-8")
+        out.write(line)
+        docs += 1
+        size += len(line)
+        if docs == batch_size:
+            progress.add(collection, docs, size)
+            docs = size = 0
+    progress.add(collection, docs, size)
+
+
+def write_bson(cursor, out, progress, collection, batch_size):
+    docs = size = 0
+    for doc in cursor:
+        out.write(doc.raw)
+        docs += 1
+        size += len(doc.raw)
+        if docs == batch_size:
+            progress.add(collection, docs, size)
+            docs = size = 0
+    progress.add(collection, docs, size)
+
+
+def export_collection(db, collection, out, args, filters, progress):
+    query = export_query(collection, filters, args.since, args.until)
+    source = db[collection]
+    if args.format == "bson":
+        source = source.with_options(codec_options=RAW)
+    expected = None if query else db[collection].estimated_document_count()
+    progress.start(collection, expected)
+    cursor = source.find(query, export_projection(collection, args.keep_passwords),
+                         batch_size=args.batch_size)
+    try:
+        writer = write_bson if args.format == "bson" else write_ndjson
+        writer(cursor, out, progress, collection, args.batch_size)
+    finally:
+        cursor.close()
+    progress.finish(collection)
+
+
+def export_to_file(db, collection, args, filters, progress):
+    name = f"{collection}.{args.format}" + (".gz" if args.gzip else "")
+    path = os.path.join(args.out, name)
+    opener = gzip.open if args.gzip else open
+    with opener(path, "wb") as out:
+        export_collection(db, collection, out, args, filters, progress)
+    return path
+
+
+def parse_date(value):
+    return datetime.strptime(value, "%m-%d-%Y")
+
+
+def parse_filters(values):
+    filters = {}
+    for value in values:
+        collection, _, query = value.partition("=")
+        if not query:
+            raise SystemExit(f"--filter expects collection=<json>, got {value!r}")
+        filters[collection] = json_util.loads(query, json_options=JSON_OPTIONS)
+    return filters
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export collections as NDJSON or BSON")
+    parser.add_argument("collections", nargs="*",
+                        help=f"collections to export (default: {', '.join(DEFAULT_COLLECTIONS)} on stdout, "
+                             "every collection with --out)")
+    parser.add_argument("--out", help="directory to write one file per collection to (default: stdout)")
+    parser.add_argument("--format", choices=["ndjson", "bson"], default="ndjson")
+    parser.add_argument("--gzip", action="store_true", help="gzip the output files")
+    parser.add_argument("--filter", action="append", default=[], metavar="COLLECTION=JSON",
+                        help="only export matching documents (Extended JSON query); repeatable")
+    parser.add_argument("--since", type=parse_date, help="first day to export, MM-DD-YYYY")
+    parser.add_argument("--until", type=parse_date, help="last day to export, MM-DD-YYYY")
+    parser.add_argument("--batch-size", type=int, default=1000, help="documents per cursor batch")
+    parser.add_argument("--jobs", type=int, default=4, help="collections exported at once with --out")
+    parser.add_argument("--progress", type=float, default=5.0, help="seconds between progress reports")
+    parser.add_argument("--keep-passwords", action="store_true", help="include password hashes")
+    args = parser.parse_args()
+
+    filters = parse_filters(args.filter)
+    db = get_db()
+    progress = Progress(args.progress)
+    reporter = threading.Thread(target=progress.report_until_done, daemon=True)
+    reporter.start()
+    started = time.monotonic()
+    try:
+        if args.out is None:
+            if args.format == "bson" or args.gzip:
+                raise SystemExit("--format bson and --gzip need --out")
+            out = sys.stdout.buffer
+            for collection in args.collections or DEFAULT_COLLECTIONS:
+                export_collection(db, collection, out, args, filters, progress)
+            out.flush()
+        else:
+            os.makedirs(args.out, exist_ok=True)
+            collections = args.collections or ALL_COLLECTIONS
+            with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+                paths = list(pool.map(
+                    lambda collection: export_to_file(db, collection, args, filters, progress), collections))
+            print(f"wrote {', '.join(paths)} in {time.monotonic() - started:.1f}s", file=sys.stderr)
+    finally:
+        progress.stop()
+
+
+if __name__ == '__main__':
+    main()
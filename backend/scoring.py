@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# Answer scores.
+#
+# Every answer stores two scores next to its counters so leaderboards can be
+# read straight off the (question_id, score) indexes:
+#
+#   ratio  - votes / max(appearances, 1), what the app has always shown
+#   wilson - the lower bound of the Wilson score interval for the vote
+#            rate, which keeps answers with a handful of lucky appearances
+#            from topping the board
+#
+# Both are recomputed inside the same update that changes the counters, so
+# they never drift from votes/appearances.
+#
+#   python3 scoring.py --backfill    # add the scores to existing answers
+
+import argparse
+import math
+
+from settings import get_setting
+
+SCORE_FIELDS = ("ratio", "wilson")
+
+WILSON_Z = get_setting("WILSON_Z", 1.96, float)
+
+
+def ratio(votes, appearances):
+    return (votes or 0) / max(appearances or 0, 1)
+
+
+def wilson_lower_bound(votes, appearances, z=WILSON_Z):
+    n = appearances or 0
+    if n <= 0:
+        return 0.0
+    p = min((votes or 0) / n, 1.0)
+    z2 = z * z
+    centre = p + z2 / (2 * n)
+    spread = z * math.sqrt(p * (1 - p) / n + z2 / (4 * n * n))
+    return max((centre - spread) / (1 + z2 / n), 0.0)
+
+
+def score_fields(votes, appearances):
+    return {
+        "ratio": ratio(votes, appearances),
+        "wilson": wilson_lower_bound(votes, appearances),
+    }
+
+
+def score_expressions(z=WILSON_Z):
+    """The same scores as aggregation expressions over $votes/$appearances."""
+    votes = {"$ifNull": ["$votes", 0]}
+    n = {"$ifNull": ["$appearances", 0]}
+    p = {"$min": [{"$divide": [votes, {"$max": [n, 1]}]}, 1]}
+    z2 = z * z
+    centre = {"$add": [p, {"$divide": [z2 / 2, {"$max": [n, 1]}]}]}
+    spread = {"$multiply": [z, {"$sqrt": {"$add": [
+        {"$divide": [{"$multiply": [p, {"$subtract": [1, p]}]}, {"$max": [n, 1]}]},
+        {"$divide": [z2 / 4, {"$multiply": [{"$max": [n, 1]}, {"$max": [n, 1]}]}]},
+    ]}}]}
+    wilson = {"$cond": [
+        {"$lte": [n, 0]},
+        0.0,
+        {"$max": [{"$divide": [
+            {"$subtract": [centre, spread]},
+            {"$add": [1, {"$divide": [z2, {"$max": [n, 1]}]}]},
+        ]}, 0.0]},
+    ]}
+    return {
+        "ratio": {"$divide": [votes, {"$max": [n, 1]}]},
+        "wilson": wilson,
+    }
+
+
+def counter_update(votes=0, appearances=0):
+    """Update pipeline that bumps an answer's counters and rescores it.
+
+    It runs as one atomic single-document update, so concurrent votes can't
+    leave a stale score behind.
+    """
+    increments = {}
+    if votes:
+        increments["votes"] = {"$add": [{"$ifNull": ["$votes", 0]}, votes]}
+    if appearances:
+        increments["appearances"] = {"$add": [{"$ifNull": ["$appearances", 0]}, appearances]}
+    return [{"$set": increments}, {"$set": score_expressions()}]
+
+
+def backfill(answers):
+    """Compute the stored scores for every answer in place."""
+    return answers.update_many({}, [{"$set": score_expressions()}]).modified_count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Maintain stored answer scores")
+    parser.add_argument("--backfill", action="store_true",
+                        help="recompute ratio and wilson for every answer")
+    args = parser.parse_args()
+    if args.backfill:
+        from db import get_db
+        print(f"rescored {backfill(get_db()['answers'])} answers")
+    else:
+        parser.print_help()
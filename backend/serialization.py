@@ -0,0 +1,52 @@
+# JSON encoding for API responses.
+#
+# Handlers hand documents straight to dumps(): ObjectIds are encoded as their
+# hex string and datetimes as MM-DD-YYYY, the format the app has always used,
+# so nothing needs to walk or copy a document first. orjson is used when it
+# is installed (it is in requirements.txt) and is several times faster than
+# the json module, which remains the fallback.
+#
+# The *_FIELDS projections below are the response schemas for user
+# documents: routes fetch exactly these fields, so a password hash or
+# anything else internal never reaches the encoder.
+
+from datetime import datetime
+import json
+
+from bson.objectid import ObjectId
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+DATE_FORMAT = "%m-%d-%Y"
+
+# /user/<user_id>
+USER_FIELDS = {"username": 1, "name": 1, "avatar_url": 1, "total_points": 1, "created_at": 1}
+
+# /user/username/<username>
+USER_SUMMARY_FIELDS = {"username": 1, "name": 1, "avatar_url": 1, "total_points": 1}
+
+# /user/login, which also needs the hash to check the password against
+LOGIN_FIELDS = {"username": 1, "name": 1, "avatar_url": 1, "total_points": 1, "password": 1}
+
+
+def _default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.strftime(DATE_FORMAT)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    def dumps(payload):
+        """Encode a response payload as UTF-8 JSON bytes."""
+        return orjson.dumps(payload, default=_default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+else:
+    _encoder = json.JSONEncoder(default=_default, separators=(",", ":"))
+
+    def dumps(payload):
+        """Encode a response payload as UTF-8 JSON bytes."""
+        return _encoder.encode(payload).encode("utf-8")
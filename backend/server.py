@@ -1,148 +1,158 @@
 from flask_cors import CORS
-from flask import Flask, Response, request
-from dotenv import dotenv_values
-from pymongo import MongoClient
-import certifi
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, g, request
 from datetime import datetime, timedelta
-import json
-from werkzeug.security import generate_password_hash, check_password_hash
+import os
+import time
 from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from counters import counter_buffer
+from daily_scores import ClosedOutOfOrder, close_day
+from db import get_db
+from passwords import PasswordServiceBusy, password_hasher
+from memberships import PROFILE_PROJECTION, add_member, leaderboard, member_ids, position, user_memberships
+from pair_sampler import POLICIES as PAIR_POLICIES, pair_prefetcher, pair_sampler
+from logs import get_logger
+from metrics import METRICS_ENABLED, record_request, registry
+from leaderboard_cache import LEADERBOARD_FIELDS, LEADERBOARD_ORDER, after_filter, top_users
+from profile_cache import profile_cache
+from question_cache import question_cache, local_midnight, parse_question_dates, questions_body, relative_to_today
+from ranking import all_points_changed, get_rank, points_changed
+from sessions import InvalidSession, session_tokens
+from scoring import SCORE_FIELDS, counter_update, score_fields
+from serialization import LOGIN_FIELDS, USER_FIELDS, USER_SUMMARY_FIELDS, dumps
+from settings import get_flag, get_setting
 
 app = Flask(__name__)
-CORS(app)
-config = dotenv_values("./.env")
+CORS(app, expose_headers=["X-Next-Cursor"])
 
-def serialize_document(doc):
-    """Helper function to serialize MongoDB documents for JSON response"""
-    if doc is None:
-        return None
+log = get_logger("server")
 
-    if "_id" in doc:
-        doc["_id"] = str(doc["_id"])
-    
-    for key, value in doc.items():
-        if isinstance(value, ObjectId):
-            doc[key] = str(value)
-        elif isinstance(value, datetime):
-            doc[key] = value.strftime("%m-%d-%Y")
-    
-    return doc
+# Password hashing processes (passwords.py) are spawned, and re-import the
+# main script as __mp_main__; under `python3 server.py` that is this module,
+# which must not touch the database there.
+if get_flag("ENSURE_INDEXES") and __name__ != "__mp_main__":
+    from indexes import ensure_indexes
+    ensure_indexes()
+
+def json_response(payload, status=200, headers=None):
+    return Response(dumps(payload), status=status, headers=headers, mimetype="application/json")
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def finish_request_timer(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        record_request(route, request.method, response.status_code, time.perf_counter() - started)
+    return response
 
 @app.route('/')
 def root():
     return "Hello World!"
 
+# Prometheus scrape target (see metrics.py). Scrapers authenticate with
+# "Authorization: Bearer <METRICS_TOKEN>", or <CRON_SECRET> when no
+# METRICS_TOKEN is set; the route is closed while neither is.
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    if not METRICS_ENABLED:
+        return json_response({"error": "Metrics are disabled"}, status=404)
+    token = get_setting("METRICS_TOKEN") or get_setting("CRON_SECRET")
+    if not token or request.headers.get("Authorization") != f"Bearer {token}":
+        return json_response({"error": "Unauthorized"}, status=401)
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+def question_cache_headers(response, dates, complete, relative):
+    """Sets ETag and Cache-Control for a response covering the given days."""
+    response.add_etag()
+    response.headers["Cache-Control"] = question_cache.cache_control(dates, complete, relative)
+    return response.make_conditional(request)
+
+def day_question_response(days_ago, label):
+    try:
+        date = local_midnight(days_ago=days_ago)
+        question = question_cache.get(date)
+        
+        if question:
+            response = Response(question.body, mimetype="application/json")
+            return question_cache_headers(response, [date], True, relative=True)
+        else:
+            return json_response({"error": f"No question found for {label}"}, status=404)
+    except Exception as e:
+        log.exception("question_endpoint_failed", day=label)
+        return json_response({"error": str(e)}, status=500)
+
 # Gets the current date and returns the corresponding question.
 @app.route('/today/get-question/')
 def get_todays_question():
-    client = MongoClient(config["ATLAS_URI"], tlsCAFile=certifi.where())
-    db = client[config["DB_NAME"]]
-    questions = db["questions"]
-    # Get today's date in the format stored in the database
-    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    # Find the question for today
-    today_question = questions.find_one({"date": today})
-    client.close()
-    
-    if today_question:
-        # Convert ObjectId to string for JSON serialization
-        today_question["_id"] = str(today_question["_id"])
-        today_question["date"] = today_question["date"].strftime("%m-%d-%Y")
-        return Response(json.dumps(today_question), mimetype="application/json")
-    else:
-        return Response(json.dumps({"error": "No question found for today"}), 
-                       status=404, 
-                       mimetype="application/json")
+    return day_question_response(0, "today")
 
 @app.route('/today/has-answered/<user_id>')
 def has_answered_today(user_id):
     try:
         object_id = ObjectId(user_id)
         
-        client = MongoClient(config["ATLAS_URI"], tlsCAFile=certifi.where())
-        db = client[config["DB_NAME"]]
-        questions = db["questions"]
+        db = get_db()
         answers = db["answers"]
         
-        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        
-        today_question = questions.find_one({"date": today})
+        today_question = question_cache.get(local_midnight())
         if not today_question:
-            client.close()
-            return Response(json.dumps({
+            return json_response({
                 "has_answered": False,
                 "error": "No question found for today"
-            }), status=404, mimetype="application/json")
+            }, status=404)
         
         existing_answer = answers.find_one({
             "user_id": object_id,
-            "question_id": today_question["_id"]
+            "question_id": today_question.doc["_id"]
         })
         
-        client.close()
-        
-        return Response(json.dumps({
+        return json_response({
             "has_answered": existing_answer is not None
-        }), mimetype="application/json")
+        })
         
     except Exception as e:
-        return Response(json.dumps({
+        return json_response({
             "error": str(e)
-        }), status=500, mimetype="application/json")
+        }, status=500)
 
 # Gets yesterday's date and returns the corresponding question.
 @app.route('/yesterday/get-question/')
 def get_yesterdays_question():
-    
-    client = MongoClient(config["ATLAS_URI"], tlsCAFile=certifi.where())
-    db = client[config["DB_NAME"]]
-    questions = db["questions"]
-    yesterday = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=1)
-    yesterday_question = questions.find_one({"date": yesterday})
-    client.close()
-    
-    if yesterday_question:
-        yesterday_question["_id"] = str(yesterday_question["_id"])
-        yesterday_question["date"] = yesterday_question["date"].strftime("%m-%d-%Y")
-        return Response(json.dumps(yesterday_question), mimetype="application/json")
-    else:
-        return Response(json.dumps({"error": "No question found for yesterday"}), 
-                       status=404, 
-                       mimetype="application/json")
+    return day_question_response(1, "yesterday")
 
 @app.route('/day-before-yesterday/get-question/')
 def get_day_before_yesterdays_question():
+    return day_question_response(2, "day before yesterday")
+
+# Returns the questions for several days at once, either as day offsets
+# (?offsets=0,1,2 means today, yesterday and the day before) or as an
+# inclusive date range (?from=MM-DD-YYYY&to=MM-DD-YYYY).
+@app.route('/questions', methods=['GET'])
+def get_questions():
     try:
-        client = MongoClient(config["ATLAS_URI"], tlsCAFile=certifi.where())
-        db = client[config["DB_NAME"]]
-        questions = db["questions"]
-        # get day before yesterday's date (2 days ago)
-        day_before_yesterday = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=2)
+        dates = parse_question_dates(request.args)
+    except ValueError as e:
+        return json_response({"error": f"Invalid date range: {e}"}, status=400)
 
-        question = questions.find_one({"date": day_before_yesterday})
-        client.close()
-        
-        if question:
-            question["_id"] = str(question["_id"])
-            question["date"] = question["date"].strftime("%m-%d-%Y")
-            return Response(json.dumps(question), mimetype="application/json")
-        else:
-            return Response(json.dumps({"error": "No question found for day before yesterday"}), 
-                           status=404, 
-                           mimetype="application/json")
+    try:
+        body, complete = questions_body(dates, question_cache.get_many(dates))
+        response = Response(body, mimetype="application/json")
+        return question_cache_headers(response, dates, complete, relative_to_today(request.args))
     except Exception as e:
-        print(f"ERROR in day-before-yesterday endpoint: {e}")
-        return Response(json.dumps({"error": str(e)}), 
-                       status=500, 
-                       mimetype="application/json")
+        return json_response({"error": str(e)}, status=500)
     
 @app.route('/test-db')
 def test_db():
     try:
-        client = MongoClient(config["ATLAS_URI"], tlsCAFile=certifi.where())
-        db = client[config["DB_NAME"]]
+        db = get_db()
         collections = db.list_collection_names()
-        client.close()
         return {"message": "Database connection successful", "collections": collections}
     except Exception as e:
         return {"error": f"Database connection failed: {str(e)}"}, 500
@@ -155,68 +165,237 @@ def get_user(user_id):
         
         object_id = ObjectId(user_id)
         
-        client = MongoClient(config["ATLAS_URI"], tlsCAFile=certifi.where())
-        db = client[config["DB_NAME"]]
+        db = get_db()
         users = db["users"]
         
-        user = users.find_one({"_id": object_id})
-        client.close()
+        user = users.find_one({"_id": object_id}, USER_FIELDS)
         
         if user:
-            user = serialize_document(user)
-            return Response(json.dumps(user), mimetype="application/json")
+            return json_response(user)
         else:
-            return Response(json.dumps({"error": "User not found"}), 
-                          status=404, 
-                          mimetype="application/json")
+            return json_response({"error": "User not found"}, status=404)
     except Exception as e:
-        return Response(json.dumps({"error": str(e)}), 
-                      status=500, 
-                      mimetype="application/json")
+        return json_response({"error": str(e)}, status=500)
+
+MAX_USER_ANSWER_PAGE_SIZE = 100
+
+# Orders for a user's answers: the stored field, and the (user_id, field, _id)
+# index that serves it (see indexes.py)
+USER_ANSWER_SORTS = {
+    "date": [("created_at", -1), ("_id", -1)],
+    "votes": [("votes", -1), ("_id", 1)],
+}
+
+EPOCH = datetime(1970, 1, 1)
+
+def user_answers_pipeline(user_id, sort="votes", limit=5, after=None):
+    """Aggregation for a page of a user's answers, each with its question.
+
+    The sort and limit run on the user's index entries, so only the page is
+    read, and the questions are joined in with a single $lookup. `after` is
+    the (sort value, _id) of the last answer on the previous page; the value
+    is None for answers without the field (created_at is missing on answers
+    older than it), which sort below every value.
+    """
+    (field, direction), (_, id_direction) = USER_ANSWER_SORTS[sort]
+    pipeline = [{"$match": {"user_id": user_id}}]
+    if after is not None:
+        value, answer_id = after
+        same_value = {field: value, "_id": {"$gt" if id_direction > 0 else "$lt": answer_id}}
+        # Range operators never match a missing field, so those answers are
+        # added or excluded explicitly
+        if value is None:
+            clauses = [same_value] + ([{field: {"$ne": None}}] if direction > 0 else [])
+        else:
+            clauses = [{field: {"$lt" if direction < 0 else "$gt": value}}, same_value]
+            if direction < 0:
+                clauses.append({field: None})
+        pipeline.append({"$match": {"$or": clauses}})
+    pipeline += [
+        {"$sort": {field: direction, "_id": id_direction}},
+        {"$limit": limit},
+        {"$lookup": {
+            "from": "questions",
+            "localField": "question_id",
+            "foreignField": "_id",
+            "as": "question",
+        }},
+        {"$unwind": {"path": "$question", "preserveNullAndEmptyArrays": True}},
+        {"$project": {
+            "question_id": 1,
+            "user_id": 1,
+            "answer_text": 1,
+            "votes": 1,
+            "appearances": 1,
+            "created_at": 1,
+            "question.question": 1,
+            "question.date": 1,
+        }},
+    ]
+    return pipeline
+
+def parse_user_answer_page_args(args):
+    """Reads ?sort=, ?limit= and ?cursor= for /user/<user_id>/answers."""
+    sort = args.get('sort', 'date')
+    if sort not in USER_ANSWER_SORTS:
+        raise ValueError(f"sort must be one of {', '.join(USER_ANSWER_SORTS)}")
+
+    limit = int(args.get('limit', 20))
+    if limit < 1:
+        raise ValueError("limit must be positive")
+    limit = min(limit, MAX_USER_ANSWER_PAGE_SIZE)
+
+    after = None
+    cursor = args.get('cursor')
+    if cursor:
+        value, answer_id = cursor.split(":", 1)
+        if sort == "date":
+            # Dates travel as milliseconds since the epoch; nothing means the
+            # answer has no created_at
+            value = EPOCH + timedelta(milliseconds=int(value)) if value else None
+        else:
+            value = int(value)
+        after = (value, ObjectId(answer_id))
+    return sort, limit, after
+
+def shape_user_answers(docs, sort, limit):
+    """Formats user_answers_pipeline() results.
+
+    Returns (entries, next_cursor); the cursor is None on the last page.
+    """
+    result = []
+    last = None
+    read = 0
+    for answer in docs:
+        read += 1
+        last = answer
+        if not answer.get("question"):
+            # Its question was deleted; leave it out, as before
+            continue
+        result.append({
+            "_id": answer["_id"],
+            "question_id": answer["question_id"],
+            "user_id": answer["user_id"],
+            "answer_text": answer.get("answer_text", ""),
+            "votes": answer.get("votes", 0),
+            "appearances": answer.get("appearances", 0),
+            "question_text": answer["question"]["question"],
+            "date": answer["question"]["date"]
+        })
+
+    next_cursor = None
+    if read == limit:
+        if sort == "date":
+            created_at = last.get("created_at")
+            value = "" if created_at is None else (created_at - EPOCH) // timedelta(milliseconds=1)
+        else:
+            value = last.get("votes", 0)
+        next_cursor = f"{value}:{last['_id']}"
+    return result, next_cursor
+
+def top_answers(db, user_id, limit=5):
+    """A user's answers with the most votes."""
+    docs = db["answers"].aggregate(user_answers_pipeline(user_id, "votes", limit))
+    return shape_user_answers(docs, "votes", limit)[0]
 
 @app.route('/user/<user_id>/top-answers')
 def get_top_answers(user_id):
     try:
-        from bson.objectid import ObjectId
         object_id = ObjectId(user_id)
         
-        client = MongoClient(config["ATLAS_URI"], tlsCAFile=certifi.where())
-        db = client[config["DB_NAME"]]
-        answers = db["answers"]
-        questions = db["questions"]
-        
-        # Get the user's top 5 answers sorted by votes (descending)
-        user_answers = list(answers.find({"user_id": object_id}).sort("votes", -1))   
-        user_answers = user_answers[:5] 
+        return json_response(top_answers(get_db(), object_id))
+    except Exception as e:
+        return json_response({"error": str(e)}, status=500)
 
-        result = []
-        
-        for answer in user_answers:
-            question_id = answer.get("question_id")
-            if not isinstance(question_id, ObjectId):
-                question_id = ObjectId(question_id)
-                
-            question = questions.find_one({"_id": question_id})
-            if question:
-                clean_answer = {
-                    "_id": str(answer["_id"]),
-                    "question_id": str(answer["question_id"]),
-                    "user_id": str(answer["user_id"]),
-                    "answer_text": answer.get("answer_text", ""),
-                    "votes": answer.get("votes", 0),
-                    "appearances": answer.get("appearances", 0),
-                    "question_text": question["question"],
-                    "date": question["date"].strftime("%m-%d-%Y")
-                }
-                result.append(clean_answer)
-        
-        client.close()
-        
-        return Response(json.dumps(result), mimetype="application/json")
+# A user's answer history, newest first (?sort=date, the default) or by
+# votes (?sort=votes). Pages of ?limit= answers (default 20) continue with the
+# previous page's X-Next-Cursor header passed back as ?cursor=.
+@app.route('/user/<user_id>/answers', methods=['GET'])
+def get_user_answers(user_id):
+    try:
+        try:
+            object_id = ObjectId(user_id)
+        except Exception:
+            return json_response({"error": "Invalid user_id format"}, status=400)
+
+        try:
+            sort, limit, after = parse_user_answer_page_args(request.args)
+        except Exception:
+            return json_response({"error": "Invalid sort, limit or cursor"}, status=400)
+
+        answers = get_db()["answers"]
+        docs = answers.aggregate(user_answers_pipeline(object_id, sort, limit, after))
+        result, next_cursor = shape_user_answers(docs, sort, limit)
+
+        response = json_response(result)
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return response
     except Exception as e:
-        return Response(json.dumps({"error": str(e)}), 
-                      status=500, 
-                      mimetype="application/json")
+        return json_response({"error": str(e)}, status=500)
+
+_profile_executor = None
+_profile_executor_pid = None
+
+def profile_executor():
+    """Threads for a profile's queries, created per process on first use."""
+    global _profile_executor, _profile_executor_pid
+    if _profile_executor is None or _profile_executor_pid != os.getpid():
+        _profile_executor = ThreadPoolExecutor(
+            max_workers=get_setting("PROFILE_WORKERS", 8, int), thread_name_prefix="profile")
+        _profile_executor_pid = os.getpid()
+    return _profile_executor
+
+def load_profile(user_id):
+    """Everything the profile screen shows, or None for an unknown user.
+
+    The four reads are independent, so they run at the same time on the
+    shared client's pool.
+    """
+    db = get_db()
+    executor = profile_executor()
+    user = executor.submit(db["users"].find_one, {"_id": user_id}, USER_FIELDS)
+    answers = executor.submit(top_answers, db, user_id)
+    ranked = executor.submit(get_rank, user_id)
+    groups = executor.submit(group_details, db, user_id)
+
+    if user.result() is None:
+        return None
+    rank, total_users = ranked.result() or (None, 0)
+    return {
+        "user": user.result(),
+        "top_answers": answers.result(),
+        "ranking": {"user_id": user_id, "rank": rank, "total_users": total_users},
+        "groups": groups.result()
+    }
+
+# Everything the profile screen needs in one request: the responses of
+# /user/<user_id>, /user/<user_id>/top-answers, /user/<user_id>/ranking and
+# /groups/get-groups/<username>, under "user", "top_answers", "ranking" and
+# "groups". Served from profile_cache.py; clients revalidate with the ETag.
+@app.route('/user/<user_id>/profile', methods=['GET'])
+def get_user_profile(user_id):
+    try:
+        try:
+            object_id = ObjectId(user_id)
+        except Exception:
+            return json_response({"error": "Invalid user_id format"}, status=400)
+
+        profile = profile_cache.get(object_id)
+        if profile is None:
+            started = profile_cache.started()
+            profile = load_profile(object_id)
+            if profile is None:
+                return json_response({"error": "User not found"}, status=404)
+            profile = dumps(profile)
+            profile_cache.put(object_id, profile, started)
+
+        response = Response(profile, mimetype="application/json")
+        response.headers["Cache-Control"] = "private, no-cache"
+        response.add_etag()
+        return response.make_conditional(request)
+    except Exception as e:
+        return json_response({"error": str(e)}, status=500)
 
 # Get user global ranking
 @app.route('/user/<user_id>/ranking')
@@ -225,39 +404,51 @@ def get_user_ranking(user_id):
         from bson.objectid import ObjectId
         object_id = ObjectId(user_id)
         
-        client = MongoClient(config["ATLAS_URI"], tlsCAFile=certifi.where())
-        db = client[config["DB_NAME"]]
-        users = db["users"]
-        
-        all_users = list(users.find().sort("total_points", -1))
-        
-        user_rank = None
-        total_users = len(all_users)
-        
-        for i, user in enumerate(all_users):
-            if user["_id"] == object_id:
-                user_rank = i + 1  # Add 1 because ranks start at 1, not 0
-                break
-        
-        client.close()
+        # Rank is 1 + the number of users with more points, so ties share
+        # a rank (see ranking.py)
+        ranked = get_rank(object_id)
+        user_rank, total_users = ranked if ranked else (None, 0)
         
         if user_rank:
-            return Response(
-                json.dumps({
+            return json_response(
+                {
                     "user_id": user_id,
                     "rank": user_rank,
                     "total_users": total_users
-                }),
-                mimetype="application/json"
+                }
             )
         else:
-            return Response(json.dumps({"error": "User not found"}), 
-                          status=404, 
-                          mimetype="application/json")
+            return json_response({"error": "User not found"}, status=404)
     except Exception as e:
-        return Response(json.dumps({"error": str(e)}), 
-                      status=500, 
-                      mimetype="application/json")
+        return json_response({"error": str(e)}, status=500)
+
+def password_busy_response():
+    """503 for when every password hashing slot on this host is taken."""
+    return json_response({
+        "error": "Too many sign-ins in progress, please try again"
+    }, status=503, headers={"Retry-After": "1"})
+
+def session_user(data):
+    """Claims of the request's session token (see sessions.py), or None if
+    it didn't send one.
+
+    A body that leaves out user_id/username gets them from the token. Raises
+    InvalidSession for a bad, expired or revoked token, or one belonging to
+    someone other than the user the body names.
+    """
+    header = request.headers.get("Authorization", "")
+    if not header.startswith("Bearer ") or not session_tokens.enabled:
+        return None
+    claims = session_tokens.verify(header[len("Bearer "):])
+    for field, claim in (("user_id", "uid"), ("username", "usr")):
+        if data.setdefault(field, claims[claim]) != claims[claim]:
+            raise InvalidSession("Session does not belong to this user")
+    return claims
+
+def invalid_session_response(error):
+    return json_response({
+        "error": str(error)
+    }, status=401)
 
 # Add a new user during registration
 @app.route('/user/register', methods=['POST'])
@@ -268,29 +459,26 @@ def register_user():
         required_fields = ['username', 'password']
         for field in required_fields:
             if field not in user_data:
-                return Response(json.dumps({
+                return json_response({
                     "error": f"Missing required field: {field}"
-                }), status=400, mimetype="application/json")
+                }, status=400)
         
-        client = MongoClient(config["ATLAS_URI"], tlsCAFile=certifi.where())
-        db = client[config["DB_NAME"]]
+        db = get_db()
         users = db["users"]
 
         existing_user = users.find_one({"username": user_data['username']})
         
         if existing_user:
-            client.close()
-            return Response(json.dumps({
+            return json_response({
                 "error": "Username already in use"
-            }), status=409, mimetype="application/json")
+            }, status=409)
         
-        hashed_password = generate_password_hash(user_data['password'])
+        hashed_password = password_hasher.hash(user_data['password'])
         new_user = {
             "username": user_data['username'],
             "password": hashed_password,
             "total_points": 0,
-            "created_at": datetime.utcnow(),
-            "groups": []
+            "created_at": datetime.utcnow()
         }
         
         if 'name' in user_data:
@@ -299,22 +487,29 @@ def register_user():
         if 'avatar_url' in user_data:
             new_user['avatar_url'] = user_data['avatar_url']
         
-        result = users.insert_one(new_user)
+        try:
+            result = users.insert_one(new_user)
+        except DuplicateKeyError:
+            # Lost a race with a concurrent registration
+            return json_response({
+                "error": "Username already in use"
+            }, status=409)
         user_id = str(result.inserted_id)
+        points_changed(result.inserted_id, 0, {
+            field: new_user[field] for field in LEADERBOARD_FIELDS if field in new_user
+        })
         
-        client.close()
-        print("got here 4")
-        print(user_data['username'])
-        
-        return Response(json.dumps({
+        return json_response({
             "message": "User created successfully",
             "user_id": user_id
-        }), status=201, mimetype="application/json")
+        }, status=201)
 
+    except PasswordServiceBusy:
+        return password_busy_response()
     except Exception as e:
-        return Response(json.dumps({
+        return json_response({
             "error": str(e)
-        }), status=500, mimetype="application/json")
+        }, status=500)
 
 # Authenticate user
 @app.route('/user/login', methods=['POST'])
@@ -325,27 +520,32 @@ def login_user():
         required_fields = ['username', 'password']
         for field in required_fields:
             if field not in login_data:
-                return Response(json.dumps({
+                return json_response({
                     "error": f"Missing required field: {field}"
-                }), status=400, mimetype="application/json")
+                }, status=400)
         
-        client = MongoClient(config["ATLAS_URI"], tlsCAFile=certifi.where())
-        db = client[config["DB_NAME"]]
+        db = get_db()
         users = db["users"]
 
-        user = users.find_one({"username": login_data['username']})
+        user = users.find_one({"username": login_data['username']}, LOGIN_FIELDS)
         
-        if not user:
-            client.close()
-            return Response(json.dumps({
+        # Users loaded by import_data.py may have no password yet
+        if not user or not user.get('password'):
+            return json_response({
                 "error": "Invalid username or password"
-            }), status=401, mimetype="application/json")
+            }, status=401)
         
-        if not check_password_hash(user['password'], login_data['password']):
-            client.close()
-            return Response(json.dumps({
+        matches, new_hash = password_hasher.verify(user['password'], login_data['password'])
+        if not matches:
+            return json_response({
                 "error": "Invalid username or password"
-            }), status=401, mimetype="application/json")
+            }, status=401)
+        if new_hash:
+            # Hash parameters changed since this password was stored
+            users.update_one(
+                {"_id": user["_id"], "password": user["password"]},
+                {"$set": {"password": new_hash}}
+            )
         
         user_data = {
             "user_id": str(user["_id"]),
@@ -358,41 +558,91 @@ def login_user():
         if "avatar_url" in user:
             user_data["avatar_url"] = user["avatar_url"]
         
-        client.close()
-        
-        return Response(json.dumps({
+        result = {
             "message": "Login successful",
             "user": user_data
-        }), mimetype="application/json")
+        }
+        if session_tokens.enabled:
+            result["token"] = session_tokens.issue(
+                user["_id"], user["username"], [m["group_name"] for m in user_memberships(db, user["_id"])])
+
+        return json_response(result)
         
+    except PasswordServiceBusy:
+        return password_busy_response()
     except Exception as e:
-        return Response(json.dumps({
+        return json_response({
             "error": str(e)
-        }), status=500, mimetype="application/json")
+        }, status=500)
 
-# Get global leaderboard
+# Revoke every session token issued to the caller (logout everywhere)
+@app.route('/user/logout', methods=['POST'])
+def logout_user():
+    try:
+        claims = session_user({})
+        if claims is None:
+            return invalid_session_response("Missing session token")
+        session_tokens.revoke_user(claims["uid"])
+        return json_response({
+            "message": "Logged out"
+        })
+    except InvalidSession as e:
+        return invalid_session_response(e)
+    except Exception as e:
+        return json_response({
+            "error": str(e)
+        }, status=500)
+
+# Get global leaderboard. ?limit= (default 10) is served from the in-process
+# top-N cache (see leaderboard_cache.py); to go further, pass the previous
+# page's X-Next-Cursor header back as ?cursor=.
 @app.route('/leaderboard', methods=['GET'])
 def get_leaderboard():
     try:
-        # Get limit parameter (default to 10)
-        limit = int(request.args.get('limit', 10))
+        try:
+            limit = int(request.args.get('limit', 10))
+            if limit < 1:
+                raise ValueError("limit must be positive")
+            # Bigger pages than the cache holds are split up with cursors
+            limit = min(limit, top_users.size)
+            after = None
+            cursor = request.args.get('cursor')
+            if cursor:
+                points, user_id = cursor.split(":", 1)
+                after = (float(points), ObjectId(user_id))
+        except Exception as e:
+            return json_response({
+                "error": "Invalid limit or cursor"
+            }, status=400)
         
-        client = MongoClient(config["ATLAS_URI"], tlsCAFile=certifi.where())
-        db = client[config["DB_NAME"]]
+        db = get_db()
         users = db["users"]
         
-        leaderboard_users = list(users.find(
-            {},
-            {"username": 1, "total_points": 1, "avatar_url": 1, "name": 1}
-        ).sort("total_points", -1).limit(limit))
+        cached = top_users.top(users, limit) if after is None else None
+        if cached is not None:
+            leaderboard_users = cached[1]
+            first_rank = 1
+        elif after is None:
+            leaderboard_users = list(users.find({}, LEADERBOARD_FIELDS).sort(LEADERBOARD_ORDER).limit(limit))
+            first_rank = 1
+        else:
+            leaderboard_users = list(users.find(
+                after_filter(*after), LEADERBOARD_FIELDS
+            ).sort(LEADERBOARD_ORDER).limit(limit))
+            # Everyone up to and including the cursor's user is ahead
+            points, user_id = after
+            first_rank = users.count_documents({"$or": [
+                {"total_points": {"$gt": points}},
+                {"total_points": points, "_id": {"$lte": user_id}}
+            ]}) + 1
         
         result = []
         for index, user in enumerate(leaderboard_users):
             user_data = {
-                "user_id": str(user["_id"]),
+                "user_id": user["_id"],
                 "username": user["username"],
                 "total_points": user.get("total_points", 0),
-                "rank": index + 1  # Add 1 because ranks start at 1, not 0
+                "rank": first_rank + index
             }
             
             if "name" in user:
@@ -402,224 +652,480 @@ def get_leaderboard():
                 
             result.append(user_data)
         
-        client.close()
-        
-        return Response(json.dumps({
+        response = json_response({
             "leaderboard": result,
             "total_users": len(result)
-        }), mimetype="application/json")
+        })
+        if len(leaderboard_users) == limit:
+            last = leaderboard_users[-1]
+            response.headers["X-Next-Cursor"] = f"{last.get('total_points', 0)!r}:{last['_id']}"
+        # Polling clients revalidate and get a 304 until the board changes
+        response.headers["Cache-Control"] = "no-cache"
+        response.add_etag()
+        return response.make_conditional(request)
         
     except Exception as e:
-        return Response(json.dumps({
+        return json_response({
             "error": str(e)
-        }), status=500, mimetype="application/json")
-
+        }, status=500)
+
+
+def answer_counted(answer_id, votes=0, appearances=0):
+    """Applies a counter change to the pair pools and drops the author's
+    cached profile (see profile_cache.py)."""
+    author = pair_sampler.record(answer_id, votes=votes, appearances=appearances)
+    if author is not None:
+        profile_cache.invalidate(author)
+
+def shape_pair(question_doc, answers):
+    """Formats sampled answers for the voting screen."""
+    enriched_answers = []
+    for ans in answers:
+        clean_ans = {
+            "_id": ans["_id"],
+            "question_id": ans["question_id"],
+            "user_id": ans["user_id"],
+            "answer_text": ans.get("answer_text", ""),
+            "votes": ans.get("votes", 0),
+            "appearances": ans.get("appearances", 0),
+            "question_text": question_doc["question"],
+            "date": question_doc["date"]
+        }
+        enriched_answers.append(clean_ans)
+    return enriched_answers
 
+# Answers come from an in-memory pool per question (see pair_sampler.py);
+# ?policy= picks how the pair is chosen.
 @app.route('/question/<question_id>/get_pair', methods=['GET'])
 def get_pair(question_id):
     try:
 
         try:
             object_id = ObjectId(question_id)
+        except Exception:
+            return json_response(
+                {"error": "Invalid question_id format"},
+                status=400
+            )
+
+        policy = request.args.get('policy')
+        if policy is not None and policy not in PAIR_POLICIES:
+            return json_response(
+                {"error": f"Unknown policy, expected one of {', '.join(PAIR_POLICIES)}"},
+                status=400
+            )
+
+        sampled = pair_sampler.sample(object_id, policy)
+        if not sampled:
+            return json_response(
+                {"error": "Question not found"},
+                status=404
+            )
+        question_doc, raw_answers = sampled
+
+        return json_response(
+            shape_pair(question_doc, raw_answers)
+        )
+
+    except Exception as e:
+        log.exception("get_pair_failed", question_id=question_id)
+        return json_response(
+            {"error": str(e)},
+            status=500
+        )
+
+MAX_PAIRS_PER_REQUEST = 50
+
+# Returns ?n= distinct pairs at once so the app can queue up several votes.
+# Pairs already sent to the same ?session= are skipped, and so is the
+# caller's own answer when ?user_id= is given.
+@app.route('/question/<question_id>/pairs', methods=['GET'])
+def get_pairs(question_id):
+    try:
+        try:
+            object_id = ObjectId(question_id)
+            n = int(request.args.get('n', 10))
+            user_id = request.args.get('user_id')
+            user_oid = ObjectId(user_id) if user_id else None
         except Exception as e:
-            print("ERROR: question_id is not a valid ObjectId:", e)
-            return Response(
-                json.dumps({"error": "Invalid question_id format"}),
-                status=400,
-                mimetype="application/json"
+            return json_response(
+                {"error": "Invalid question_id, n or user_id"},
+                status=400
             )
 
-        client = MongoClient(config["ATLAS_URI"], tlsCAFile=certifi.where())
-        db = client[config["DB_NAME"]]
-        answers_col = db["answers"]
-        questions_col = db["questions"]
-
-        question_doc = questions_col.find_one({"_id": object_id})
-        if not question_doc:
-            print("DEBUG: No question found with that _id")
-            client.close()
-            return Response(
-                json.dumps({"error": "Question not found"}),
-                status=404,
-                mimetype="application/json"
+        policy = request.args.get('policy')
+        if policy is not None and policy not in PAIR_POLICIES:
+            return json_response(
+                {"error": f"Unknown policy, expected one of {', '.join(PAIR_POLICIES)}"},
+                status=400
             )
-        count = answers_col.count_documents({"question_id": object_id})
-
-        raw_answers = list(answers_col.aggregate([
-            {"$match": {"question_id": object_id}},
-            {"$sample": {"size": 2}}
-        ]))
-        print("DEBUG: raw sampled answers (before cleaning) =", raw_answers)
-
-        enriched_answers = []
-        for ans in raw_answers:
-            clean_ans = {
-                "_id": str(ans["_id"]),
-                "question_id": str(ans["question_id"]),
-                "user_id": str(ans["user_id"]),
-                "answer_text": ans.get("answer_text", ""),
-                "votes": ans.get("votes", 0),
-                "appearances": ans.get("appearances", 0),
-                "question_text": question_doc["question"],
-                "date": question_doc["date"].strftime("%m-%d-%Y")
-            }
-            enriched_answers.append(clean_ans)
 
-        client.close()
-        print("DEBUG: returning enriched answers:", enriched_answers)
+        n = max(1, min(n, MAX_PAIRS_PER_REQUEST))
+        session = request.args.get('session') or user_id
+        taken = pair_prefetcher.take(object_id, n, user_id=user_oid, session=session, policy_name=policy)
+        if not taken:
+            return json_response(
+                {"error": "Question not found"},
+                status=404
+            )
+        question_doc, pairs = taken
 
-        return Response(
-            json.dumps(enriched_answers),
-            mimetype="application/json"
+        return json_response(
+            {"pairs": [shape_pair(question_doc, pair) for pair in pairs]}
         )
 
     except Exception as e:
-        print("ERROR in get_pair:", e)
-        return Response(
-            json.dumps({"error": str(e)}),
-            status=500,
-            mimetype="application/json"
+        return json_response(
+            {"error": str(e)},
+            status=500
         )
 
+def matchup_operations(winner_oid, loser_oid):
+    return [
+        UpdateOne({"_id": winner_oid}, counter_update(votes=1, appearances=1)),
+        UpdateOne({"_id": loser_oid}, counter_update(appearances=1)),
+    ]
+
+# Records one pairwise vote: the winner gets a vote and both answers get an
+# appearance, in a single bulk write. Replaces the increment-vote plus two
+# increment-appearance calls the voting screen used to make.
+@app.route('/question/<question_id>/matchup', methods=['POST'])
+def record_matchup(question_id):
+    try:
+        data = request.json or {}
+        for f in ["winner_id", "loser_id"]:
+            if f not in data:
+                return json_response(
+                    {"error": f"Missing required field: {f}"},
+                    status=400
+                )
+
+        try:
+            question_oid = ObjectId(question_id)
+            winner_oid = ObjectId(data["winner_id"])
+            loser_oid = ObjectId(data["loser_id"])
+        except Exception as e:
+            return json_response(
+                {"error": "Invalid question_id, winner_id or loser_id format"},
+                status=400
+            )
+
+        if winner_oid == loser_oid:
+            return json_response(
+                {"error": "winner_id and loser_id must be different answers"},
+                status=400
+            )
+
+        db = get_db()
+        answers_col = db["answers"]
+
+        # The pooled answers for the question usually settle this without a
+        # query; fall back to counting in case the pool is stale or not loaded
+        valid = pair_sampler.contains(question_oid, [winner_oid, loser_oid]) or answers_col.count_documents({
+            "_id": {"$in": [winner_oid, loser_oid]},
+            "question_id": question_oid
+        }) == 2
+        if not valid:
+            return json_response(
+                {"error": "Both answers must belong to this question"},
+                status=404
+            )
+
+        if counter_buffer is not None:
+            counter_buffer.add(winner_oid, votes=1, appearances=1)
+            counter_buffer.add(loser_oid, appearances=1)
+            status = 202
+        else:
+            answers_col.bulk_write(matchup_operations(winner_oid, loser_oid), ordered=False)
+            status = 200
+        answer_counted(winner_oid, votes=1, appearances=1)
+        answer_counted(loser_oid, appearances=1)
+
+        result = {"message": "Matchup recorded"}
+
+        if data.get("next_pair"):
+            sampled = pair_sampler.sample(question_oid)
+            if sampled:
+                result["next_pair"] = shape_pair(*sampled)
+
+        return json_response(result, status=status)
+
+    except Exception as e:
+        return json_response(
+            {"error": str(e)},
+            status=500
+        )
+
+# Closes out a question day (see daily_scores.py). Meant for the scheduler
+# in vercel.json, which authenticates with "Authorization: Bearer
+# <CRON_SECRET>"; the route is disabled while CRON_SECRET is unset.
+# ?date=MM-DD-YYYY closes a given day instead of yesterday.
+@app.route('/jobs/close-day', methods=['GET', 'POST'])
+def close_question_day():
+    secret = get_setting("CRON_SECRET")
+    if not secret or request.headers.get("Authorization") != f"Bearer {secret}":
+        return json_response({"error": "Unauthorized"}, status=401)
+    try:
+        date = request.args.get('date')
+        date = datetime.strptime(date, "%m-%d-%Y") if date else local_midnight(days_ago=1)
+    except ValueError:
+        return json_response({"error": "Invalid date, expected MM-DD-YYYY"}, status=400)
+
+    try:
+        if counter_buffer is not None:
+            # Score the day with every vote this process has accepted
+            counter_buffer.flush()
+        db = get_db()
+        summary = close_day(db, date)
+        all_points_changed(db["users"])
+        return json_response({
+            "date": date,
+            "question_id": summary["question_id"],
+            "users": summary["users"],
+            "users_credited": summary["users_credited"],
+            "points": summary["points"],
+            "seconds": summary["seconds"]
+        })
+    except LookupError as e:
+        return json_response({"error": str(e)}, status=404)
+    except (ClosedOutOfOrder, ValueError) as e:
+        return json_response({"error": str(e)}, status=409)
+    except Exception as e:
+        return json_response({"error": str(e)}, status=500)
+
+# Buffer depth and flush latency of the write-behind counters
+@app.route('/stats/counters', methods=['GET'])
+def get_counter_stats():
+    if counter_buffer is None:
+        return json_response({"enabled": False})
+    return json_response({"enabled": True, **counter_buffer.stats()})
+
 @app.route('/answer/<answer_id>/increment-appearance', methods=['POST'])
 def increment_appearance_count(answer_id):
     try:
-        client = MongoClient(config["ATLAS_URI"], tlsCAFile=certifi.where())
-        db = client[config["DB_NAME"]]
+        db = get_db()
         answers = db["answers"]
 
         from bson.objectid import ObjectId
         object_id = ObjectId(answer_id)
 
+        if counter_buffer is not None:
+            # Written later in a batch; the answer isn't checked here
+            counter_buffer.add(object_id, appearances=1)
+            answer_counted(object_id, appearances=1)
+            return json_response({"message": "Appearance count increment queued"}, status=202)
+
         result = answers.update_one(
             {"_id": object_id},
-            {"$inc": {"appearances": 1}}
+            counter_update(appearances=1)
         )
 
-        client.close()
-
         if result.matched_count == 0:
-            return Response(json.dumps({"error": "Answer not found"}), status=404, mimetype="application/json")
+            return json_response({"error": "Answer not found"}, status=404)
+        answer_counted(object_id, appearances=1)
         
-        return Response(json.dumps({"message": "Appearance count incremented"}), mimetype="application/json")
+        return json_response({"message": "Appearance count incremented"})
 
     except Exception as e:
-        return Response(json.dumps({"error": str(e)}), status=500, mimetype="application/json")
+        return json_response({"error": str(e)}, status=500)
     
 @app.route('/answer/<answer_id>/increment-vote', methods=['POST'])
 def increment_vote_count(answer_id):
     try:
-        client = MongoClient(config["ATLAS_URI"], tlsCAFile=certifi.where())
-        db = client[config["DB_NAME"]]
+        db = get_db()
         answers = db["answers"]
 
         from bson.objectid import ObjectId
         object_id = ObjectId(answer_id)
 
+        if counter_buffer is not None:
+            # Written later in a batch; the answer isn't checked here
+            counter_buffer.add(object_id, votes=1)
+            answer_counted(object_id, votes=1)
+            return json_response({"message": "Vote count increment queued"}, status=202)
+
         result = answers.update_one(
             {"_id": object_id},
-            {"$inc": {"votes": 1}}
+            counter_update(votes=1)
         )
 
-        client.close()
-
         if result.matched_count == 0:
-            return Response(json.dumps({"error": "Answer not found"}), status=404, mimetype="application/json")
+            return json_response({"error": "Answer not found"}, status=404)
+        answer_counted(object_id, votes=1)
         
-        return Response(json.dumps({"message": "Vote count incremented"}), mimetype="application/json")
+        return json_response({"message": "Vote count incremented"})
 
     except Exception as e:
-        return Response(json.dumps({"error": str(e)}), status=500, mimetype="application/json")
+        return json_response({"error": str(e)}, status=500)
     
+MAX_ANSWER_PAGE_SIZE = 200
+
+def answer_leaderboard_pipeline(match, score="ratio", limit=None, after=None):
+    """Aggregation that ranks a question's answers by a stored score.
+
+    `score` is one of the fields scoring.py keeps on every answer, so the
+    sort is a range scan over the (question_id, score, _id) index. Results
+    are paged with a (score, _id) keyset cursor, and each answer's author is
+    joined in with a single $lookup instead of one users query per answer.
+    """
+    pipeline = [{"$match": match}]
+    if after is not None:
+        value, answer_id = after
+        pipeline.append({"$match": {"$or": [
+            {score: {"$lt": value}},
+            {score: value, "_id": {"$gt": answer_id}},
+        ]}})
+    pipeline.append({"$sort": {score: -1, "_id": 1}})
+    if limit is not None:
+        pipeline.append({"$limit": limit})
+    pipeline += [
+        {"$addFields": {
+            "votes": {"$ifNull": ["$votes", 0]},
+            "appearances": {"$max": ["$appearances", 1]},
+            "score": "$" + score,
+        }},
+        {"$lookup": {
+            "from": "users",
+            "localField": "user_id",
+            "foreignField": "_id",
+            "as": "user",
+        }},
+        {"$unwind": {"path": "$user", "preserveNullAndEmptyArrays": True}},
+        {"$project": {
+            "question_id": 1,
+            "user_id": 1,
+            "answer_text": 1,
+            "votes": 1,
+            "appearances": 1,
+            "score": 1,
+            "user._id": 1,
+            "user.username": 1,
+            "user.name": 1,
+            "user.avatar_url": 1,
+        }},
+    ]
+    return pipeline
+
+def parse_answer_page_args(args):
+    """Reads ?score=, ?limit= and ?cursor= for the answer leaderboards.
+
+    `score` is "ratio" (the default) or "wilson". Without a limit every
+    answer is returned, as before. The cursor is the X-Next-Cursor header of
+    the previous page.
+    """
+    score = args.get('score', 'ratio')
+    if score not in SCORE_FIELDS:
+        raise ValueError(f"score must be one of {', '.join(SCORE_FIELDS)}")
+
+    limit = args.get('limit')
+    if limit is not None:
+        limit = int(limit)
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        limit = min(limit, MAX_ANSWER_PAGE_SIZE)
+
+    after = None
+    cursor = args.get('cursor')
+    if cursor:
+        value, answer_id = cursor.split(":", 1)
+        after = (float(value), ObjectId(answer_id))
+    return score, limit, after
+
+def shape_answer_leaderboard(docs, limit):
+    """Formats answer_leaderboard_pipeline() results.
+
+    Returns (entries, next_cursor); the cursor is None on the last page.
+    """
+    result = []
+    last = None
+    for ans in docs:
+        clean_ans = {
+            "_id": ans["_id"],
+            "question_id": ans["question_id"],
+            "user_id": ans["user_id"],
+            "answer_text": ans.get("answer_text", ""),
+            "votes": ans["votes"],
+            "appearances": ans["appearances"]
+        }
+
+        user_doc = ans.get("user")
+        if user_doc:
+            clean_user = {
+                "_id": user_doc["_id"],
+                "username": user_doc.get("username", ""),
+                "name": user_doc.get("name", ""),
+                "avatar_url": user_doc.get("avatar_url", "")
+            }
+        else:
+            clean_user = {
+                "_id": ans["user_id"],
+                "username": "Unknown",
+                "name": "",
+                "avatar_url": ""
+            }
+
+        result.append({"answer": clean_ans, "user": clean_user})
+        last = ans
+
+    next_cursor = None
+    if limit is not None and last is not None and len(result) == limit:
+        next_cursor = f"{float(last.get('score') or 0)!r}:{last['_id']}"
+    return result, next_cursor
+
+def answer_leaderboard_response(match, score, limit, after):
+    answers_col = get_db()["answers"]
+    docs = answers_col.aggregate(answer_leaderboard_pipeline(match, score, limit, after))
+    result, next_cursor = shape_answer_leaderboard(docs, limit)
+
+    response = json_response(result)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
+
 @app.route('/question/<question_id>/answer_leaderboard', methods=['GET'])
 def get_answer_leaderboard(question_id):
     try:
         try:
             object_id = ObjectId(question_id)
         except Exception as e:
-            return Response(
-                json.dumps({"error": "Invalid question_id format"}),
-                status=400,
-                mimetype="application/json"
+            return json_response(
+                {"error": "Invalid question_id format"},
+                status=400
             )
 
-        client = MongoClient(config["ATLAS_URI"], tlsCAFile=certifi.where())
-        db = client[config["DB_NAME"]]
-        answers_col = db["answers"]
-        users_col = db["users"]
-
-        answer_cursor = answers_col.find({"question_id": object_id})
-
-        enriched = []
-        for ans in answer_cursor:
-            votes = ans.get("votes", 0)
-            appearances = ans.get("appearances", 1)
-            appearances = max(appearances, 1)
-            ratio = votes / appearances
-            clean_ans = {
-                "_id": str(ans["_id"]),
-                "question_id": str(ans["question_id"]),
-                "user_id": str(ans["user_id"]),
-                "answer_text": ans.get("answer_text", ""),
-                "votes": votes,
-                "appearances": appearances
-            }
-
-            user_doc = users_col.find_one({"_id": ObjectId(ans["user_id"])})
-            if user_doc:
-                clean_user = {
-                    "_id": str(user_doc["_id"]),
-                    "username": user_doc.get("username", ""),
-                    "name": user_doc.get("name", ""),
-                    "avatar_url": user_doc.get("avatar_url", "")
-                }
-            else:
-                clean_user = {
-                    "_id": str(ans["user_id"]),
-                    "username": "Unknown",
-                    "name": "",
-                    "avatar_url": ""
-                }
-
-            enriched.append({
-                "answer": clean_ans,
-                "user": clean_user,
-                "ratio": ratio
-            })
-
-        client.close()
-
-        enriched.sort(key=lambda x: x["ratio"], reverse=True)
-
-        result = [{"answer": item["answer"], "user": item["user"]} for item in enriched]
+        try:
+            score, limit, after = parse_answer_page_args(request.args)
+        except Exception as e:
+            return json_response(
+                {"error": "Invalid score, limit or cursor"},
+                status=400
+            )
 
-        return Response(json.dumps(result), mimetype="application/json")
+        return answer_leaderboard_response({"question_id": object_id}, score, limit, after)
 
     except Exception as e:
-        return Response(
-            json.dumps({"error": str(e)}),
-            status=500,
-            mimetype="application/json"
+        return json_response(
+            {"error": str(e)},
+            status=500
         )
 
 @app.route('/answer', methods=['POST'])
 def create_answer():
     try:
         data = request.json or {}
+        session_user(data)
         required_fields = ["user_id", "question_id", "answer_text"]
         for f in required_fields:
             if f not in data:
-                return Response(
-                    json.dumps({"error": f"Missing required field: {f}"}),
-                    status=400,
-                    mimetype="application/json"
+                return json_response(
+                    {"error": f"Missing required field: {f}"},
+                    status=400
                 )
 
         user_oid = ObjectId(data["user_id"])
         question_oid = ObjectId(data["question_id"])
 
-        client = MongoClient(config["ATLAS_URI"], tlsCAFile=certifi.where())
-        db = client[config["DB_NAME"]]
+        db = get_db()
         answers_col = db["answers"]
 
         existing = answers_col.find_one({
@@ -627,11 +1133,9 @@ def create_answer():
             "question_id": question_oid
         })
         if existing:
-            client.close()
-            return Response(
-                json.dumps({"error": "You have already submitted an answer"}),
-                status=409,
-                mimetype="application/json"
+            return json_response(
+                {"error": "You have already submitted an answer"},
+                status=409
             )
 
         new_ans = {
@@ -640,267 +1144,310 @@ def create_answer():
             "answer_text": data["answer_text"],
             "votes": 0,
             "appearances": 0,
+            **score_fields(0, 0),
             "created_at": datetime.utcnow()
         }
-        result = answers_col.insert_one(new_ans)
-        client.close()
+        try:
+            result = answers_col.insert_one(new_ans)
+        except DuplicateKeyError:
+            return json_response(
+                {"error": "You have already submitted an answer"},
+                status=409
+            )
+        pair_sampler.add_answer(new_ans)
+        profile_cache.invalidate(user_oid)
 
-        return Response(
-            json.dumps({
+        return json_response(
+            {
                 "message": "Answer created",
                 "answer_id": str(result.inserted_id)
-            }),
-            status=201,
-            mimetype="application/json"
+            },
+            status=201
         )
 
+    except InvalidSession as e:
+        return invalid_session_response(e)
     except Exception as e:
-        return Response(
-            json.dumps({"error": str(e)}),
-            status=500,
-            mimetype="application/json"
+        return json_response(
+            {"error": str(e)},
+            status=500
         )
 
 @app.route('/user/username/<username>', methods=['GET'])
 def get_user_by_username(username: str):
     try:
-        client = MongoClient(config["ATLAS_URI"], tlsCAFile=certifi.where())
-        db = client[config["DB_NAME"]]
+        db = get_db()
         users = db["users"]
 
-        user = users.find_one({"username": username})
-        client.close()
+        user = users.find_one({"username": username}, USER_SUMMARY_FIELDS)
 
         if not user:
-            return Response(
-                json.dumps({"error": "User not found"}),
-                status=404,
-                mimetype="application/json"
+            return json_response(
+                {"error": "User not found"},
+                status=404
             )
 
-        return Response(
-            json.dumps({
+        return json_response(
+            {
                 "user_id": str(user["_id"]),
                 "username": user["username"],
                 "total_points": user.get("total_points", 0),
                 "name": user.get("name", ""),
                 "avatar_url": user.get("avatar_url", "")
-            }),
-            mimetype="application/json"
+            }
         )
     except Exception as e:
-        return Response(
-            json.dumps({"error": str(e)}),
-            status=500,
-            mimetype="application/json"
+        return json_response(
+            {"error": str(e)},
+            status=500
         )
 
 @app.route('/groups/create-group', methods=['POST'])
 def create_group():
     try:
         group_data = request.json
+        claims = session_user(group_data)
         
         required_fields = ['group_name', 'password', 'username']
         for field in required_fields:
             if field not in group_data:
-                return Response(json.dumps({
+                return json_response({
                     "error": f"Missing required field: {field}"
-                }), status=400, mimetype="application/json")
+                }, status=400)
         
-
-        client = MongoClient(config["ATLAS_URI"], tlsCAFile=certifi.where())
-        db = client[config["DB_NAME"]]
+        db = get_db()
         groups = db["groups"]
         users = db["users"]
         
         existing_group = groups.find_one({"group_name": group_data['group_name']})
         
         if existing_group:
-            client.close()
-            return Response(json.dumps({
+            return json_response({
                 "error": "Group name already in use"
-            }), status=409, mimetype="application/json")
+            }, status=409)
+        
+        # The membership keeps a copy of the member's profile, so the user is
+        # read either way; a session only says which one.
+        if claims:
+            user = users.find_one({"_id": ObjectId(claims["uid"])}, PROFILE_PROJECTION)
+        else:
+            user = users.find_one({"username": group_data['username']}, PROFILE_PROJECTION)
+        if not user:
+            return json_response({
+                "error": "User not found"
+            }, status=404)
+        user_id = user["_id"]
         
-        hashed_password = generate_password_hash(group_data['password'])
+        hashed_password = password_hasher.hash(group_data['password'])
 
+        # Members live in the memberships collection (see memberships.py)
         new_group = {
             "group_name": group_data['group_name'],
             "password": hashed_password,
-            "group_size": 1,
-            "members": [group_data['username']],
+            "group_size": 0,
+            "created_at": datetime.utcnow()
         }
         
-        result = groups.insert_one(new_group)
+        try:
+            result = groups.insert_one(new_group)
+        except DuplicateKeyError:
+            return json_response({
+                "error": "Group name already in use"
+            }, status=409)
         group_id = str(result.inserted_id)
 
-        users.update_one(
-            {"username": group_data['username']},
-            {"$push": {"groups": group_data['group_name']}}
-        )
-
-        client.close()
+        new_group["_id"] = result.inserted_id
+        add_member(db, new_group, user)
+        profile_cache.invalidate(user_id)
         
-        return Response(json.dumps({
+        result = {
             "message": "Group created successfully",
             "group_id": group_id
-        }), status=201, mimetype="application/json")
+        }
+        if claims:
+            # The old token's group list is now out of date
+            result["token"] = session_tokens.issue(
+                claims["uid"], claims["usr"], claims["grp"] + [group_data['group_name']])
 
+        return json_response(result, status=201)
+
+    except InvalidSession as e:
+        return invalid_session_response(e)
+    except PasswordServiceBusy:
+        return password_busy_response()
     except Exception as e:
-        return Response(json.dumps({
+        return json_response({
             "error": str(e)
-        }), status=500, mimetype="application/json")
+        }, status=500)
+
+def group_details(db, user_id):
+    """Name and size of each group a user belongs to, oldest first."""
+    memberships = user_memberships(db, user_id)
+    sizes = {
+        group["_id"]: group.get("group_size", 0)
+        for group in db["groups"].find(
+            {"_id": {"$in": [m["group_id"] for m in memberships]}},
+            {"group_size": 1}
+        )
+    }
+    return [
+        {"group_name": m["group_name"], "group_size": sizes[m["group_id"]]}
+        for m in memberships if m["group_id"] in sizes
+    ]
 
 @app.route('/groups/get-groups/<username>', methods=['GET'])
 def get_user_groups(username):
     try:
-        client = MongoClient(config["ATLAS_URI"], tlsCAFile=certifi.where())
-        db = client[config["DB_NAME"]]
+        db = get_db()
         users = db["users"]
-        groups = db["groups"]
         
-        user = users.find_one({"username": username})
+        user = users.find_one({"username": username}, {"_id": 1})
         
         if not user:
-            client.close()
-            return Response(json.dumps({
+            return json_response({
                 "error": "User not found"
-            }), status=404, mimetype="application/json")
-        
-        user_groups = user.get("groups", [])
-
-        group_details = []
-        for group_name in user_groups:
-            group = groups.find_one({"group_name": group_name})
-            if group:
-                members = group.get("members", [])
-                group_details.append({
-                    "group_name": group_name,
-                    "group_size": len(members)
-                })
-        
-        client.close()
+            }, status=404)
         
-        return Response(json.dumps({
-            "groups": group_details
-        }), mimetype="application/json")
+        return json_response({
+            "groups": group_details(db, user["_id"])
+        })
         
     except Exception as e:
-        return Response(json.dumps({
+        return json_response({
             "error": str(e)
-        }), status=500, mimetype="application/json")
+        }, status=500)
 
 @app.route('/groups/join-group', methods=['POST'])
 def join_group():
     try:
         join_data = request.json
+        claims = session_user(join_data)
 
         required_fields = ['group_name', 'password', 'username']
         for field in required_fields:
             if field not in join_data:
-                return Response(json.dumps({
+                return json_response({
                     "error": f"Missing required field: {field}"
-                }), status=400, mimetype="application/json")
+                }, status=400)
         
-        client = MongoClient(config["ATLAS_URI"], tlsCAFile=certifi.where())
-        db = client[config["DB_NAME"]]
+        db = get_db()
         groups = db["groups"]
         users = db["users"]
         
         group = groups.find_one({"group_name": join_data['group_name']})
         
         if not group:
-            client.close()
-            return Response(json.dumps({
+            return json_response({
                 "error": "Group not found"
-            }), status=404, mimetype="application/json")
+            }, status=404)
         
-        if not check_password_hash(group['password'], join_data['password']):
-            client.close()
-            return Response(json.dumps({
+        matches, new_hash = password_hasher.verify(group['password'], join_data['password'])
+        if not matches:
+            return json_response({
                 "error": "Incorrect password"
-            }), status=401, mimetype="application/json")
-        
-        if join_data['username'] in group['members']:
-            client.close()
-            return Response(json.dumps({
-                "error": "User is already a member of this group"
-            }), status=409, mimetype="application/json")
+            }, status=401)
+        if new_hash:
+            groups.update_one(
+                {"_id": group["_id"], "password": group["password"]},
+                {"$set": {"password": new_hash}}
+            )
         
-        user = users.find_one({"username": join_data['username']})
+        # The membership keeps a copy of the member's profile, so the user is
+        # read either way; a session only says which one.
+        if claims:
+            user = users.find_one({"_id": ObjectId(claims["uid"])}, PROFILE_PROJECTION)
+        else:
+            user = users.find_one({"username": join_data['username']}, PROFILE_PROJECTION)
         if not user:
-            client.close()
-            return Response(json.dumps({
+            return json_response({
                 "error": "User not found"
-            }), status=404, mimetype="application/json")
-        
-        groups.update_one(
-            {"group_name": join_data['group_name']},
-            {"$push": {"members": join_data['username']}}
-        )
+            }, status=404)
+        user_id = user["_id"]
         
-        users.update_one(
-            {"username": join_data['username']},
-            {"$push": {"groups": join_data['group_name']}}
-        )
-        
-        client.close()
+        if not add_member(db, group, user):
+            return json_response({
+                "error": "User is already a member of this group"
+            }, status=409)
+        profile_cache.invalidate(user_id)
         
-        return Response(json.dumps({
+        result = {
             "message": "Successfully joined group"
-        }), mimetype="application/json")
+        }
+        if claims:
+            result["token"] = session_tokens.issue(
+                claims["uid"], claims["usr"], claims["grp"] + [join_data['group_name']])
+
+        return json_response(result)
         
+    except InvalidSession as e:
+        return invalid_session_response(e)
+    except PasswordServiceBusy:
+        return password_busy_response()
     except Exception as e:
-        return Response(json.dumps({
+        return json_response({
             "error": str(e)
-        }), status=500, mimetype="application/json")
+        }, status=500)
 
+# Group leaderboard, read from the members' materialized points (see
+# memberships.py). Without parameters it lists every member. ?limit=&offset=
+# page through it, and ?around=<user_id> returns the `limit` members around
+# that one.
 @app.route('/groups/leaderboard/<group_name>', methods=['GET'])
 def get_group_leaderboard(group_name):
     try:
-        client = MongoClient(config["ATLAS_URI"], tlsCAFile=certifi.where())
-        db = client[config["DB_NAME"]]
+        try:
+            limit = request.args.get('limit')
+            limit = int(limit) if limit is not None else None
+            offset = int(request.args.get('offset', 0))
+            around = request.args.get('around')
+            around = ObjectId(around) if around else None
+            if offset < 0 or (limit is not None and limit < 1):
+                raise ValueError()
+        except Exception as e:
+            return json_response({
+                "error": "Invalid limit, offset or around"
+            }, status=400)
+
+        db = get_db()
         groups = db["groups"]
-        users = db["users"]
         
-        group = groups.find_one({"group_name": group_name})
+        group = groups.find_one({"group_name": group_name}, {"group_size": 1})
         if not group:
-            client.close()
-            return Response(json.dumps({
+            return json_response({
                 "error": "Group not found"
-            }), status=404, mimetype="application/json")
-        
-        group_members = group.get("members", [])
-        
-        user_cursor = users.find({"username": {"$in": group_members}})
-        
+            }, status=404)
+
+        if around is not None:
+            limit = limit or 10
+            place = position(db, group["_id"], around)
+            if place is None:
+                return json_response({
+                    "error": "User is not a member of this group"
+                }, status=404)
+            offset = max(place - limit // 2, 0)
+
         enriched = []
-        for user in user_cursor:
-            clean_user = {
-                "_id": str(user["_id"]),
-                "username": user.get("username", ""),
-                "name": user.get("name", ""),
-                "avatar_url": user.get("avatar_url", ""),
-                "total_points": user.get("total_points", 0)
-            }
-            enriched.append(clean_user)
-        
-        client.close()
-        
-        enriched.sort(key=lambda x: x["total_points"], reverse=True)
-        
-        for index, user in enumerate(enriched):
-            user["rank"] = index + 1
+        for index, member in enumerate(leaderboard(db, group["_id"], offset, limit)):
+            enriched.append({
+                "_id": member["user_id"],
+                "username": member.get("username", ""),
+                "name": member.get("name", ""),
+                "avatar_url": member.get("avatar_url", ""),
+                "total_points": member.get("total_points", 0),
+                "rank": offset + index + 1
+            })
         
-        return Response(json.dumps({
+        return json_response({
             "leaderboard": enriched,
-            "total_users": len(enriched),
+            "total_users": group.get("group_size", 0),
+            "offset": offset,
             "group_name": group_name
-        }), mimetype="application/json")
+        })
         
     except Exception as e:
-        return Response(json.dumps({
+        return json_response({
             "error": str(e)
-        }), status=500, mimetype="application/json")
+        }, status=500)
 
 @app.route('/groups/<group_name>/answer-leaderboard/<question_id>', methods=['GET'])
 def get_group_answer_leaderboard(group_name, question_id):
@@ -908,74 +1455,41 @@ def get_group_answer_leaderboard(group_name, question_id):
         try:
             object_id = ObjectId(question_id)
         except Exception as e:
-            return Response(
-                json.dumps({"error": "Invalid question_id format"}),
-                status=400,
-                mimetype="application/json"
+            return json_response(
+                {"error": "Invalid question_id format"},
+                status=400
+            )
+
+        try:
+            score, limit, after = parse_answer_page_args(request.args)
+        except Exception as e:
+            return json_response(
+                {"error": "Invalid score, limit or cursor"},
+                status=400
             )
         
-        client = MongoClient(config["ATLAS_URI"], tlsCAFile=certifi.where())
-        db = client[config["DB_NAME"]]
+        db = get_db()
         groups = db["groups"]
-        answers_col = db["answers"]
-        users_col = db["users"]
 
-        group = groups.find_one({"group_name": group_name})
+        group = groups.find_one({"group_name": group_name}, {"_id": 1})
         if not group:
-            client.close()
-            return Response(json.dumps({
+            return json_response({
                 "error": "Group not found"
-            }), status=404, mimetype="application/json")
-        
-        group_members = group.get("members", [])
-
-        answer_cursor = answers_col.find({"question_id": object_id})
-
-        enriched = []
-        for ans in answer_cursor:
-            user_doc = users_col.find_one({"_id": ObjectId(ans["user_id"])})
-            
-            if user_doc and user_doc.get("username") in group_members:
-                votes = ans.get("votes", 0)
-                appearances = ans.get("appearances", 1)
-                appearances = max(appearances, 1)
-                ratio = votes / appearances
-
-                clean_ans = {
-                    "_id": str(ans["_id"]),
-                    "question_id": str(ans["question_id"]),
-                    "user_id": str(ans["user_id"]),
-                    "answer_text": ans.get("answer_text", ""),
-                    "votes": votes,
-                    "appearances": appearances
-                }
-
-                clean_user = {
-                    "_id": str(user_doc["_id"]),
-                    "username": user_doc.get("username", ""),
-                    "name": user_doc.get("name", ""),
-                    "avatar_url": user_doc.get("avatar_url", "")
-                }
-
-                enriched.append({
-                    "answer": clean_ans,
-                    "user": clean_user,
-                    "ratio": ratio
-                })
-
-        client.close()
-
-        enriched.sort(key=lambda x: x["ratio"], reverse=True)
-        
-        result = [{"answer": item["answer"], "user": item["user"]} for item in enriched]
-
-        return Response(json.dumps(result), mimetype="application/json")
+            }, status=404)
+
+        # Only members' answers enter the pipeline, so the group filter is
+        # applied by MongoDB rather than here
+        return answer_leaderboard_response(
+            {"question_id": object_id, "user_id": {"$in": member_ids(db, group["_id"])}},
+            score,
+            limit,
+            after
+        )
 
     except Exception as e:
-        return Response(
-            json.dumps({"error": str(e)}),
-            status=500,
-            mimetype="application/json"
+        return json_response(
+            {"error": str(e)},
+            status=500
         )
     
 if __name__ == '__main__':
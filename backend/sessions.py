@@ -0,0 +1,160 @@
+# Signed session tokens.
+#
+# login_user issues a token carrying the user's id, username and groups,
+# signed with HMAC-SHA256 under SESSION_SECRET:
+#
+#   base64url(json claims) "." base64url(signature)
+#
+# Clients send it back as "Authorization: Bearer <token>", and write routes
+# take the caller's identity from it instead of looking the user up. Checking
+# a token is a signature check and a dict lookup, and recently verified
+# tokens are cached so repeat calls skip even that.
+#
+# Forced logout works through a revocation list: revoking a user invalidates
+# every token issued to them before that moment. Revocations are stored in
+# the revoked_sessions collection and each process reloads them every
+# SESSION_REVOCATION_TTL seconds, so a revocation made elsewhere applies
+# within that window (immediately in the revoking process).
+#
+# Without SESSION_SECRET no tokens are issued and routes keep taking the
+# user from the request body.
+
+import base64
+from collections import OrderedDict
+from datetime import datetime, timezone
+import hashlib
+import hmac
+import json
+import threading
+import time
+
+from db import get_db
+from settings import get_setting
+from snapshots import Snapshot
+
+
+class InvalidSession(Exception):
+    pass
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+class RevocationList(Snapshot):
+    """user_id (str) -> epoch ms before which that user's tokens are void."""
+
+    def __init__(self, ttl=30):
+        super().__init__(ttl)
+        self._revoked = {}
+
+    def load(self):
+        revoked = {
+            str(doc["_id"]): int(doc["revoked_at"].replace(tzinfo=timezone.utc).timestamp() * 1000)
+            for doc in get_db()["revoked_sessions"].find({})
+        }
+        with self._lock:
+            # Keep anything revoked locally since the query started.
+            for user_id, at in self._revoked.items():
+                if at > revoked.get(user_id, 0):
+                    revoked[user_id] = at
+            self._revoked = revoked
+            self._loaded()
+
+    def revoked_before(self, user_id):
+        self._ensure_fresh()
+        return self._revoked.get(user_id, 0)
+
+    def revoke(self, user_id):
+        at = _now_ms()
+        get_db()["revoked_sessions"].update_one(
+            {"_id": user_id},
+            {"$max": {"revoked_at": datetime.fromtimestamp(at / 1000, timezone.utc)}},
+            upsert=True
+        )
+        with self._lock:
+            self._revoked[user_id] = max(at, self._revoked.get(user_id, 0))
+
+
+class SessionTokens:
+    def __init__(self, secret, ttl=7 * 24 * 3600, revocations=None, cache_size=10000):
+        self.secret = secret.encode("utf-8") if secret else None
+        self.ttl = ttl
+        self.revocations = revocations
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.secret is not None
+
+    def _sign(self, payload):
+        return hmac.new(self.secret, payload.encode("ascii"), hashlib.sha256).digest()
+
+    def issue(self, user_id, username, groups):
+        """A token for this user, or None if sessions aren't configured."""
+        if not self.enabled:
+            return None
+        now = _now_ms()
+        claims = {
+            "uid": str(user_id),
+            "usr": username,
+            "grp": list(groups),
+            "iat": now,
+            "exp": now + int(self.ttl * 1000),
+        }
+        payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+        return payload + "." + _b64encode(self._sign(payload))
+
+    def _decode(self, token):
+        payload, _, signature = token.partition(".")
+        try:
+            valid = hmac.compare_digest(self._sign(payload), _b64decode(signature))
+        except (ValueError, UnicodeEncodeError):
+            valid = False
+        if not valid:
+            raise InvalidSession("Invalid session token")
+        return json.loads(_b64decode(payload))
+
+    def verify(self, token):
+        """The token's claims. Raises InvalidSession if it is forged,
+        expired or revoked."""
+        if not self.enabled:
+            raise InvalidSession("Sessions are not enabled")
+        with self._lock:
+            claims = self._cache.get(token)
+            if claims is not None:
+                self._cache.move_to_end(token)
+        if claims is None:
+            claims = self._decode(token)
+            with self._lock:
+                self._cache[token] = claims
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        if claims["exp"] <= _now_ms():
+            raise InvalidSession("Session expired")
+        if self.revocations is not None and claims["iat"] < self.revocations.revoked_before(claims["uid"]):
+            raise InvalidSession("Session revoked")
+        return claims
+
+    def revoke_user(self, user_id):
+        """Log a user out everywhere."""
+        self.revocations.revoke(str(user_id))
+
+
+session_tokens = SessionTokens(
+    get_setting("SESSION_SECRET"),
+    ttl=get_setting("SESSION_TTL", 7 * 24 * 3600, float),
+    revocations=RevocationList(ttl=get_setting("SESSION_REVOCATION_TTL", 30, float)),
+    cache_size=get_setting("SESSION_CACHE_SIZE", 10000, int),
+)
@@ -0,0 +1,22 @@
+from dotenv import dotenv_values
+import os
+
+# Values from ./.env take precedence; anything missing there falls back to the
+# process environment (which is how Vercel hands us configuration).
+config = dotenv_values("./.env")
+
+
+def get_setting(name, default=None, cast=str):
+    value = config.get(name)
+    if value is None:
+        value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    return cast(value)
+
+
+def get_flag(name, default=False):
+    value = get_setting(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
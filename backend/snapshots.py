@@ -0,0 +1,54 @@
+# In-process copies of database state that are rebuilt periodically.
+#
+# The rank index (ranking.py), the leaderboard cache (leaderboard_cache.py)
+# and the session revocation list (sessions.py) each keep a snapshot that
+# only sees the changes their own process makes. Snapshot holds the shared
+# part: the first use loads synchronously, and once `ttl` seconds have
+# passed the current copy keeps being served while one background thread
+# builds the next. invalidate() makes the next use start that reload.
+
+import threading
+import time
+
+
+class Snapshot:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._loaded_at = None
+        self._loading = False
+        self._lock = threading.Lock()
+
+    def load(self, *args):
+        """Query the database and install the result; must call _loaded()
+        while holding self._lock."""
+        raise NotImplementedError
+
+    def _loaded(self):
+        self._loaded_at = time.monotonic()
+        self._loading = False
+
+    def _ensure_fresh(self, *args):
+        if self._loaded_at is None:
+            self.load(*args)
+            return
+        if time.monotonic() - self._loaded_at < self.ttl or self._loading:
+            return
+        # Serve the current snapshot while a fresh one is built.
+        with self._lock:
+            if self._loading:
+                return
+            self._loading = True
+        threading.Thread(target=self._reload, args=args, daemon=True).start()
+
+    def _reload(self, *args):
+        try:
+            self.load(*args)
+        except Exception:
+            with self._lock:
+                self._loading = False
+
+    def invalidate(self):
+        """Reload in the background on the next use."""
+        with self._lock:
+            if self._loaded_at is not None:
+                self._loaded_at = 0
@@ -0,0 +1,21 @@
+import argparse
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(BACKEND_DIR, "benchmarks"))
+sys.path.insert(0, BACKEND_DIR)
+
+
+@pytest.fixture
+def database():
+    """An empty in-memory stand-in for MongoDB (see benchmarks/common.py)."""
+    pytest.importorskip("mongomock")
+    from common import BENCH_DB_NAME, install_standin
+    factory = install_standin(argparse.Namespace(mongo_uri=None, handshake_ms=0.0))
+    database = factory()[BENCH_DB_NAME]
+    yield database
+    for name in database.list_collection_names():
+        database.drop_collection(name)
@@ -0,0 +1,42 @@
+import asyncio
+
+from bson.objectid import ObjectId
+import httpx
+
+import asgi
+from question_cache import local_midnight, question_cache
+
+
+def get(path):
+    async def request():
+        transport = httpx.ASGITransport(app=asgi.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get(path)
+    return asyncio.run(request())
+
+
+def cache_question(days_ago):
+    # Served from the cache, so no database is needed
+    date = local_midnight(days_ago=days_ago)
+    today, _, missing = question_cache.lookup([date])
+    question_cache.store(today, missing, [{"_id": ObjectId(), "question": "Q", "date": date}])
+    return date
+
+
+def test_yesterday_is_cached_until_midnight():
+    question_cache.clear()
+    cache_question(1)
+    response = get("/yesterday/get-question/")
+    assert response.status_code == 200
+    cache_control = response.headers["cache-control"]
+    assert "immutable" not in cache_control
+    max_age = int(cache_control.rsplit("max-age=", 1)[1])
+    assert max_age <= 24 * 60 * 60
+
+
+def test_past_date_range_is_immutable():
+    question_cache.clear()
+    date = cache_question(1).strftime("%m-%d-%Y")
+    response = get(f"/questions?from={date}&to={date}")
+    assert response.status_code == 200
+    assert "immutable" in response.headers["cache-control"]
@@ -0,0 +1,30 @@
+from question_cache import local_midnight
+import ranking
+import server
+import settings
+
+
+def test_rank_index_follows_close_day(database, monkeypatch):
+    monkeypatch.setattr(ranking, "rank_index", ranking.RankIndex(ttl=1e9))
+    monkeypatch.setitem(settings.config, "CRON_SECRET", "secret")
+    yesterday = local_midnight(days_ago=1)
+    question_id = database["questions"].insert_one({"question": "Q", "date": yesterday}).inserted_id
+    users = database["users"].insert_many([
+        {"username": name, "total_points": 0} for name in ["a", "b", "c"]
+    ]).inserted_ids
+    database["answers"].insert_many([
+        {"question_id": question_id, "user_id": user_id, "answer_text": "A",
+         "votes": votes, "appearances": 20, **server.score_fields(votes, 20)}
+        for user_id, votes in zip(users, [20, 20, 0])
+    ])
+    client = server.app.test_client()
+
+    # Everybody is tied before the day is closed, which loads the index
+    assert client.get(f"/user/{users[2]}/ranking").get_json()["rank"] == 1
+
+    response = client.post("/jobs/close-day", headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 200
+    assert response.get_json()["users_credited"] == 2
+
+    ranks = [client.get(f"/user/{user_id}/ranking").get_json()["rank"] for user_id in users]
+    assert ranks == [1, 1, 3]